@@ -35,6 +35,9 @@ MODES = [dwi.util.ImageMode(_) for _ in words(get_var('mode', DEFAULT_MODE))]
 # Sample lists (train, test, etc).
 SAMPLELISTS = words(get_var('samplelist', 'all'))
 
+# Calculate merged textures in a single pass instead of merging method files.
+FUSED_TEXTURES = bool(int(get_var('fused', '0')))
+
 
 def texture_params():
     masktypes = ['lesion']
@@ -200,6 +203,22 @@ def get_task_select_roi_manual(mode, case, scan, masktype):
         }
 
 
+def get_task_find_roi(mode, case, scan, algparams_list):
+    """Find automatic ROIs of all parameter combinations in one pass."""
+    pmap = pmap_path(mode, case, scan)
+    prostate = mask_path(mode, 'prostate', case, scan)
+    masks = [mask_path(mode, 'auto', case, scan, algparams=x) for x in
+             algparams_list]
+    cmd = dwi.shell.find_roi(pmap, prostate, algparams_list, masks)
+    return {
+        'name': name(mode, case, scan),
+        'actions': folders(*masks) + [cmd],
+        'file_dep': [pmap, prostate],
+        'targets': masks,
+        'clean': True,
+        }
+
+
 def get_task_select_roi_auto(mode, case, scan, algparams):
     """Select ROIs from the pmap DICOMs based on masks."""
     ap_ = '_'.join(algparams)
@@ -234,6 +253,15 @@ def task_select_roi_manual():
                 yield get_task_select_roi_manual(mode, c, s, mt)
 
 
+def task_find_roi():
+    """Find automatic ROIs."""
+    for mode, sl in product(MODES, SAMPLELISTS):
+        if mode[0] == 'DWI':
+            algparams_list = list(find_roi_param_combinations(mode, sl))
+            for c, s in cases_scans(mode, sl):
+                yield get_task_find_roi(mode, c, s, algparams_list)
+
+
 def task_select_roi_auto():
     """Select automatic ROIs from the pmap DICOMs."""
     for mode, sl in product(MODES, SAMPLELISTS):
@@ -298,11 +326,43 @@ def task_texture():
                                        'all')
 
 
+def get_task_texture_fused(mode, masktype, case, scan, lesion, slices,
+                           portion):
+    """Generate merged texture features of all methods in one pass."""
+    inpath = pmap_path(mode, case, scan)
+    deps = [inpath]
+    mask = mask_path(mode, masktype, case, scan, lesion=lesion)
+    if mask is not None:
+        deps.append(mask)
+    outfile = texture_path(mode, case, scan, lesion, masktype+'_merged',
+                           slices, portion, None, None)
+    methods, winsizes = [], []
+    for mth, ws in texture_methods_winsizes(mode, masktype):
+        if mth not in methods:
+            methods.append(mth)
+        if ws not in winsizes + ['all', 'mbb']:
+            winsizes.append(ws)
+    winsizes = winsizes or ['all']  # Only methods without window.
+    cmd = dwi.shell.get_texture(mode, inpath, methods, winsizes, slices,
+                                portion, outfile, 'mean', mask=mask)
+    return {
+        'name': name(mode, case, scan, lesion, masktype, slices, portion),
+        'actions': folders(outfile) + [cmd],
+        'file_dep': deps,
+        'targets': [outfile],
+        'clean': True,
+        }
+
+
 def task_merge_textures():
     """Merge texture methods into singe file per case/scan/lesion."""
     for mode, sl in product(MODES, SAMPLELISTS):
         for mt, slices, portion in texture_params():
             for c, s, l in lesions(mode, sl):
+                if FUSED_TEXTURES:
+                    yield get_task_texture_fused(mode, mt, c, s, l, slices,
+                                                 portion)
+                    continue
                 infiles = [texture_path(mode, c, s, l, mt, slices,
                                         portion, mth, ws) for mth, ws in
                            texture_methods_winsizes(mode, mt)]
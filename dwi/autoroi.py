@@ -42,14 +42,69 @@ def get_score_param(img, param):
     return r
 
 
-def get_roi_scores(img, d, params):
-    """Return array of all scores for each possible ROI of given dimension."""
-    shape = [img.shape[i]-d[i]+1 for i in range(3)] + [len(params)]
-    scores = np.empty(shape)
-    for z, y, x, i in np.ndindex(scores.shape):
-        roi = img[z:z+d[0], y:y+d[1], x:x+d[2], i]
-        scores[z, y, x, i] = get_score_param(roi, params[i])
-    return scores
+def sum_table(a, dtype=np.float64):
+    """Return the 3D summed-area table of an array, padded with zeros at the
+    beginning of each axis, so that table[z, y, x] is the sum of a[:z, :y,
+    :x].
+    """
+    table = np.zeros(tuple(n+1 for n in a.shape), dtype=dtype)
+    table[1:, 1:, 1:] = a.cumsum(0, dtype=dtype).cumsum(1).cumsum(2)
+    return table
+
+
+def box_sums(table, d):
+    """Return the sums of all boxes of dimension d from a summed-area table,
+    indexed by box corner.
+    """
+    z, y, x = d
+    t = table
+    return (t[z:, y:, x:] - t[:-z, y:, x:] - t[z:, :-y, x:] - t[z:, y:, :-x] +
+            t[:-z, :-y, x:] + t[:-z, y:, :-x] + t[z:, :-y, :-x] -
+            t[:-z, :-y, :-x])
+
+
+def get_score_tables(img):
+    """Return summed-area tables of each parameter for ROI scoring: a table of
+    values and an exact integer table of nonzero counts.
+    """
+    return [(sum_table(img[..., i]), sum_table(img[..., i] != 0, np.int64))
+            for i in range(img.shape[-1])]
+
+
+def get_box_scores(tables, d, param):
+    """Return parameter scores of all ROIs of given dimension, from the
+    summed-area tables of the parameter. Same rules as get_score_param().
+    """
+    sums, counts = (box_sums(x, d) for x in tables)
+    size = np.prod(d)
+    mean = sums / size
+    if param.startswith('ADC'):
+        # A box of zeros may not sum to exact zero, so check the count.
+        positive = (counts > 0) & (mean > 0)
+        r = np.where(positive, 1 / np.where(positive, mean, 1), 0)
+    elif param.startswith('K'):
+        r = mean / 1000
+    elif param.startswith('score'):
+        r = mean
+    elif param == 'prostate_mask':
+        r = np.where(sums / size > 0.20, 1, -1e20)
+    elif param == 'prostate_mask_strict':
+        r = np.where(counts == size, 1, -1e20)
+    else:
+        r = np.zeros_like(mean)  # Unknown parameter
+    return r
+
+
+def get_roi_scores(img, d, params, tables=None):
+    """Return array of all scores for each possible ROI of given dimension.
+
+    The scores are calculated from summed-area tables, which can be given
+    precalculated by get_score_tables() when scoring several dimensions.
+    """
+    if tables is None:
+        tables = get_score_tables(img)
+    return np.stack([get_box_scores(t, d, p) for t, p in zip(tables, params)],
+                    axis=-1)
 
 
 def scale_scores(scores):
@@ -63,18 +118,56 @@ def scale_scores(scores):
     # scores[...] = a
 
 
-def get_scoremap(img, d, params, n_rois):
-    """Return array like original image, with scores of n_rois best ROI's."""
-    scores = get_roi_scores(img, d, params)
+def get_size_scores(img, d, params, tables=None):
+    """Return the summed, scaled scores of all ROIs of given dimension."""
+    scores = get_roi_scores(img, d, params, tables=tables)
     for i in range(len(params)):
         scale_scores(scores[..., i])
-    scores = np.sum(scores, axis=-1)  # Sum scores parameter-wise.
-    indices = scores.ravel().argsort()  # Sort ROI's by score.
-    indices = indices[-n_rois:]  # Select best ones.
-    indices = [np.unravel_index(i, scores.shape) for i in indices]
+    return np.sum(scores, axis=-1)  # Sum scores parameter-wise.
+
+
+def best_indices(scores, n):
+    """Return the flat indices of the n best scores in ascending order of
+    score, like scores.ravel().argsort()[-n:], but with a partial sort.
+    """
+    a = scores.ravel()
+    if n >= a.size:
+        return a.argsort()
+    part = np.argpartition(a, -n)[-n:]
+    if np.count_nonzero(a >= a[part].min()) > n:
+        # Ties at the cut: select the same ones as a full sort.
+        return a.argsort()[-n:]
+    return part[a[part].argsort()]
+
+
+def add_boxes(scoremap, d, indices, scores):
+    """Add the score of each ROI at given flat indices into a scoremap.
+
+    The scores are scattered to their box corners and spread over the box
+    dimension by separable sums of shifted slices, so the cost does not depend
+    on the number of boxes. There is no subtraction, which would lose the
+    smaller scores next to the huge negative ones of banned areas.
+    """
+    a = np.zeros(scores.shape)
+    a.flat[indices] = scores.flat[indices]
+    for axis, w in enumerate(d):
+        shape = list(a.shape)
+        shape[axis] += w - 1
+        spread = np.zeros(shape)
+        for i in range(w):
+            slices = [slice(None)] * a.ndim
+            slices[axis] = slice(i, i + a.shape[axis])
+            spread[tuple(slices)] += a
+        a = spread
+    scoremap[..., 0] += a
+
+
+def get_scoremap(img, d, params, n_rois):
+    """Return array like original image, with scores of n_rois best ROI's."""
+    scores = get_size_scores(img, d, params)
+    indices = best_indices(scores, n_rois)  # Select best ones.
     scoremap = np.zeros(img.shape[0:3] + (1,))
-    for z, y, x in indices:
-        scoremap[z:z+d[0], y:y+d[1], x:x+d[2], 0] += scores[z, y, x]
+    add_boxes(scoremap, d, indices, scores)
     return scoremap
 
 
@@ -86,22 +179,21 @@ def add_mask(img, mask):
     return img
 
 
-def find_roi(img, roidim, params, prostate_mask=None, depthmin=2, depthmax=3,
-             sidemin=10, sidemax=10, n_rois=500):
+def get_dims(depthmin, depthmax, sidemin, sidemax):
+    """Return the ROI dimensions to draw score map with."""
     assert depthmin <= depthmax
     assert sidemin <= sidemax
-
-    # Draw score map.
-    dims = [(j, i, i) for i in range(sidemin, sidemax+1)
+    return [(j, i, i) for i in range(sidemin, sidemax+1)
             for j in range(depthmin, depthmax+1)]
-    if prostate_mask:
-        img = add_mask(img, prostate_mask)
-        params = params + ['prostate_mask']
-    print(img.shape, params)
-    scoremaps = [get_scoremap(img, d, params, n_rois) for d in dims]
-    scoremap = sum(scoremaps)
 
-    # Find optimal ROI.
+
+def locate_roi(scoremap, roidim, prostate_mask=None):
+    """Find optimal ROI in score map.
+
+    The ROI scores are summed from summed-area tables, and rounded
+    differently than when summed box by box. Thus ROIs tied exactly, or
+    within rounding, may be selected differently.
+    """
     scoremap_params = ['score']
     if prostate_mask:
         scoremap = add_mask(scoremap, prostate_mask)
@@ -115,3 +207,44 @@ def find_roi(img, roidim, params, prostate_mask=None, depthmin=2, depthmax=3,
 
     d = dict(scoremap=scoremap[..., 0], roi_corner=corner, roi_coords=coords)
     return d
+
+
+def find_roi(img, roidim, params, prostate_mask=None, depthmin=2, depthmax=3,
+             sidemin=10, sidemax=10, n_rois=500):
+    combination = (depthmin, depthmax, sidemin, sidemax, n_rois)
+    _, d = next(find_roi_sweep(img, roidim, params, [combination],
+                               prostate_mask=prostate_mask))
+    return d
+
+
+def find_roi_sweep(img, roidim, params, combinations, prostate_mask=None):
+    """Find ROIs with many parameter combinations of find_roi() at once.
+
+    Each combination is a tuple (depthmin, depthmax, sidemin, sidemax,
+    n_rois). The ROI scores of each distinct dimension are calculated only
+    once, and sorted only as far as the greatest n_rois needs; the smaller
+    ones take the best of that list, which may select differently among ROIs
+    tied in score. Yields each combination with its result, like find_roi()
+    returns, grouped by n_rois.
+    """
+    combinations = [tuple(x) for x in combinations]
+    dims = sorted(set(d for c in combinations for d in get_dims(*c[:4])))
+    n_max = max(c[4] for c in combinations)
+    if prostate_mask:
+        img = add_mask(img, prostate_mask)
+        params = params + ['prostate_mask']
+    tables = get_score_tables(img)
+    best = {}
+    for d in dims:
+        scores = get_size_scores(img, d, params, tables=tables)
+        best[d] = scores, best_indices(scores, n_max)
+    for n_rois in sorted(set(c[4] for c in combinations)):
+        group = [c for c in combinations if c[4] == n_rois]
+        scoremaps = {}
+        for d in set(d for c in group for d in get_dims(*c[:4])):
+            scores, indices = best[d]
+            scoremaps[d] = np.zeros(img.shape[0:3] + (1,))
+            add_boxes(scoremaps[d], d, indices[-n_rois:], scores)
+        for c in group:
+            scoremap = sum(scoremaps[d] for d in get_dims(*c[:4]))
+            yield c, locate_roi(scoremap, roidim, prostate_mask)
@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import, division, print_function
 import argparse
+from contextlib import contextmanager
 import logging
 
 from dwi.files import Path
@@ -31,7 +32,12 @@ rcParamsDefault = {
     'texture.winsizes.small': (3, 16, 2),  # DWI.
     'texture.avg': False,  # Boolean: average result texture map?
     'texture.path': None,  # Write result directly to disk, if string.
+    'texture.sparse': False,  # Boolean: store selected voxels only?
+    'texture.compression': 'lzf',  # Compression on disk (gzip, lzf, none).
     'texture.dtype': 'float32',  # Output texture map type.
+    'texture.jobs': 1,  # Number of processes for texture maps.
+    'texture.cache.dir': None,  # Result cache directory, if string.
+    'texture.cache.size': 2**30,  # Maximum cache size in bytes.
     'texture.glcm.names': ('contrast', 'dissimilarity', 'homogeneity',
                            'energy', 'correlation', 'ASM'),
     'texture.glcm.distances': (1, 2, 3, 4),  # GLCM pixel distances.
@@ -43,7 +49,7 @@ rcParamsDefault = {
     'texture.lbp.neighbours': 8,  # Number of neighbours.
     'texture.zernike.degree': 8,  # Maximum degree.
     'texture.haar.levels': 4,  # Numer of levels.
-    'texture.hog.orientations': 1,  # Numer of orientations.
+    'texture.hog.orientations': 1,  # Numer of orientations (or sequence).
     }
 rcParams = dict(rcParamsDefault)
 
@@ -53,6 +59,17 @@ def rcdefaults():
     rcParams.update(rcParamsDefault)
 
 
+@contextmanager
+def rc_context(params):
+    """Context with rc params temporarily updated."""
+    orig = dict(rcParams)
+    rcParams.update(params)
+    try:
+        yield
+    finally:
+        rcParams.update(orig)
+
+
 def get_config_paths():
     """Return existing default configuration files."""
     dirnames = ['/etc/dwilib', '~/.config/dwilib', '.']
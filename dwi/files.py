@@ -19,6 +19,7 @@ except ImportError:
 import dwi.asciifile
 import dwi.dicomfile
 import dwi.hdf5
+import dwi.sparse
 from dwi.patient import Patient, Lesion
 
 log = logging.getLogger(__name__)
@@ -185,8 +186,11 @@ def guess_format(path):
 
 
 def write_pmap(filename, pmap, attrs, fmt=None):
-    """Write parametric map file either as HDF5 or ASCII."""
-    pmap = np.asanyarray(pmap)
+    """Write parametric map file either as HDF5 or ASCII. A sparse map (see
+    dwi.sparse) is written as such into HDF5, or expanded into ASCII.
+    """
+    if not isinstance(pmap, dwi.sparse.SparseMap):
+        pmap = np.asanyarray(pmap)
     if pmap.ndim < 2:
         raise Exception('Not enough dimensions: {}'.format(pmap.shape))
     if 'parameters' not in attrs:
@@ -204,6 +208,7 @@ def write_pmap(filename, pmap, attrs, fmt=None):
     if fmt == 'h5':
         dwi.hdf5.write_hdf5(filename, pmap, attrs)
     elif fmt == 'txt':
+        pmap = np.asarray(pmap)
         pmap = pmap.reshape((-1, pmap.shape[-1]))  # Can't keep shape.
         dwi.asciifile.write_ascii_file(filename, pmap, None, attrs=attrs)
     else:
@@ -224,7 +229,10 @@ def asindices(iterable, lst):
 def pick_params(pmap, attrs, params):
     """Select a subset of parameters by their indices or names."""
     params = list(asindices(params, attrs['parameters']))
-    pmap = pmap[..., params]
+    if isinstance(pmap, dwi.sparse.SparseMap):
+        pmap = pmap.pick(params)
+    else:
+        pmap = pmap[..., params]
     if 'bset' in attrs and len(attrs['bset']) == len(attrs['parameters']):
         attrs['bset'] = [attrs['bset'][x] for x in params]
     if 'echotimes' in attrs and (len(attrs['echotimes']) ==
@@ -234,11 +242,17 @@ def pick_params(pmap, attrs, params):
     return pmap, attrs
 
 
-def read_pmap(path, ondisk=False, fmt=None, params=None, dtype=None):
+def read_pmap(path, ondisk=False, fmt=None, params=None, dtype=None,
+              sparse=False):
     """Read a parametric map.
 
     With parameter ondisk it will not be read into memory. Parameter params
     tells which parameter indices should be included.
+
+    A sparse map file (see dwi.sparse) is expanded into a dense map, with
+    unselected voxels as NaN, unless parameter sparse is true; then it is
+    returned as dwi.sparse.SparseMap, to be expanded on request by its
+    todense(). Parameters are picked before expanding.
     """
     if fmt is None:
         fmt = guess_format(path)
@@ -251,7 +265,7 @@ def read_pmap(path, ondisk=False, fmt=None, params=None, dtype=None):
     elif fmt == 'zip':
         with read_archive(path) as tempdir:
             return read_pmap(tempdir, ondisk=ondisk, fmt=None, params=params,
-                             dtype=dtype)
+                             dtype=dtype, sparse=sparse)
     else:
         # No extension, assume it's a DICOM directory.
         d = dwi.dicomfile.read_dir(path)
@@ -264,6 +278,8 @@ def read_pmap(path, ondisk=False, fmt=None, params=None, dtype=None):
         pmap, attrs = pick_params(pmap, attrs, params)
     if dtype is not None:
         pmap = pmap.astype(dtype)
+    if isinstance(pmap, dwi.sparse.SparseMap) and not sparse:
+        pmap = pmap.todense()
     log.debug('Read %s, %s, %s', path, pmap.shape, pmap.dtype)
     return pmap, attrs
 
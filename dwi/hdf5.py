@@ -6,6 +6,7 @@ from collections import OrderedDict
 import numpy as np
 import h5py
 
+import dwi.sparse
 import dwi.util
 
 
@@ -17,6 +18,9 @@ DEFAULT_DSETPARAMS = dict(
     fletcher32=True,  # Flether32 checksum.
     track_times=False,  # Dataset creation timestamps.
     )
+CHUNK_BYTES = 2**20  # Target chunk size for datasets written piecewise.
+COORDS_DSETNAME = 'coords'  # Voxel coordinates of a sparse map.
+ROWS_DSETNAME = 'rows'  # Value row indices of a sparse map.
 
 
 class Dataset(h5py.Dataset):
@@ -39,6 +43,9 @@ def write_hdf5(filename, array, attrs, fillvalue=None,
     """Write an array with attributes into a newly created, compressed HDF5
     file.
     """
+    if isinstance(array, dwi.sparse.SparseMap):
+        write_sparse_hdf5(filename, array, attrs, dsetname=dsetname)
+        return
     f = h5py.File(filename, 'w')
     dset = f.create_dataset(dsetname, data=array, fillvalue=fillvalue,
                             **DEFAULT_DSETPARAMS)
@@ -47,6 +54,25 @@ def write_hdf5(filename, array, attrs, fillvalue=None,
     f.close()
 
 
+def write_sparse_hdf5(filename, pmap, attrs, dsetname=DEFAULT_DSETNAME):
+    """Write a sparse map (see dwi.sparse) into a newly created HDF5 file.
+
+    The value rows are written as the main dataset with the attributes. The
+    voxel coordinates and the dense shape go to a dataset of their own, as do
+    the value row indices, if any.
+    """
+    f = h5py.File(filename, 'w')
+    dset = f.create_dataset(dsetname, data=pmap.values, **DEFAULT_DSETPARAMS)
+    for k, v in attrs.items():
+        dset.attrs[k] = convert_value_write(v)
+    coords = f.create_dataset(COORDS_DSETNAME, data=pmap.coords,
+                              **DEFAULT_DSETPARAMS)
+    coords.attrs['shape'] = pmap.shape
+    if pmap.rows is not None:
+        f.create_dataset(ROWS_DSETNAME, data=pmap.rows, **DEFAULT_DSETPARAMS)
+    f.close()
+
+
 def convert_value_read(value):
     """Convert attribute value from bytes to string."""
     if isinstance(value, bytes):
@@ -64,13 +90,17 @@ def convert_attrs_read(attrs):
 def read_hdf5(filename, ondisk=False, dsetname=DEFAULT_DSETNAME):
     """Read an array with attributes from an HDF5 file.
 
-    With parameter "ondisk" True it will not be read into memory."""
+    With parameter "ondisk" True it will not be read into memory. A sparse map
+    is returned as dwi.sparse.SparseMap, always read into memory; use its
+    todense() to expand it."""
     try:
         f = h5py.File(filename, 'r')
     except IOError as e:
         if e.filename is None:
             e.filename = filename
         raise
+    if COORDS_DSETNAME in f:
+        return read_sparse_hdf5(f, dsetname)
     if dsetname not in f:
         # No dataset of given name, try the one there is.
         try:
@@ -89,13 +119,52 @@ def read_hdf5(filename, ondisk=False, dsetname=DEFAULT_DSETNAME):
     return array, attrs
 
 
+def read_sparse_hdf5(f, dsetname=DEFAULT_DSETNAME):
+    """Read a sparse map with attributes from an open HDF5 file, and close
+    it.
+    """
+    dset = f[dsetname]
+    coords = f[COORDS_DSETNAME]
+    rows = None
+    if ROWS_DSETNAME in f:
+        rows = np.array(f[ROWS_DSETNAME])
+    pmap = dwi.sparse.SparseMap(coords.attrs['shape'], np.array(coords),
+                                np.array(dset), rows=rows)
+    attrs = OrderedDict(dset.attrs)
+    attrs.update(convert_attrs_read(attrs))
+    f.close()
+    return pmap, attrs
+
+
+def slice_chunks(shape, dtype, nbytes=CHUNK_BYTES):
+    """Return chunk shape for a map of shape (slices, height, width,
+    parameters) that is written one slice at a time and read one parameter at
+    a time.
+
+    A chunk covers a whole slice plane with as many parameters as fit in
+    nbytes, or a part of the plane for a single parameter if it does not fit.
+    """
+    _, height, width, nparams = shape
+    itemsize = np.dtype(dtype).itemsize
+    plane = height * width * itemsize
+    if plane <= nbytes:
+        return 1, height, width, int(max(1, min(nparams, nbytes // plane)))
+    rows = int(max(1, nbytes // (width * itemsize)))
+    return 1, min(rows, height), width, 1
+
+
 def create_hdf5(filename, shape, dtype, fillvalue=None,
-                dsetname=DEFAULT_DSETNAME):
+                dsetname=DEFAULT_DSETNAME, **kwargs):
     """Create a HDF5 file and return the dataset for manipulation.
 
     Attributes and the file object can be accessed by dset.attrs and dset.file.
+    Keyword arguments override the default dataset parameters, e.g. chunks or
+    compression (None for no compression).
     """
+    params = dict(DEFAULT_DSETPARAMS, **kwargs)
+    if params['compression'] is None:
+        params['shuffle'] = False  # Only helps compression.
     f = h5py.File(filename, 'w')
     dset = f.create_dataset(dsetname, shape, dtype=dtype, fillvalue=fillvalue,
-                            **DEFAULT_DSETPARAMS)
+                            **params)
     return Dataset(dset.id)
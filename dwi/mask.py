@@ -220,15 +220,65 @@ def read_mask(path):
         return Mask3D(dwi.files.read_mask(path))
 
 
+def window_counts(mask, winshape):
+    """Count selected voxels in each full sliding window of a mask by a box
+    filter, see dwi.util.window_sums(). The counts are placed at window origin
+    like in dwi.util.sliding_window(); voxels without a full window around
+    them, near the border, get -1.
+    """
+    mask = np.asanyarray(mask)
+    winshape = dwi.util.normalize_sequence(winshape, mask.ndim)
+    counts = np.full(mask.shape, -1, dtype=np.int64)
+    counts[dwi.util.window_origins(mask.shape, winshape)] = \
+        dwi.util.window_sums(mask, winshape, dtype=np.int64)
+    return counts
+
+
+def max_count_mask(mask, counts):
+    """Return a mask of the selected voxels that have the maximum window
+    count, see window_counts().
+    """
+    counts = np.where(mask, counts, -1)
+    r = np.zeros_like(mask)
+    m = counts.max()
+    if m >= 0:
+        r[counts == m] = True
+    return r
+
+
+def max_mask(mask, winshape):
+    """Return a mask that has the voxels selected that have the maximum number
+    of surrounding voxels selected in the original mask.
+    """
+    return max_count_mask(mask, window_counts(mask, winshape))
+
+
+def portion_mask(mask, winshape, portion=1, resort_to_max=True):
+    """Return a mask that selects (only) voxels that have the window at each
+    selected voxel origin up to a minimum portion in the original mask selected
+    (1 means the whole window must be selected, 0 gives the original mask).
+
+    If resort_to_max is true, the window with maximum number of selected voxels
+    is used in case the resulting mask would otherwise be empty.
+    """
+    mask = np.asanyarray(mask)
+    winshape = dwi.util.normalize_sequence(winshape, mask.ndim)
+    counts = window_counts(mask, winshape)
+    r = np.zeros_like(mask)
+    r[(counts / np.prod(winshape) >= portion) & (counts >= 0) &
+      mask.astype(np.bool)] = True
+    if resort_to_max and np.count_nonzero(r) == 0:
+        r = max_count_mask(mask, counts)
+    return r
+
+
 def border(mask, out=None):
-    """Outline mask border by using a sliding window."""
+    """Outline mask border by counting selected voxels in a sliding window."""
     mask = np.asanyarray(mask)
     if out is None:
         out = np.zeros_like(mask, dtype=np.bool)
     # Try to guess a good window shape; thicker border for bigger resolution.
     winshape = [max(x//70, 3) for x in mask.shape]
-    for i, win in dwi.util.sliding_window(mask, winshape):
-        selected = np.count_nonzero(win) / win.size
-        if 0.3 < selected < 0.7:
-            out[i] = True
+    selected = window_counts(mask, winshape) / np.prod(winshape)
+    out[(0.3 < selected) & (selected < 0.7)] = True
     return out
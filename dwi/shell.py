@@ -3,6 +3,7 @@
 from __future__ import absolute_import, division, print_function
 
 from dwi.files import Path
+import dwi.util
 
 DWILIB = Path.home() / 'src/dwilib/tools'
 
@@ -32,6 +33,10 @@ def standardize_transform(cfgpath, inpath, outpath, mask=None):
 
 def get_texture(mode, inpath, method, winsize, slices, portion, outpath, voxel,
                 mask=None):
+    if dwi.util.iterable(method) and not dwi.util.isstring(method):
+        method = _arglist(method)  # Multiple methods in one pass.
+    if dwi.util.iterable(winsize) and not dwi.util.isstring(winsize):
+        winsize = _arglist(winsize)  # Multiple window sizes in one pass.
     d = dict(prg=DWILIB/'get_texture.py', m=mode, i=inpath, mask=mask,
              slices=slices, portion=portion, mth=method, ws=winsize,
              o=outpath, vx=voxel)
@@ -46,6 +51,15 @@ def get_texture(mode, inpath, method, winsize, slices, portion, outpath, voxel,
     return cmd.format(**d)
 
 
+def find_roi(inpath, prostate, algparams, outpaths):
+    """Find automatic ROIs with several parameter combinations at once."""
+    d = dict(prg=DWILIB/'find_roi.py', i=inpath, p=prostate,
+             ap=_arglist('_'.join(x) for x in algparams),
+             o=_pathlist(outpaths))
+    cmd = '{prg} -v --input {i} --prostate {p} --algparams {ap} --output {o}'
+    return cmd.format(**d)
+
+
 def make_subregion(mask, subregion):
     d = dict(prg=DWILIB/'masktool.py', mask=mask, sr=subregion)
     cmd = '{prg} -i {mask} --pad 10 -s {sr}'
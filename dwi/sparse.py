@@ -0,0 +1,112 @@
+"""Sparse parametric maps that store only the selected voxels.
+
+A sparse map has the shape of a dense map, but only contains the coordinates
+of selected voxels and their parameter values. Voxels may also share value
+rows, like all voxels of a slice in 'mbb' textures or all voxels in 'all'
+textures. Sparse maps are expanded into dense arrays on request.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+class SparseMap(object):
+    """Parametric map with values only at selected voxels.
+
+    Variables
+    ---------
+    shape : tuple
+        Shape of the dense map, parameters on the last axis.
+    coords : ndarray, shape = [voxels, ndim-1], dtype = int
+        Coordinates of selected voxels.
+    values : ndarray, shape = [rows, parameters]
+        Parameter value rows.
+    rows : ndarray, shape = [voxels], dtype = int, or None
+        Index of the value row of each voxel, or None for one row per voxel.
+    """
+    def __init__(self, shape, coords, values, rows=None):
+        self.shape = tuple(shape)
+        self.coords = np.asarray(coords, dtype=np.int32)
+        self.values = np.asarray(values)
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int32)
+        if self.coords.shape != (len(self.coords), len(self.shape)-1):
+            raise ValueError('Invalid coordinates: {}'.format(
+                self.coords.shape))
+        if self.values.shape[-1] != self.shape[-1]:
+            raise ValueError('Invalid values: {}'.format(self.values.shape))
+
+    def __repr__(self):
+        return '{}({}, voxels={}, rows={})'.format(
+            self.__class__.__name__, self.shape, len(self.coords),
+            len(self.values))
+
+    def __array__(self, dtype=None):
+        a = self.todense()
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def voxel_values(self):
+        """Return value rows of each selected voxel."""
+        if self.rows is None:
+            return self.values
+        return self.values[self.rows]
+
+    def todense(self, fill=np.nan):
+        """Expand into a dense array, with unselected voxels filled."""
+        dtype = self.dtype
+        if np.isnan(fill) and not np.issubdtype(dtype, np.floating):
+            dtype = np.float32
+        a = np.full(self.shape, fill, dtype=dtype)
+        a[tuple(self.coords.T)] = self.voxel_values()
+        return a
+
+    def astype(self, dtype):
+        """Return a copy with values converted to another type."""
+        return SparseMap(self.shape, self.coords, self.values.astype(dtype),
+                         rows=self.rows)
+
+    def pick(self, params):
+        """Return a map with a subset of parameters by their indices."""
+        return SparseMap(self.shape[:-1] + (len(params),), self.coords,
+                         self.values[:, params], rows=self.rows)
+
+
+def from_dense(a, mask):
+    """Make a sparse map of dense map voxels selected by a mask."""
+    a = np.asanyarray(a)
+    return SparseMap(a.shape, np.argwhere(mask), a[mask])
+
+
+def concatenate(maps):
+    """Concatenate sparse maps along parameters. The selected voxels are
+    unified, and voxels missing from a map are filled with NaN.
+    """
+    coords = [x.coords for x in maps]
+    if all(np.array_equal(coords[0], x) for x in coords[1:]):
+        rows = [x.rows for x in maps]
+        if all(x is None for x in rows):
+            values = np.concatenate([x.values for x in maps], axis=-1)
+        else:
+            values = np.concatenate([x.voxel_values() for x in maps],
+                                    axis=-1)
+        coords = coords[0]
+    else:
+        shape = maps[0].shape[:-1]
+        union = np.zeros(shape, dtype=np.bool)
+        for c in coords:
+            union[tuple(c.T)] = True
+        parts = [x.todense()[union] for x in maps]
+        values = np.concatenate(parts, axis=-1)
+        coords = np.argwhere(union)
+    shape = maps[0].shape[:-1] + (values.shape[-1],)
+    return SparseMap(shape, coords, values)
@@ -4,7 +4,8 @@ This module implements the percentile landmark method described in [1]. Much of
 the notation (variable names etc.) comes from this paper.
 
 Learning:
-    - Use landmark_scores() to get percentile scores for all images.
+    - Use landmark_scores() to get percentile scores for all images, or
+      landmark_scores_stream() for images on disk.
     - Use map_onto_scale() to map landmark scores to the standard scale.
     - Average mapped landmarks to get standard landmarks. TODO: This should be
       implemented here somehow.
@@ -79,6 +80,160 @@ def landmark_scores(img, pc, landmarks, thresholding, mask=None):
     return p, scores
 
 
+def iter_blocks(a, blocksize=2**26):
+    """Yield the finite values of an array or an on-disk HDF5 dataset, a block
+    of its first axis at a time. A chunked dataset is read by chunk length,
+    otherwise by rows fitting in blocksize bytes.
+    """
+    n = getattr(a, 'chunks', None)
+    if n:
+        n = n[0]
+    else:
+        n = max(1, blocksize // (a.dtype.itemsize * np.prod(a.shape[1:],
+                                                            dtype=int)))
+    for i in range(0, len(a), n):
+        block = np.asarray(a[i:i+n]).ravel()
+        yield block[np.isfinite(block)]
+
+
+def value_range(a):
+    """Return the number, sum, minimum, and maximum of finite values."""
+    n, total, lo, hi = 0, 0., np.inf, -np.inf
+    for block in iter_blocks(a):
+        if block.size:
+            n += block.size
+            total += np.sum(block, dtype=np.float64)
+            lo = min(lo, block.min().item())
+            hi = max(hi, block.max().item())
+    if not n:
+        raise ValueError('No finite values')
+    return n, total, lo, hi
+
+
+def value_histogram(a, lo, hi, above=None):
+    """Count the finite integer values of an array or an on-disk HDF5 dataset
+    in [lo, hi], optionally only those above a threshold, with a bin for each
+    integer. Returns the counts and the value of the first bin.
+    """
+    start = lo if above is None else max(lo, int(np.floor(above)) + 1)
+    bins = int(hi - start) + 1
+    counts = np.zeros(max(bins, 0), dtype=np.int64)
+    for block in iter_blocks(a):
+        if above is not None:
+            block = block[block > above]
+        counts += np.bincount(block.astype(np.int64) - start, minlength=bins)
+    return counts, start
+
+
+def histogram_percentiles(counts, start, q):
+    """Return percentiles from integer value counts, interpolating like
+    np.percentile().
+    """
+    cum = np.cumsum(counts)
+    if not cum.size or not cum[-1]:
+        raise ValueError('No values above threshold')
+    k = np.asarray(q, dtype=np.float64) / 100 * (cum[-1] - 1)
+    lo = start + np.searchsorted(cum, np.floor(k), side='right')
+    hi = start + np.searchsorted(cum, np.ceil(k), side='right')
+    return lo + (k - np.floor(k)) * (hi - lo)
+
+
+def value_percentiles(a, lo, hi, q, bins, above=None):
+    """Return percentiles of the finite values of an array or an on-disk HDF5
+    dataset in [lo, hi], optionally only those above a threshold,
+    interpolating like np.percentile().
+
+    Each pass over the data counts the values in equal bins of the intervals
+    holding the needed ranks. The bins holding them are searched again on the
+    next pass, until they have few enough values to be sorted. Thus the result
+    is exact, and outliers stretching the range only cost an extra pass.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    k = None
+    found = {}
+    # Intervals to search: start, stop, whether stop is included, number of
+    # values before start, ranks within (unknown at first), and whether to
+    # sort their values instead of counting them in bins.
+    tasks = [(lo, hi, True, 0, None, False)]
+    while tasks:
+        edges = [np.linspace(t[0], t[1], bins + 1) for t in tasks]
+        results = [[] if t[5] else np.zeros(bins, dtype=np.int64) for t in
+                   tasks]
+        for block in iter_blocks(a):
+            if above is not None:
+                block = block[block > above]
+            for (start, stop, closed, _, _, sort), e, r in zip(tasks, edges,
+                                                                results):
+                if closed:
+                    values = block[(start <= block) & (block <= stop)]
+                else:
+                    values = block[(start <= block) & (block < stop)]
+                if sort:
+                    r.append(values)
+                else:
+                    i = np.searchsorted(e, values, side='right') - 1
+                    r += np.bincount(np.minimum(i, bins - 1), minlength=bins)
+        new_tasks = []
+        for (start, stop, closed, before, ranks, sort), e, r in zip(
+                tasks, edges, results):
+            if sort:
+                values = np.sort(np.concatenate(r))
+                found.update((x, values[x - before]) for x in ranks)
+                continue
+            cum = np.cumsum(r)
+            if ranks is None:
+                if not cum[-1]:
+                    raise ValueError('No values above threshold')
+                k = q / 100 * (cum[-1] - 1)
+                ranks = np.union1d(np.floor(k), np.ceil(k)).astype(np.int64)
+            bin_indices = np.searchsorted(cum, ranks - before, side='right')
+            for i in np.unique(bin_indices):
+                task = (e[i], e[i + 1], closed and i == bins - 1,
+                        before + cum[i] - r[i], ranks[bin_indices == i],
+                        r[i] <= bins)
+                if not task[5] and (task[0] == task[1] or
+                                    task[:3] == (start, stop, closed)):
+                    # No more room for narrowing: all values are the same.
+                    found.update((x, task[0]) for x in task[4])
+                else:
+                    new_tasks.append(task)
+        tasks = new_tasks
+    value = np.vectorize(found.__getitem__, otypes=[np.float64])
+    lo = value(np.floor(k).astype(np.int64))
+    hi = value(np.ceil(k).astype(np.int64))
+    return lo + (k - np.floor(k)) * (hi - lo)
+
+
+def landmark_scores_stream(a, pc, landmarks, thresholding, bins=2**16):
+    """Get scores at histogram landmarks like landmark_scores(), but stream
+    over blocks of an array or an on-disk HDF5 dataset. Integer images of a
+    reasonable range are counted by value in one pass; others are searched by
+    repeated binning, see value_percentiles(). Both give exact percentiles.
+    """
+    n, total, lo, hi = value_range(a)
+    exact = (np.issubdtype(a.dtype, np.integer) and hi - lo < 2**24)
+
+    def percentiles(q, above=None):
+        if exact:
+            counts, start = value_histogram(a, lo, hi, above=above)
+            return histogram_percentiles(counts, start, q)
+        return value_percentiles(a, lo, hi, q, bins, above=above)
+
+    if thresholding == 'none':
+        threshold = None
+    elif thresholding == 'mean':
+        threshold = total / n
+    elif thresholding == 'median':
+        threshold = percentiles(50)
+    else:
+        raise ValueError('Invalid parameter: {}'.format(thresholding))
+    if not threshold:
+        threshold = None
+    p = tuple(percentiles(pc, above=threshold))
+    scores = tuple(percentiles(landmarks, above=threshold))
+    return p, scores
+
+
 def map_onto_scale(p1, p2, s1, s2, v):
     """Map value v from original scale [p1, p2] onto standard scale [s1, s2].
 
@@ -106,9 +261,30 @@ def map_onto_scale(p1, p2, s1, s2, v):
     return r
 
 
+def map_values(v, scores, mapped_scores, scale):
+    """Map values onto standard scale piecewise linearly between landmarks,
+    like map_onto_scale(), extrapolating beyond the first and last ones.
+    Returns the values rounded toward zero into integers, clipped to one past
+    the standard scale.
+    """
+    s1, s2 = scale
+    # Select slot where to map: the number of scores below the value.
+    slot = np.searchsorted(scores, v, side='left')
+    slot = np.clip(slot, 1, len(scores)-1)
+    p1, p2 = scores[slot-1], scores[slot]
+    m1, m2 = mapped_scores[slot-1], mapped_scores[slot]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.where(p1 == p2, m1, (v-p1) / (p2-p1) * (m2-m1) + m1)
+    r = np.clip(r, s1-1, s2+1)
+    return np.trunc(r).astype(np.int16)
+
+
 def transform(img, p, scores, scale, mapped_scores):
     """Transform image onto standard scale.
 
+    Images of small integer types are transformed via a lookup table that maps
+    every possible value once.
+
     Parameters
     ----------
     img : ndarray
@@ -127,19 +303,18 @@ def transform(img, p, scores, scale, mapped_scores):
     r : ndarray of integers
         Transformed image.
     """
+    img = np.asanyarray(img)
     p1, p2 = p
     s1, s2 = scale
-    scores = [p1] + list(scores) + [p2]
-    mapped_scores = [s1] + list(mapped_scores) + [s2]
-    r = np.zeros_like(img, dtype=np.int16)
-    for pos, v in np.ndenumerate(img):
-        # Select slot where to map.
-        slot = sum(v > s for s in scores)
-        slot = np.clip(slot, 1, len(scores)-1)
-        r[pos] = map_onto_scale(scores[slot-1], scores[slot],
-                                mapped_scores[slot-1], mapped_scores[slot], v)
-    r = np.clip(r, s1-1, s2+1, out=r)
-    return r
+    scores = np.array([p1] + list(scores) + [p2], dtype=np.float64)
+    mapped_scores = np.array([s1] + list(mapped_scores) + [s2],
+                             dtype=np.float64)
+    if img.dtype.kind in 'iu' and img.dtype.itemsize <= 2:
+        info = np.iinfo(img.dtype)
+        values = np.arange(info.min, info.max+1)
+        lut = map_values(values, scores, mapped_scores, scale)
+        return lut[img.astype(np.int32) - info.min]
+    return map_values(img, scores, mapped_scores, scale)
 
 
 def standardize(img, cfg, mask=None):
@@ -168,7 +343,8 @@ def standardize(img, cfg, mask=None):
     return img
 
 
-def write_std_cfg(filename, pc, landmarks, scale, mapped_scores, thresholding):
+def write_std_cfg(filename, pc, landmarks, scale, mapped_scores, thresholding,
+                  n=None, sums=None):
     """Write image standardization configuration file.
 
     Parameters
@@ -185,6 +361,11 @@ def write_std_cfg(filename, pc, landmarks, scale, mapped_scores, thresholding):
         Standard landmark percentile scores on the standard scale.
     thresholding : string
         Thresholding strategy.
+    n : integer, optional
+        Number of training images, for adding more images later.
+    sums : iterable of integers, optional
+        Sums of mapped landmark scores of training images, for adding more
+        images later.
     """
     with open(filename, 'w') as f:
         f.write(dwi.files.toline(pc))
@@ -192,6 +373,10 @@ def write_std_cfg(filename, pc, landmarks, scale, mapped_scores, thresholding):
         f.write(dwi.files.toline(scale))
         f.write(dwi.files.toline(mapped_scores))
         f.write(thresholding)
+        if n is not None:
+            f.write('\n')
+            f.write(dwi.files.toline([n]))
+            f.write(dwi.files.toline(sums))
 
 
 def read_std_cfg(filename):
@@ -205,9 +390,10 @@ def read_std_cfg(filename):
     Returns
     -------
     d : OrderedDict
-        Standardization configuration.
+        Standardization configuration. Items 'n' and 'sums' are included if
+        the file has them.
     """
-    lines = list(dwi.files.valid_lines(filename))[:5]
+    lines = list(dwi.files.valid_lines(filename))[:7]
     lines = [l.split() for l in lines]
     d = collections.OrderedDict()
     d['pc'] = tuple(float(x) for x in lines[0])
@@ -215,6 +401,9 @@ def read_std_cfg(filename):
     d['scale'] = tuple(int(x) for x in lines[2])
     d['mapped_scores'] = tuple(int(x) for x in lines[3])
     d['thresholding'] = lines[4][0]
+    if len(lines) == 7:
+        d['n'] = int(lines[5][0])
+        d['sums'] = tuple(int(x) for x in lines[6])
     if len(d['landmarks']) != len(d['mapped_scores']):
         raise Exception('Invalid standardization file: {}'.format(filename))
     return d
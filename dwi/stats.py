@@ -63,6 +63,21 @@ def resample_bootstrap_stratified(Y, X):
     return Y[indices], X[indices]
 
 
+def bootstrap_indices_stratified(y, nboot, random_state=None):
+    """Get a matrix of stratified bootstrap resample indices, one resample
+    per row. Like resample_bootstrap_stratified(), the indices are grouped by
+    label. Parameter random_state is a seed or numpy.random.RandomState.
+    """
+    y = np.asarray(y)
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    indices = []
+    for u in np.unique(y):
+        l = np.flatnonzero(y == u)
+        indices.append(l[random_state.randint(0, len(l), (nboot, len(l)))])
+    return np.concatenate(indices, axis=1)
+
+
 def posneg_to_labelsvalues(pos, neg):
     """From two data sequences, positives and negatives, create to ndarrays,
     labels and values, where labels contains True/False labels, and values
@@ -101,31 +116,155 @@ def calculate_roc_auc(y, x, autoflip=False, scale=True):
     return fpr, tpr, auc
 
 
-def bootstrap_aucs(y, x, n=2000):
-    """Produce an array of bootstrapped ROC AUCs."""
-    aucs = np.zeros(n)
-    for i in range(n):
-        yb, xb = resample_bootstrap_stratified(y, x)
-        _, _, auc = calculate_roc_auc(yb, xb, autoflip=False, scale=False)
-        aucs[i] = auc
-    return aucs
+def mann_whitney_aucs(y, x, indices):
+    """Calculate ROC AUCs of resamples by the Mann-Whitney U statistic, which
+    equals the area under the empirical ROC curve. Parameter indices is a
+    matrix of sample indices, one resample per row. The greatest label is
+    positive.
+
+    All rows are counted at once: values are replaced by their ranks among
+    unique values, offset by row, so that a single sorted array of negatives
+    serves a binary search for the positives of every row. Ties count half.
+    """
+    y = np.asarray(y)
+    x = np.asarray(x)
+    indices = np.atleast_2d(indices)
+    nrows, m = indices.shape
+    positive = (y == y.max())[indices]
+    _, codes = np.unique(x, return_inverse=True)
+    u = codes.max() + 1
+    codes = codes.ravel()[indices]
+    offset = np.arange(nrows)[:, np.newaxis] * (u + 1)
+    # Positives are pushed past the values of the row, out of the search.
+    negatives = np.sort(np.where(positive, u, codes), axis=1) + offset
+    negatives = negatives.ravel()
+    rows = np.nonzero(positive)[0]
+    codes = (codes + offset)[positive]
+    counts = (np.searchsorted(negatives, codes, side='left') +
+              np.searchsorted(negatives, codes, side='right') - 2 * rows * m)
+    U = np.bincount(rows, weights=counts, minlength=nrows) / 2
+    n_pos = np.count_nonzero(positive, axis=1)
+    return U / (n_pos * (m - n_pos))
+
+
+def bootstrap_aucs(y, x, n=2000, random_state=None):
+    """Produce an array of bootstrapped ROC AUCs, with stratified resampling.
+    Parameter random_state is a seed or numpy.random.RandomState.
+    """
+    indices = bootstrap_indices_stratified(y, n, random_state=random_state)
+    return mann_whitney_aucs(y, x, indices)
+
+
+def midranks(a):
+    """Return the one-based ranks along the last axis, with ties given their
+    average rank.
+
+    All rows are ranked at once: after sorting, each tied run gets the mean of
+    its first and last position.
+    """
+    a = np.asarray(a)
+    shape = a.shape
+    a = a.reshape(-1, shape[-1])
+    m, n = a.shape
+    rows = np.arange(m)[:, np.newaxis]
+    order = np.argsort(a, axis=-1, kind='mergesort')
+    s = a[rows, order]
+    positions = np.arange(n) * np.ones((m, 1), dtype=np.intp)
+    starts = np.ones(s.shape, dtype=np.bool)
+    starts[:, 1:] = s[:, 1:] != s[:, :-1]
+    ends = np.ones(s.shape, dtype=np.bool)
+    ends[:, :-1] = starts[:, 1:]
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, positions, n-1)[:, ::-1],
+                                 axis=1)[:, ::-1]
+    ranks = np.empty(s.shape)
+    ranks[rows, order] = (first + last) / 2 + 1
+    return ranks.reshape(shape)
+
+
+def delong_components(labels, values):
+    """Calculate the structural components of DeLong's method for ROC AUC of
+    classifiers on the same samples, with the fast midrank algorithm of Sun &
+    Xu 2014, in O(n log n). Parameter values has the values of each
+    classifier on a row. The greatest label is positive.
+
+    Returns the AUCs, and the components of positive and negative samples as
+    arrays with a row for each classifier.
+    """
+    labels = np.asarray(labels)
+    values = np.atleast_2d(values)
+    positive = labels == labels.max()
+    x = values[:, positive]
+    y = values[:, ~positive]
+    m, n = x.shape[1], y.shape[1]
+    tx = midranks(x)
+    ty = midranks(y)
+    tz = midranks(np.concatenate([x, y], axis=1))
+    aucs = np.sum(tz[:, :m], axis=1) / (m * n) - (m + 1) / (2 * n)
+    v01 = (tz[:, :m] - tx) / n
+    v10 = 1 - (tz[:, m:] - ty) / m
+    return aucs, v01, v10
+
+
+def delong_cov(labels, values):
+    """Calculate ROC AUCs and their covariance matrix by DeLong's method. See
+    delong_components().
+    """
+    aucs, v01, v10 = delong_components(labels, values)
+    m, n = v01.shape[1], v10.shape[1]
+    cov = (np.atleast_2d(np.cov(v01)) / m + np.atleast_2d(np.cov(v10)) / n)
+    return aucs, cov
 
 
-def roc_auc(labels, values, autoflip=False, nboot=None):
+def delong_conf_int(auc, var, p=0.05):
+    """Confidence interval of ROC AUC from DeLong variance, clipped to [0,
+    1].
+    """
+    z = stats.norm.ppf(1 - p/2)
+    sd = np.sqrt(var)
+    return max(0, auc - z*sd), min(1, auc + z*sd)
+
+
+def compare_aucs_delong(aucs, cov):
+    """Compare ROC AUCs pairwise by DeLong's paired test, given their
+    covariance matrix from delong_cov(). Returns matrices of AUC difference
+    (row minus column), z-score, and p-value, which is taken like in
+    compare_aucs().
+    """
+    aucs = np.asarray(aucs)
+    var = np.diag(cov)
+    D = aucs[:, np.newaxis] - aucs[np.newaxis, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = D / np.sqrt(var[:, np.newaxis] + var[np.newaxis, :] - 2 * cov)
+    p = 1.0 - stats.norm.cdf(abs(z))
+    return D, z, p
+
+
+def roc_auc(labels, values, autoflip=False, nboot=None, random_state=None,
+            delong=False):
     """Calculate ROC AUC with optional bootstrapping. If autoflip is True,
     results under 0.5 are 'switched' automatically. Returns a dictionary with
     keys: auc: AUC, flipped: whether flipped, ci1, ci2: confidence interval.
+    Parameter random_state is a seed or numpy.random.RandomState for the
+    bootstrap. With delong, the confidence interval is calculated by DeLong's
+    method instead, and key var is added for AUC variance.
     """
     _, _, auc = dwi.stats.calculate_roc_auc(labels, values, autoflip=False,
                                             scale=False)
     if autoflip and auc < 0.5:
         # Must flip here for the bootstrap to work.
-        return dict(roc_auc(labels, -values, autoflip=False, nboot=nboot),
+        return dict(roc_auc(labels, -values, autoflip=False, nboot=nboot,
+                            random_state=random_state, delong=delong),
                     flipped=True)
     d = dict(auc=auc, flipped=False)
-    if nboot:
+    if delong:
+        _, cov = delong_cov(labels, values)
+        d['var'] = cov[0, 0]
+        d['ci1'], d['ci2'] = delong_conf_int(auc, d['var'])
+    elif nboot:
         # Note: values may now be negated (ROC flipped).
-        d['aucs'] = dwi.stats.bootstrap_aucs(labels, values, nboot)
+        d['aucs'] = dwi.stats.bootstrap_aucs(labels, values, nboot,
+                                             random_state=random_state)
         d['ci1'], d['ci2'] = dwi.stats.conf_int(d['aucs'])
     return d
 
@@ -142,40 +281,98 @@ def compare_aucs(aucs1, aucs2):
     return np.mean(D), z, p
 
 
-def conf_int(x, p=0.05):
-    """Confidence interval of a normally distributed array."""
-    x = sorted(x)
-    l = len(x)
+def compare_aucs_matrix(aucs):
+    """Compare arrays of (bootstrapped) ROC AUC values pairwise, like
+    compare_aucs(), but for all pairs at once. Parameter aucs has the values
+    of each parameter on a row. The mean and deviation of each difference are
+    taken from the means and covariance matrix of the rows. Returns matrices
+    of mean difference (row minus column), z-score, and p-value.
+    """
+    aucs = np.asarray(aucs)
+    mean = np.mean(aucs, axis=1)
+    cov = np.atleast_2d(np.cov(aucs, bias=True))
+    var = np.diag(cov)
+    D = mean[:, np.newaxis] - mean[np.newaxis, :]
+    sd = np.sqrt(np.maximum(var[:, np.newaxis] + var[np.newaxis, :] - 2 * cov,
+                            0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = D / sd
+    p = 1.0 - stats.norm.cdf(abs(z))
+    return D, z, p
+
+
+def correlations(x, y, method='spearman'):
+    """Calculate correlation of each column of x, shaped (samples, params),
+    with y. Method is 'spearman' or 'pearson'. Returns a dictionary of arrays:
+    r: coefficient, p: two-sided p-value, lower, upper: 95% confidence
+    interval by Fisher z-transformation. Columns with non-finite or equal
+    values get nan.
+
+    For Spearman, the whole matrix is ranked at once; the coefficients are
+    then given by a single matrix product of the centered columns.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    assert len(x) == len(y)
+    n = len(y)
+    invalid = ~np.all(np.isfinite(x), axis=0) | ~np.all(np.isfinite(y))
+    if method == 'spearman':
+        x = midranks(x.T).T
+        y = midranks(y)
+    elif method != 'pearson':
+        raise ValueError('Invalid method: {}'.format(method))
+    x = x - np.mean(x, axis=0)
+    y = y - np.mean(y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.dot(y, x) / np.sqrt(np.sum(x**2, axis=0) * np.sum(y**2))
+        r = np.clip(r, -1, 1)
+        r[invalid] = np.nan
+        t = r * np.sqrt((n-2) / (1 - r**2))
+        p = 2 * stats.t.sf(np.abs(t), n-2)
+        z = np.arctanh(r)
+    delta = 1.96 / np.sqrt(n-3)
+    return dict(r=r, p=p, lower=np.tanh(z - delta), upper=np.tanh(z + delta))
+
+
+def conf_int(x, p=0.05, axis=-1):
+    """Confidence interval of a normally distributed array, along an axis."""
+    x = np.sort(x, axis=axis)
+    l = x.shape[axis]
     i1 = int(round((p/2) * l + 0.5))
     i2 = int(round((1-p/2) * l - 0.5))
-    ci1 = x[i1]
-    ci2 = x[i2]
+    ci1 = np.take(x, i1, axis=axis)
+    ci2 = np.take(x, i2, axis=axis)
     return ci1, ci2
 
 
 def mean_squared_difference(a1, a2):
-    """Return mean squared difference of two arrays."""
+    """Return mean squared difference of two arrays, along the first axis."""
     a1 = np.asanyarray(a1)
     a2 = np.asanyarray(a2)
     assert len(a1) == len(a2), 'Array length mismatch'
     n = len(a1)
     ds = a1-a2
     sds = ds**2
-    msd = np.sqrt(sum(sds) / (n-1))
+    msd = np.sqrt(np.sum(sds, axis=0) / (n-1))
     return msd
 
 
 def repeatability_coeff(a1, a2, avgfun=np.mean):
     """Calculate reproducibility coefficients for two arrays by Bland-Altman
     analysis. Return average, average squared difference, confidence interval,
-    within-patient coefficient of variance, coefficient of repeatability."""
+    within-patient coefficient of variance, coefficient of repeatability.
+
+    Samples are along the first axis; with more dimensions, the coefficients
+    are calculated for each of the rest, like parameters, at once. Function
+    avgfun must take an axis argument.
+    """
     a1 = np.asanyarray(a1)
     a2 = np.asanyarray(a2)
     assert len(a1) == len(a2), 'Array length mismatch'
     n = len(a1)
     a = np.concatenate((a1, a2))
-    avg = avgfun(a)
-    avg_ci1, avg_ci2 = conf_int(a)
+    avg = avgfun(a, axis=0)
+    avg_ci1, avg_ci2 = conf_int(a, axis=0)
     msd = mean_squared_difference(a1, a2)
     ci = 1.96*msd / np.sqrt(n)
     wcv = (msd/np.sqrt(2)) / avg
@@ -189,21 +386,26 @@ def icc(baselines):
     """Calculate ICC(3,1) intraclass correlation.
 
     Parameter baselines is an array of size (k, n) where k is the number of
-    raters (repetitions) and n is the number of targets (samples).
+    raters (repetitions) and n is the number of targets (samples). It may also
+    be a stack of them, like (nboot, k, n) or (nparams, k, n), giving an array
+    of ICCs.
 
     See Shrout, Fleiss 1979: Intraclass Correlations: Uses in Assessing Rater
     Reliability.
     """
-    data = np.array(baselines)
-    k, n = data.shape  # Number of raters, targets.
-    mpt = np.mean(data, axis=0)  # Mean per target.
-    mpr = np.mean(data, axis=1)  # Mean per rater.
-    tm = np.mean(data)  # Total mean.
-    wss = sum(sum((data-mpt)**2))  # Within-target sum of squares.
+    data = np.asarray(baselines, dtype=np.float64)
+    k, n = data.shape[-2:]  # Number of raters, targets.
+    mpt = np.mean(data, axis=-2)  # Mean per target.
+    mpr = np.mean(data, axis=-1)  # Mean per rater.
+    tm = np.mean(data, axis=(-2, -1))  # Total mean.
+    # Within-target sum of squares.
+    wss = np.sum((data-mpt[..., np.newaxis, :])**2, axis=(-2, -1))
     # wms = wss / (n * (k-1))  # Within-target mean of squares.
-    rss = sum((mpr-tm)**2) * n  # Between-rater sum of squares.
+    # Between-rater sum of squares.
+    rss = np.sum((mpr-tm[..., np.newaxis])**2, axis=-1) * n
     # rms = rss / (k-1)  # Between-rater mean of squares.
-    bss = sum((mpt-tm)**2) * k  # Between-target sum of squares.
+    # Between-target sum of squares.
+    bss = np.sum((mpt-tm[..., np.newaxis])**2, axis=-1) * k
     bms = bss / (n-1)  # Between-target mean of squares.
     ess = wss - rss  # Residual sum of squares.
     ems = ess / ((k-1) * (n-1))  # Residual mean of squares.
@@ -211,15 +413,24 @@ def icc(baselines):
     return icc31
 
 
-def bootstrap_icc(baselines, nboot=2000):
+def bootstrap_icc(baselines, nboot=2000, random_state=None, blocksize=256):
     """Calculate ICC bootstrapped target-wise. Return mean and confidence
     intervals.
+
+    Parameter baselines is an array of size (k, n) as in icc(), or a stack of
+    them; the same resamples are used for each. The resamples are taken and
+    calculated in blocks. Parameter random_state is a seed or
+    numpy.random.RandomState.
     """
-    data = np.array(baselines)
-    values = np.zeros((nboot,))
-    for i in range(nboot):
-        sample = resample_bootstrap_single(data.T).T
-        values[i] = icc(sample)
-    mean = np.mean(values)
+    data = np.asarray(baselines)
+    n = data.shape[-1]
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    indices = random_state.randint(0, n, (nboot, n))
+    values = np.empty(data.shape[:-2] + (nboot,))
+    for i in range(0, nboot, blocksize):
+        samples = data[..., indices[i:i+blocksize]]  # Shape (..., k, b, n).
+        values[..., i:i+blocksize] = icc(np.swapaxes(samples, -3, -2))
+    mean = np.mean(values, axis=-1)
     ci1, ci2 = conf_int(values)
     return mean, ci1, ci2
@@ -9,18 +9,32 @@ Output type can be one of the following: 'map' just returns the map or spreads
 the single values over all selected voxels, 'mean' and 'median' return just the
 single values or reduces the map into a single average value.
 
+If 'texture.sparse' is set, maps are returned as dwi.sparse.SparseMap that only
+holds the selected voxels, with one value row for each slice or volume in case
+of 'mbb' and 'all'.
+
 Scikit-image and Mahotas libraries are used for the calculations.
 """
 
 from __future__ import absolute_import, division, print_function
 from collections import OrderedDict
+from functools import partial
 import logging
+import multiprocessing
+import os
+import tempfile
 
 import numpy as np
 import scipy as sp
 
+import dwi.conf
 import dwi.hdf5
+import dwi.sparse
+import dwi.texture_cache
 import dwi.util
+# The method modules import this module back. Import this module first: the
+# method tables below read their functions when this module is imported.
+import dwi.texture_3d
 import dwi.texture_mahotas
 import dwi.texture_skimage
 
@@ -28,34 +42,39 @@ import dwi.texture_skimage
 # Basic statistical features
 
 
-def stats(img):
-    """Statistical texture features that don't consider spatial relations."""
+def stats(img, axis=None):
+    """Statistical texture features that don't consider spatial relations.
+
+    With axis given, features are calculated along it, for a batch of windows.
+    """
     # TODO: Consider IQR, MAD, interdecile range, midhinge, trimean, trimmed
     # mean, winsorized mean.
     img = np.asanyarray(img)
+    if axis is None:
+        img = img.ravel()
+        axis = 0
     d = OrderedDict()
     # Add percentiles.
     p_ranks = sorted(list(range(0, 101, 10)) + [25, 75])
-    for p_rank, p in zip(p_ranks, np.percentile(img, p_ranks)):
+    for p_rank, p in zip(p_ranks, np.percentile(img, p_ranks, axis=axis)):
         d['p{:03d}'.format(p_rank)] = p
     d['range'] = d['p100'] - d['p000']
-    d['mean'] = np.mean(img)
-    d['stddev'] = np.std(img)
-    d['kurtosis'] = sp.stats.kurtosis(img.ravel())
-    d['skewness'] = sp.stats.skew(img.ravel())
+    d['mean'] = np.mean(img, axis=axis)
+    d['stddev'] = np.std(img, axis=axis)
+    d['kurtosis'] = sp.stats.kurtosis(img, axis=axis)
+    d['skewness'] = sp.stats.skew(img, axis=axis)
     return d
 
 
 def stats_map(img, winsize, mask=None, output=None):
-    """Statistical texture feature map."""
-    for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
-        d = stats(win)
+    """Statistical texture feature map. Calculated in blocks of windows."""
+    for pos, wins in dwi.util.window_blocks(img, winsize, mask=mask):
+        d = stats(wins.reshape(len(wins), -1), axis=-1)
         names = list(d.keys())
         if output is None:
             dtype = dwi.rcParams['texture.dtype']
             output = np.zeros((len(names),) + img.shape, dtype=dtype)
-        for i, value in enumerate(d.values()):
-            output[(i,) + pos] = value
+        output[(slice(None),) + tuple(pos.T)] = list(d.values())
     names = ['stats({})'.format(x) for x in names]
     return output, names
 
@@ -77,7 +96,7 @@ METHODS = OrderedDict([
     # Methods that consider an n*n window.
     ('stats', stats_map),
     ('glcm', dwi.texture_skimage.glcm_map),
-    # ('haralick', dwi.texture_mahotas.haralick_map),
+    ('haralick', dwi.texture_mahotas.haralick_map),
     ('lbp', dwi.texture_skimage.lbp_freq_map),
     ('hog', dwi.texture_skimage.hog_map),
     ('gabor', dwi.texture_skimage.gabor_map),
@@ -89,63 +108,507 @@ METHODS = OrderedDict([
     # Methods that consider a minimum bounding box of selected voxels.
     ('stats_mbb', stats_mbb),
     ('glcm_mbb', dwi.texture_skimage.glcm_mbb),
-    # ('haralick_mbb', dwi.texture_mahotas.haralick_mbb),
+    ('haralick_mbb', dwi.texture_mahotas.haralick_mbb),
 
     # Methods that consider all selected voxels.
     ('stats_all', stats_mbb),  # Use the same mbb function.
     ])
 
+# Map methods that take a sequence of window sizes at once, sharing the
+# computation that does not depend on window size. They return the outputs
+# stacked by window size, and a list of feature names for each size.
+MULTI_METHODS = OrderedDict([
+    ('lbp', dwi.texture_skimage.lbp_freq_maps),
+    ('hog', dwi.texture_skimage.hog_maps),
+    ('gabor', dwi.texture_skimage.gabor_maps),
+    ('haar', dwi.texture_mahotas.haar_maps),
+    ('sobel', dwi.texture_skimage.sobel_maps),
+    ])
+
+# Methods that need the image normalized and quantized into grey levels.
+QUANTIZED_METHODS = ('glcm', 'glcm_mbb', 'haralick', 'haralick_mbb')
+
+# Map methods that have a volumetric version with 3D windows, see get_winshape().
+METHODS_3D = OrderedDict([
+    ('stats', dwi.texture_3d.stats_map),
+    ('glcm', dwi.texture_3d.glcm_map),
+    ('lbp', dwi.texture_3d.lbp_freq_map),
+    ('gabor', dwi.texture_3d.gabor_map),
+    ])
+
+# Map methods that look only inside each window. They can be calculated in row
+# tiles padded by the window halo.
+LOCAL_METHODS = ('stats', 'glcm', 'haralick', 'hog', 'hu', 'zernike')
+
+
+def get_maps(img, method, winsizes, mask):
+    """Call a map method for a sequence of window sizes. Return a list of
+    outputs and a list of feature names, one for each size. The number of
+    features may depend on window size, e.g. GLCM leaves out the distances
+    that do not fit in the window.
+    """
+    if method in MULTI_METHODS:
+        outputs, outnames = MULTI_METHODS[method](img, winsizes, mask=mask)
+        return list(outputs), outnames
+    outputs = []
+    outnames = []
+    for winsize in winsizes:
+        output, names = METHODS[method](img, winsize, mask=mask)
+        outputs.append(output)
+        outnames.append(names)
+    return outputs, outnames
+
+
+def get_winshape(winspec):
+    """Return window shape (depth, height, width) of a volumetric window
+    specification given as 'WIDTHxHEIGHTxDEPTH', e.g. '5x5x3', or None if it is
+    not one.
+    """
+    if not dwi.util.isstring(winspec):
+        return None
+    parts = winspec.split('x')
+    if len(parts) != 3 or not all(x.isdigit() and int(x) for x in parts):
+        return None
+    return tuple(int(x) for x in reversed(parts))
+
+
+def get_texture_volume(img, method, winshape, mask):
+    """Texture map with volumetric windows, see dwi.texture_3d. Background is
+    filled with NaN.
+    """
+    if method not in METHODS_3D:
+        raise ValueError('Method has no volumetric version: {}'.format(method))
+    if mask is None:
+        mask = np.ones(img.shape, dtype=np.bool)
+    output, names = METHODS_3D[method](img, winshape, mask=mask)
+    tmap = np.rollaxis(output, 0, 4).astype(dwi.rcParams['texture.dtype'])
+    tmap[~mask, :] = np.nan
+    return tmap, names
+
 
 def get_texture_all(img, call, mask):
+    """Features of all selected voxels, as a sparse map of one value row."""
     feats, names = call(img, mask=mask)
     dtype = dwi.rcParams['texture.dtype']
-    tmap = np.full(img.shape + (len(names),), np.nan, dtype=dtype)
-    tmap[mask, :] = feats
+    coords = np.argwhere(mask)
+    tmap = dwi.sparse.SparseMap(img.shape + (len(names),), coords,
+                                np.array([feats], dtype=dtype),
+                                rows=np.zeros(len(coords)))
     return tmap, names
 
 
 def get_texture_mbb(img, call, mask):
-    tmap = None
-    for i, (img_slice, mask_slice) in enumerate(zip(img, mask)):
-        if np.count_nonzero(mask_slice):
-            feats, names = call(img_slice, mask=mask_slice)
-            if tmap is None:
-                dtype = dwi.rcParams['texture.dtype']
-                tmap = np.full(img.shape + (len(names),), np.nan, dtype=dtype)
-            tmap[i, mask_slice, :] = feats
+    """Features of selected voxels of each slice, as a sparse map of one value
+    row for each slice.
+    """
+    indices = [i for i, x in enumerate(mask) if np.count_nonzero(x)]
+    values = []
+    for i in indices:
+        feats, names = call(img[i], mask=mask[i])
+        values.append(feats)
+    dtype = dwi.rcParams['texture.dtype']
+    coords = np.argwhere(mask)
+    rows = np.searchsorted(indices, coords[:, 0])
+    tmap = dwi.sparse.SparseMap(img.shape + (len(names),), coords,
+                                np.array(values, dtype=dtype), rows=rows)
     return tmap, names
 
 
-def get_texture_map(img, call, winsize, mask):
+def get_map_feats(img, method, winsizes, masks):
+    """Texture features of a single slice (or tile) for a sequence of window
+    sizes, each with its own mask.
+
+    Features of all window sizes are concatenated along the last axis, with
+    background filled with NaN. Their names are returned as (winsize, name)
+    pairs.
+    """
+    mask = dwi.util.unify_masks(masks)
+    outputs, outnames = get_maps(img, method, winsizes, mask)
+    names = [(w, n) for w, l in zip(winsizes, outnames) for n in l]
+    feats = []
+    for output, m in zip(outputs, masks):
+        f = np.rollaxis(np.asarray(output), 0, 3)
+        f[~m, :] = np.nan  # Fill background with NaN.
+        feats.append(f)
+    return np.concatenate(feats, axis=-1), names
+
+
+def create_texture_file(path, shape, dtype):
+    """Create an HDF5 texture map on disk, to be written a slice at a time.
+
+    The chunks follow the slice-by-feature access pattern, so a slice write
+    never touches a chunk twice, and only one slice is kept in memory. Chunks
+    of slices never written are not stored, they read as NaN. Compression is
+    taken from 'texture.compression'; lzf and none are faster than gzip.
+    """
+    compression = dwi.rcParams['texture.compression']
+    if compression == 'none':
+        compression = None
+    chunks = dwi.hdf5.slice_chunks(shape, dtype)
+    logging.info('Writing texture map on disk: %s, chunks %s, compression %s',
+                 path, chunks, compression)
+    return dwi.hdf5.create_hdf5(path, shape, dtype, fillvalue=np.nan,
+                                chunks=chunks, compression=compression)
+
+
+def get_texture_map(img, method, winsizes, masks, sparse=False):
+    """Texture map for a sequence of window sizes, each with its own mask.
+
+    Features of all window sizes are concatenated, and their names are
+    returned as (winsize, name) pairs. If 'texture.jobs' is more than one, the
+    map is calculated in parallel by get_texture_map_parallel(). If sparse is
+    true, the map is returned as a sparse map of voxels selected in any mask,
+    and 'texture.path' is not used.
+    """
+    jobs = dwi.rcParams['texture.jobs']
+    mask = dwi.util.unify_masks(masks)
+    if not np.any(mask):
+        raise ValueError('No voxels selected')
+    if jobs > 1:
+        tmap, names = get_texture_map_parallel(img, method, winsizes, masks,
+                                               jobs)
+        if sparse:
+            tmap = dwi.sparse.from_dense(tmap, mask)
+        return tmap, names
     path = dwi.rcParams['texture.path']
+    dtype = dwi.rcParams['texture.dtype']
     tmap = None
-    for i, (img_slice, mask_slice) in enumerate(zip(img, mask)):
+    coords = []
+    values = []
+    for i, mask_slice in enumerate(mask):
         if np.count_nonzero(mask_slice):
-            feats, names = call(img_slice, winsize, mask=mask_slice)
+            feats, names = get_map_feats(img[i], method, winsizes,
+                                         [m[i] for m in masks])
+            if sparse:
+                c = np.argwhere(mask_slice)
+                coords.append(np.insert(c, 0, i, axis=1))
+                values.append(feats[mask_slice].astype(dtype))
+                continue
             if tmap is None:
                 shape = img.shape + (len(names),)
-                dtype = dwi.rcParams['texture.dtype']
                 if path is None:
                     tmap = np.full(shape, np.nan, dtype=dtype)
                 else:
-                    s = 'Array is manipulated on disk, it is slow: %s'
-                    logging.warning(s, path)
-                    tmap = dwi.hdf5.create_hdf5(path, shape, dtype,
-                                                fillvalue=np.nan)
-            feats = np.rollaxis(feats, 0, 3)
-            feats[-mask_slice, :] = np.nan  # Fill background with NaN.
-            tmap[i, :, :, :] = feats
+                    tmap = create_texture_file(path, shape, dtype)
+            tmap[i, :, :, :] = feats  # Whole slice at once, see chunks.
+    if sparse:
+        tmap = dwi.sparse.SparseMap(img.shape + (len(names),),
+                                    np.concatenate(coords),
+                                    np.concatenate(values))
+    return tmap, names
+
+
+def split_rows(mask, n):
+    """Split the rows containing selected voxels in a 2D mask into at most n
+    tiles of consecutive rows. Return (start, stop) pairs.
+    """
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if len(rows) == 0:
+        return []
+    start, stop = rows[0], rows[-1] + 1
+    bounds = np.linspace(start, stop, min(n, stop-start) + 1)
+    bounds = [int(round(x)) for x in bounds]
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if
+            np.any(mask[a:b])]
+
+
+def get_map_tasks(img, method, winsizes, masks, jobs):
+    """Split a texture map calculation into tasks for get_map_tile().
+
+    Each slice is a task of its own. Slices of LOCAL_METHODS are further split
+    into row tiles padded by the window halo, so that there are a few tasks
+    for each process. There are no tasks if no voxel is selected.
+    """
+    mask = dwi.util.unify_masks(masks)
+    indices = [i for i, x in enumerate(mask) if np.count_nonzero(x)]
+    if not indices:
+        return []
+    height = img.shape[1]
+    ntiles = 1
+    if method in LOCAL_METHODS:
+        ntiles = -(-4 * jobs // len(indices))  # Ceiling division.
+    halo_before = max(w // 2 for w in winsizes)
+    halo_after = max(w - w // 2 - 1 for w in winsizes)
+    winsize = max(winsizes)
+    params = dict(dwi.rcParams)
+    tasks = []
+    for i in indices:
+        if ntiles == 1:
+            tiles = [(0, height)]
+        else:
+            tiles = split_rows(mask[i], ntiles)
+        for start, stop in tiles:
+            a = max(0, start - halo_before)
+            b = min(height, stop + halo_after)
+            if b - a < winsize:
+                # The tile must be able to hold a window.
+                b = min(height, a + winsize)
+                a = max(0, b - winsize)
+            tile_masks = []
+            for m in masks:
+                tile_mask = np.zeros_like(m[i, a:b])
+                tile_mask[start-a:stop-a] = m[i, start:stop]
+                tile_masks.append(tile_mask)
+            task = dict(params=params, method=method, winsizes=winsizes,
+                        img=img[i, a:b], masks=tile_masks,
+                        rows=(start-a, stop-a), position=(i, start, stop))
+            tasks.append(task)
+    return tasks
+
+
+def get_map_tile(task, out=None):
+    """Calculate a texture map task made by get_map_tasks(). Write the result
+    into memory-mapped output defined by out as (path, shape, dtype) if
+    given, otherwise return the features and their names.
+    """
+    dwi.rcParams.update(task['params'])
+    dwi.rcParams['texture.jobs'] = 1
+    feats, names = get_map_feats(task['img'], task['method'],
+                                 task['winsizes'], task['masks'])
+    feats = feats[slice(*task['rows'])]
+    if out is None:
+        return feats, names
+    path, shape, dtype = out
+    i, start, stop = task['position']
+    tmap = np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+    tmap[i, start:stop, :, :] = feats
+    tmap.flush()
+    del tmap
+
+
+def get_texture_map_parallel(img, method, winsizes, masks, jobs):
+    """Texture map like get_texture_map(), calculated by a pool of processes.
+
+    The slices, or row tiles of them, are spread over the processes, which
+    write into a temporary memory-mapped map. One task is calculated before
+    the others to get the feature names. The map is returned as a memory-mapped
+    array, or written into HDF5 file if 'texture.path' is set.
+    """
+    path = dwi.rcParams['texture.path']
+    dtype = dwi.rcParams['texture.dtype']
+    tasks = get_map_tasks(img, method, winsizes, masks, jobs)
+    # Largest tasks go first for load balancing, except that the smallest one
+    # is calculated before the others, here.
+    tasks.sort(key=lambda x: -np.count_nonzero(dwi.util.unify_masks(
+        x['masks'])))
+    tasks.insert(0, tasks.pop())
+    feats, names = get_map_tile(tasks[0])
+    shape = img.shape + (len(names),)
+    fd, mappath = tempfile.mkstemp(suffix='.texture')
+    os.close(fd)
+    try:
+        tmap = np.memmap(mappath, dtype=dtype, mode='w+', shape=shape)
+        tmap.fill(np.nan)
+        i, start, stop = tasks[0]['position']
+        tmap[i, start:stop, :, :] = feats
+        tmap.flush()
+        pool = multiprocessing.Pool(jobs)
+        try:
+            pool.map(partial(get_map_tile, out=(mappath, shape, dtype)),
+                     tasks[1:], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        os.remove(mappath)  # The mapping stays valid until closed.
+    if path is not None:
+        dset = create_texture_file(path, shape, dtype)
+        for i in set(x['position'][0] for x in tasks):
+            dset[i, :, :, :] = tmap[i]
+        tmap = dset
     return tmap, names
 
 
-def get_texture(img, method, winspec, mask):
-    """General texture map layer."""
+def get_map_sums(img, method, winsizes, masks):
+    """Feature sums and voxel counts of a single slice (or tile), for the
+    selected voxels of each window size mask. Return them with feature names,
+    see get_map_feats().
+    """
+    feats, names = get_map_feats(img, method, winsizes, masks)
+    sums = np.zeros(len(names), dtype=np.float64)
+    counts = np.zeros(len(names), dtype=np.int64)
+    for w, m in zip(winsizes, masks):
+        indices = [i for i, n in enumerate(names) if n[0] == w]
+        sums[indices] = np.sum(feats[m][:, indices], axis=0, dtype=np.float64)
+        counts[indices] = np.count_nonzero(m)
+    return sums, counts, names
+
+
+def get_map_tile_sums(task):
+    """Calculate feature sums and counts of a texture map task made by
+    get_map_tasks().
+    """
+    dwi.rcParams.update(task['params'])
+    dwi.rcParams['texture.jobs'] = 1
+    return get_map_sums(task['img'], task['method'], task['winsizes'],
+                        task['masks'])
+
+
+def get_texture_map_mean(img, method, winsizes, masks):
+    """Average texture map features over the selected voxels of each window
+    size mask, as in get_texture_map().
+
+    The features are accumulated into running sums and counts a slice (or tile)
+    at a time, so the map is never built. With 'texture.jobs' more than one,
+    the tasks of get_map_tasks() are spread over a pool of processes. Return
+    the averages shaped (1, 1, 1, features).
+    """
+    jobs = dwi.rcParams['texture.jobs']
+    dtype = dwi.rcParams['texture.dtype']
+    mask = dwi.util.unify_masks(masks)
+    if not np.any(mask):
+        raise ValueError('No voxels selected')
+    if jobs > 1:
+        tasks = get_map_tasks(img, method, winsizes, masks, jobs)
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(get_map_tile_sums, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = (get_map_sums(img[i], method, winsizes, [m[i] for m in
+                                                            masks])
+                   for i, x in enumerate(mask) if np.count_nonzero(x))
+    sums = 0
+    counts = 0
+    for s, c, names in results:
+        sums += s
+        counts += c
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tmap = (sums / counts).astype(dtype)
+    tmap.shape = 1, 1, 1, len(names)
+    return tmap, names
+
+
+def parse_name(name):
+    """Split a texture feature name like '5-glcm(contrast,1,mean)' into window
+    specification, feature method, and a list of feature arguments.
+    """
+    winspec, feat = name.split('-', 1)
+    method, _, args = feat.partition('(')
+    args = args.rstrip(')').split(',') if args else []
+    return winspec, method, args
+
+
+def get_name_method(name):
+    """Return the texture method of a feature name."""
+    winspec, method, _ = parse_name(name)
+    if winspec in ('mbb', 'all'):
+        method = '{}_{}'.format(method, winspec)
+    return method
+
+
+def get_selection_params(method, names):
+    """Return configuration parameters that restrict a method to calculate only
+    what is needed for given feature names: GLCM properties and distances,
+    Gabor sigmas and frequencies, Haar levels, and HOG orientations.
+    """
+    args = [parse_name(x)[2] for x in names]
+    method = method.split('_')[0]
+
+    def select(key, index):
+        wanted = set(x[index] for x in args)
+        return tuple(x for x in dwi.rcParams[key] if str(x) in wanted)
+
+    params = {}
+    if method == 'glcm':
+        params['texture.glcm.names'] = select('texture.glcm.names', 0)
+        params['texture.glcm.distances'] = select('texture.glcm.distances', 1)
+    elif method == 'gabor':
+        params['texture.gabor.sigmas'] = select('texture.gabor.sigmas', 0)
+        params['texture.gabor.freqs'] = select('texture.gabor.freqs', 1)
+    elif method == 'haar':
+        params['texture.haar.levels'] = max(int(x[0]) for x in args)
+    elif (method == 'hog' and
+          dwi.util.iterable(dwi.rcParams['texture.hog.orientations'])):
+        params['texture.hog.orientations'] = select('texture.hog.orientations',
+                                                    0)
+    return params
+
+
+def get_selected_texture(img, method, winspec, mask, names):
+    """Texture map of only the features of given names, see get_texture().
+
+    The window sizes, and the method parameters selected by
+    get_selection_params(), are restricted to what the names need before
+    calculating. The features are returned in the order of names. Setting
+    'texture.path' is ignored.
+    """
+    winspecs = set(parse_name(x)[0] for x in names)
+    if dwi.util.iterable(winspec) and not dwi.util.isstring(winspec):
+        selected = [i for i, x in enumerate(winspec) if str(x) in winspecs]
+        if not selected:
+            raise ValueError('Features not available: {}'.format(names))
+        if isinstance(mask, (list, tuple)):
+            mask = [mask[i] for i in selected]
+        winspec = [winspec[i] for i in selected]
+    params = get_selection_params(method, names)
+    # Only the subset is returned, so the full map is not written on disk.
+    params['texture.path'] = None
+    with dwi.conf.rc_context(params):
+        tmap, allnames = get_texture(img, method, winspec, mask)
+    missing = [x for x in names if x not in allnames]
+    if missing:
+        raise ValueError('Features not available: {}'.format(missing))
+    indices = [allnames.index(x) for x in names]
+    if isinstance(tmap, dwi.sparse.SparseMap):
+        tmap = tmap.pick(indices)
+    else:
+        tmap = tmap[..., indices]
+    return tmap, list(names)
+
+
+def get_texture(img, method, winspec, mask, names=None):
+    """General texture map layer, see compute_texture().
+
+    If 'texture.cache.dir' is set, results are looked up from the cache in
+    that directory before calculating, see dwi.texture_cache. Results written
+    on disk by 'texture.path' are not cached.
+
+    If a list of feature names is given, only those features are calculated,
+    see get_selected_texture().
+    """
+    if names is not None:
+        return get_selected_texture(img, method, winspec, mask, names)
+    directory = dwi.rcParams['texture.cache.dir']
+    if directory is None or dwi.rcParams['texture.path'] is not None:
+        return compute_texture(img, method, winspec, mask)
+    cache = dwi.texture_cache.get_cache(directory,
+                                        dwi.rcParams['texture.cache.size'])
+    key = dwi.texture_cache.get_key(img, method, winspec, mask, dwi.rcParams)
+    result = cache.get(key)
+    if result is None:
+        result = compute_texture(img, method, winspec, mask)
+        cache.put(key, *result)
+    return result
+
+
+def compute_texture(img, method, winspec, mask):
+    """Calculate texture map.
+
+    Parameter winspec may also be a sequence of window sizes. Their features
+    are then calculated in one pass, sharing the computation that does not
+    depend on window size, and mask may be a sequence of masks, one for each
+    size.
+
+    A volumetric winspec like '5x5x3' uses 3D windows, see get_winshape().
+    They are calculated in one process, and 'texture.jobs' must be one.
+
+    Unless averaged, the result is a sparse map if 'texture.sparse' is set.
+    """
     avg = dwi.rcParams['texture.avg']
+    sparse = dwi.rcParams['texture.sparse'] and not avg
     dtype = dwi.rcParams['texture.dtype']
     assert img.ndim == 3, img.ndim
-    if mask is not None:
-        assert mask.dtype == bool
-        assert img.shape == mask.shape, (img.shape, mask.shape)
+    if isinstance(mask, (list, tuple)):
+        masks = mask
+    else:
+        masks = [mask]
+    for m in masks:
+        if m is not None:
+            assert m.dtype == bool
+            assert img.shape == m.shape, (img.shape, m.shape)
     call = METHODS[method]
     if winspec == 'all':
         assert method.endswith('_all')
@@ -153,31 +616,104 @@ def get_texture(img, method, winspec, mask):
         assert tmap.shape[-1] == len(names), (tmap.shape[-1], len(names))
         if avg:
             # It's all the same value.
-            # Feeding np.nanmean whole image hogs too much memory, circumvent.
-            tmap = np.array([np.nanmean(x) for x in np.rollaxis(tmap, -1)],
-                            dtype=dtype)
+            tmap = tmap.values.astype(dtype)
             tmap.shape = 1, 1, 1, len(names)
+        elif not sparse:
+            tmap = tmap.todense()
+        names = [(winspec, n) for n in names]
     elif winspec == 'mbb':
         assert method.endswith('_mbb')
         tmap, names = get_texture_mbb(img, call, mask)
         assert tmap.shape[-1] == len(names), (tmap.shape[-1], len(names))
         if avg:
-            # Take average of each slice; slice-wise they are the same value.
-            # Feeding np.nanmean whole image hogs too much memory, circumvent.
-            a = np.empty((len(tmap), len(names)), dtype=dtype)
-            for s, p in np.ndindex(a.shape):
-                a[s, p] = np.nanmean(tmap[s, :, :, p])
-            tmap = a
-            tmap = np.nanmean(tmap, axis=0)
+            # Take average of slices; slice-wise they are the same value.
+            tmap = np.nanmean(tmap.values, axis=0).astype(dtype)
             tmap.shape = 1, 1, 1, len(names)
-    else:
-        tmap, names = get_texture_map(img, call, int(winspec), mask)
-        assert tmap.shape[-1] == len(names), (tmap.shape[-1], len(names))
+        elif not sparse:
+            tmap = tmap.todense()
+        names = [(winspec, n) for n in names]
+    elif get_winshape(winspec) is not None:
+        if dwi.rcParams['texture.jobs'] > 1:
+            raise ValueError('Volumetric windows are calculated in one '
+                             'process, set texture.jobs to 1: {}'.format(
+                                 winspec))
+        if mask is None:
+            mask = np.ones(img.shape, dtype=bool)
+        tmap, names = get_texture_volume(img, method, get_winshape(winspec),
+                                         mask)
         if avg:
-            # Take average of all selected voxels.
-            tmap = tmap[mask, :]
-            assert tmap.ndim == 2
-            tmap = np.mean(tmap, axis=0)
+            tmap = np.mean(tmap[mask], axis=0)
             tmap.shape = 1, 1, 1, len(names)
-    names = ['{w}-{n}'.format(w=winspec, n=n) for n in names]
+        elif sparse:
+            tmap = dwi.sparse.from_dense(tmap, mask)
+        elif dwi.rcParams['texture.path'] is not None:
+            a = create_texture_file(dwi.rcParams['texture.path'], tmap.shape,
+                                    tmap.dtype)
+            for i, x in enumerate(tmap):
+                a[i, :, :, :] = x  # Whole slice at once, see chunks.
+            tmap = a
+        names = [(winspec, n) for n in names]
+    else:
+        if dwi.util.iterable(winspec) and not dwi.util.isstring(winspec):
+            winsizes = [int(x) for x in winspec]
+        else:
+            winsizes = [int(winspec)]
+        if len(masks) == 1:
+            masks = masks * len(winsizes)
+        assert len(masks) == len(winsizes), (len(masks), len(winsizes))
+        if avg:
+            # Take average of all selected voxels, separately for each window
+            # size, without building the map.
+            tmap, names = get_texture_map_mean(img, method, winsizes, masks)
+        else:
+            tmap, names = get_texture_map(img, method, winsizes, masks,
+                                          sparse=sparse)
+        assert tmap.shape[-1] == len(names), (tmap.shape[-1], len(names))
+    names = ['{w}-{n}'.format(w=w, n=n) for w, n in names]
     return tmap, names
+
+
+def get_textures(img, methods, winspecs, masks, qimg=None, names=None):
+    """Fused texture layer: calculate a sequence of methods on one image, and
+    merge their features.
+
+    Parameters winspecs and masks contain a window specification and a mask
+    (or sequence of masks) for each method, as in get_texture(). The methods
+    in QUANTIZED_METHODS use qimg, the image normalized and quantized once by
+    the caller, the others use img. If a list of feature names is given, only
+    those features are calculated, and returned in that order.
+    """
+    tmaps = []
+    outnames = []
+    for method, winspec, mask in zip(methods, winspecs, masks):
+        wanted = None
+        if names is not None:
+            wanted = [x for x in names if get_name_method(x) == method]
+            if not wanted:
+                continue
+        if method in QUANTIZED_METHODS:
+            if qimg is None:
+                raise ValueError('Quantized image needed: {}'.format(method))
+            tmap, n = get_texture(qimg, method, winspec, mask, names=wanted)
+        else:
+            tmap, n = get_texture(img, method, winspec, mask, names=wanted)
+        tmaps.append(tmap)
+        outnames += n
+    if names is not None:
+        missing = [x for x in names if x not in outnames]
+        if missing:
+            raise ValueError('Features not available: {}'.format(missing))
+    if len(tmaps) == 1:
+        tmap = tmaps[0]
+    elif isinstance(tmaps[0], dwi.sparse.SparseMap):
+        tmap = dwi.sparse.concatenate(tmaps)
+    else:
+        tmap = np.concatenate(tmaps, axis=-1)
+    if names is not None and outnames != list(names):
+        indices = [outnames.index(x) for x in names]
+        if isinstance(tmap, dwi.sparse.SparseMap):
+            tmap = tmap.pick(indices)
+        else:
+            tmap = tmap[..., indices]
+        outnames = list(names)
+    return tmap, outnames
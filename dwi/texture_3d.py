@@ -0,0 +1,241 @@
+"""Volumetric texture features with 3D windows.
+
+The map functions take a 3D image and a window shape (depth, height, width),
+and return a feature map of shape (features, depth, height, width) with the
+features placed at window origin, like the 2D map functions. Voxels without a
+full window around them are left zero.
+
+Most features are averages over window voxels, calculated as separable box
+filters (summed-area tables, see dwi.util.window_sums()). Gabor filters are
+convolved via FFT, and the rest is calculated in blocks of windows, see
+dwi.util.window_blocks().
+"""
+
+from __future__ import absolute_import, division, print_function
+from itertools import product
+
+import numpy as np
+from scipy import signal
+import skimage.feature
+
+import dwi.texture
+import dwi.texture_skimage
+import dwi.util
+
+# The 13 directions of a 3D neighbourhood, one of each opposite pair.
+DIRECTIONS = tuple(x for x in product((-1, 0, 1), repeat=3) if x > (0, 0, 0))
+
+# Plane names and axes for LBP on three orthogonal planes.
+PLANES = (('xy', (1, 2)), ('xz', (0, 2)), ('yz', (0, 1)))
+
+
+def origin_slices(shape, winshape):
+    """Return slices selecting the window origins in a map, see
+    dwi.util.window_origins().
+    """
+    return (slice(None),) + dwi.util.window_origins(shape, winshape)
+
+
+def box_mean(a, winshape):
+    """Return the window means of an array, indexed by window corner."""
+    return dwi.util.window_sums(a, winshape) / np.prod(winshape)
+
+
+# Basic statistical features
+
+
+def stats_map(img, winshape, mask=None):
+    """Statistical texture feature map. Calculated in blocks of windows."""
+    # Feature names from a dummy window, in case no window is selected.
+    names = list(dwi.texture.stats(np.zeros(np.prod(winshape))).keys())
+    output = np.zeros((len(names),) + img.shape, dtype=np.float64)
+    for pos, wins in dwi.util.window_blocks(img, winshape, mask=mask):
+        d = dwi.texture.stats(wins.reshape(len(wins), -1), axis=-1)
+        output[(slice(None),) + tuple(pos.T)] = list(d.values())
+    names = ['stats({})'.format(x) for x in names]
+    return output, names
+
+
+# Grey-Level Co-Occurrence Matrix (GLCM) features
+
+
+def sum_of_squared_counts(codes):
+    """Return the sum of squared counts of distinct values on each row."""
+    codes = np.sort(codes, axis=1)
+    n = codes.shape[1]
+    indices = np.arange(n) * np.ones_like(codes)
+    starts = np.ones(codes.shape, dtype=np.bool)
+    starts[:, 1:] = codes[:, 1:] != codes[:, :-1]
+    run_starts = np.maximum.accumulate(np.where(starts, indices, 0), axis=1)
+    # The k-th repeat of a value adds 2k+1 to the squared count.
+    return np.sum(2 * (indices - run_starts) + 1, axis=1)
+
+
+def glcm_pair_props(img, winshape, offset, corners):
+    """GLCM properties of the windows at given corners, for one offset.
+
+    The symmetric, normalized GLCM properties of scikit-image are calculated
+    from window sums of voxel pair functions, except for ASM, which is
+    calculated from the sorted pair codes of blocks of windows.
+    """
+    first, second = dwi.util.pair_slices(img.shape, offset)
+    a = img[first].astype(np.int64)
+    b = img[second].astype(np.int64)
+    pairshape = tuple(w - abs(o) for w, o in zip(winshape, offset))
+    n = np.prod(pairshape)
+
+    def sums(x):
+        return dwi.util.window_sums(x, pairshape, dtype=np.int64)[corners]
+
+    d = {}
+    diff2 = (a - b)**2
+    d['contrast'] = sums(diff2) / n
+    d['dissimilarity'] = sums(np.abs(a - b)) / n
+    d['homogeneity'] = (dwi.util.window_sums(1 / (1 + diff2), pairshape)
+                        [corners] / n)
+    # Mean and variance are the same for both voxels of symmetric pairs. The
+    # numerators are exact integers.
+    s = sums(a + b).astype(np.float64)
+    var = 2 * n * sums(a**2 + b**2) - s**2
+    cov = 4 * n * sums(a * b) - s**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        d['correlation'] = np.where(var == 0, 1, cov / var)
+    levels = int(img.max()) + 1  # Avoid wrapping around in uint8.
+    codes1 = dwi.util.window_view(a * levels + b, pairshape)
+    codes2 = dwi.util.window_view(b * levels + a, pairshape)
+    asm = np.empty(len(corners[0]), dtype=np.float64)
+    blocksize = 4096
+    for i in range(0, len(asm), blocksize):
+        block = tuple(x[i:i+blocksize] for x in corners)
+        codes = np.concatenate([codes1[block].reshape(len(block[0]), -1),
+                                codes2[block].reshape(len(block[0]), -1)],
+                               axis=1)
+        asm[i:i+blocksize] = sum_of_squared_counts(codes) / (2 * n)**2
+    d['ASM'] = asm
+    d['energy'] = np.sqrt(asm)
+    return d
+
+
+def glcm_map(img, winshape, mask=None):
+    """Grey-level co-occurrence matrix (GLCM) texture feature map in 13
+    directions.
+
+    Like the 2D version, features are averaged over directions, and their
+    range is also given. Directions whose offset does not fit in the window
+    are left out.
+    """
+    names = dwi.rcParams['texture.glcm.names']
+    distances = dwi.rcParams['texture.glcm.distances']
+    assert img.ndim == 3, img.shape
+    assert img.dtype == np.uint8, img.dtype
+    origins = dwi.util.window_origins(img.shape, winshape)
+    if mask is None:
+        mask = np.ones(img.shape, dtype=np.bool)
+    corners = np.nonzero(mask[origins])
+    props = []
+    for dist in distances:
+        offsets = [tuple(dist * x for x in d) for d in DIRECTIONS]
+        offsets = [x for x in offsets if
+                   all(abs(o) < w for o, w in zip(x, winshape))]
+        if offsets:
+            props.append((dist, [glcm_pair_props(img, winshape, x, corners)
+                                 for x in offsets]))
+    feats = []
+    outnames = []
+    for name in names:
+        for dist, p in props:
+            a = np.array([x[name] for x in p])
+            feats += [np.mean(a, axis=0), np.ptp(a, axis=0)]
+            outnames += [(name, dist, 'mean'), (name, dist, 'range')]
+    output = np.zeros((len(feats),) + img.shape, dtype=np.float64)
+    output[origin_slices(img.shape, winshape)][(slice(None),) + corners] = \
+        feats
+    names = ['glcm({},{},{})'.format(*x) for x in outnames]
+    return output, names
+
+
+# Local Binary Pattern (LBP) features
+
+
+def lbp_freq_map(img, winshape, mask=None):
+    """Local Binary Pattern (LBP) frequency histogram map on three orthogonal
+    planes (LBP-TOP).
+
+    The uniform patterns are calculated on each plane in each direction, with
+    radius of half the window in that plane, and their frequencies are
+    counted over the 3D window. Planes that are too thin are left out.
+    """
+    neighbours = dwi.rcParams['texture.lbp.neighbours']
+    n = neighbours + 2
+    feats = []
+    names = []
+    for plane, axes in PLANES:
+        radius = min(winshape[x] for x in axes) // 2
+        if radius == 0:
+            continue
+        axis, = set(range(3)) - set(axes)
+        patterns = [skimage.feature.local_binary_pattern(x, neighbours,
+                                                         radius,
+                                                         method='uniform')
+                    for x in np.rollaxis(img, axis)]
+        patterns = np.rollaxis(np.array(patterns), 0, axis+1)
+        for i in range(n):
+            feats.append(box_mean(patterns == i, winshape))
+            names.append('lbp({p},{r},{i})'.format(p=plane, r=radius, i=i))
+    output = np.zeros((len(feats),) + img.shape, dtype=np.float64)
+    output[origin_slices(img.shape, winshape)] = feats
+    return output, names
+
+
+# Gabor features
+
+
+def gabor_kernel(frequency, direction, sigma_x, sigma_y):
+    """Complex 3D Gabor kernel with a direction vector. The Gaussian envelope
+    has deviation sigma_x along the direction, and sigma_y across it, extended
+    to three deviations like in scikit-image.
+    """
+    direction = np.asarray(direction, dtype=np.float64)
+    direction /= np.linalg.norm(direction)
+    half = int(np.ceil(max(3 * sigma_x, 3 * sigma_y, 1)))
+    grid = np.mgrid[-half:half+1, -half:half+1, -half:half+1]
+    along = np.tensordot(direction, grid, axes=1)
+    across = np.sum(grid**2, axis=0) - along**2
+    g = np.exp(-0.5 * (along**2 / sigma_x**2 + across / sigma_y**2))
+    g /= (2 * np.pi)**1.5 * sigma_x * sigma_y**2
+    return g * np.exp(1j * 2 * np.pi * frequency * along)
+
+
+def gabor_map(img, winshape, mask=None):
+    """Gabor texture feature map with 3D filters.
+
+    The filters of the 13 directions are summed for orientation invariance
+    like in 2D, into a single kernel that is convolved via FFT, with reflected
+    borders. Window features are box filters over the response.
+    """
+    img = np.nan_to_num(np.asarray(img, dtype=np.float64))
+    sigmas = dwi.rcParams['texture.gabor.sigmas']
+    freqs = dwi.rcParams['texture.gabor.freqs']
+    feats = []
+    names = []
+    for sigma, freq in product(sigmas, freqs):
+        if sigma is None:
+            sigma_x = dwi.texture_skimage.get_sigma_x(freq)
+            sigma_y = dwi.texture_skimage.get_sigma_y(freq)
+        else:
+            sigma_x = sigma_y = sigma
+        kernel = sum(gabor_kernel(freq, x, sigma_x, sigma_y) for x in
+                     DIRECTIONS)
+        half = kernel.shape[0] // 2
+        padded = np.pad(img, half, mode='reflect')
+        response = signal.fftconvolve(padded, kernel, mode='valid')
+        real = response.real
+        mean = box_mean(real, winshape)
+        var = np.maximum(box_mean(real**2, winshape) - mean**2, 0)
+        feats += [mean, var, box_mean(np.abs(real), winshape),
+                  box_mean(np.abs(response), winshape)]
+        names += ['gabor({},{},{})'.format(sigma, freq, x) for x in
+                  dwi.texture_skimage.GABOR_FEAT_NAMES]
+    output = np.zeros((len(feats),) + img.shape, dtype=np.float64)
+    output[origin_slices(img.shape, winshape)] = feats
+    return output, names
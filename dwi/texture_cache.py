@@ -0,0 +1,158 @@
+"""Content-addressed cache for texture results on local disk.
+
+Results are keyed on a hash of the image and mask content, method, window
+specification, and the texture configuration parameters that affect the
+result. Each entry is a NumPy .npz file in the cache directory. When the total
+size exceeds a limit, the least recently used entries are evicted.
+"""
+
+from __future__ import absolute_import, division, print_function
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+import dwi.sparse
+import dwi.util
+
+log = logging.getLogger(__name__)
+
+# Configuration parameters that do not affect the result.
+IGNORED_PARAMS = ('texture.methods', 'texture.winsizes.large',
+                  'texture.winsizes.small', 'texture.path', 'texture.jobs',
+                  'texture.cache.dir', 'texture.cache.size')
+SUFFIX = '.npz'
+
+
+class TextureCache(object):
+    """Texture result cache in a directory, with a maximum size in bytes.
+
+    Attributes hits and misses count the lookups.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return '{}({}, hits={}, misses={})'.format(self.__class__.__name__,
+                                                   self.directory, self.hits,
+                                                   self.misses)
+
+    def path(self, key):
+        """Return entry path."""
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """Return cached (tmap, names), or None if not found."""
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                if 'coords' in f:
+                    rows = f['rows'] if 'rows' in f else None
+                    tmap = dwi.sparse.SparseMap(f['shape'], f['coords'],
+                                                f['tmap'], rows=rows)
+                else:
+                    tmap = f['tmap']
+                names = [str(x) for x in f['names']]
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path, None)  # Mark as recently used.
+        self.hits += 1
+        log.debug('Cache hit: %s', key)
+        return tmap, names
+
+    def put(self, key, tmap, names):
+        """Store result, then evict old entries if needed."""
+        fd, tmppath = tempfile.mkstemp(suffix=SUFFIX, dir=self.directory)
+        try:
+            if isinstance(tmap, dwi.sparse.SparseMap):
+                arrays = dict(tmap=tmap.values, coords=tmap.coords,
+                              shape=np.array(tmap.shape))
+                if tmap.rows is not None:
+                    arrays['rows'] = tmap.rows
+            else:
+                arrays = dict(tmap=np.asarray(tmap))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, names=np.array(names), **arrays)
+            os.rename(tmppath, self.path(key))  # Atomic on POSIX.
+        except Exception:
+            os.remove(tmppath)
+            raise
+        self.evict()
+
+    def entries(self):
+        """Return (last use time, size, path) of entries, oldest first."""
+        r = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(SUFFIX):
+                path = os.path.join(self.directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process.
+                r.append((st.st_mtime, st.st_size, path))
+        return sorted(r)
+
+    def size(self):
+        """Return total size of entries in bytes."""
+        return sum(x[1] for x in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until within maximum size."""
+        entries = self.entries()
+        total = sum(x[1] for x in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Removed by another process.
+            total -= size
+            log.debug('Cache evicted: %s', path)
+
+
+def update_hash(h, a):
+    """Update hash with array content, type, and shape."""
+    if a is None:
+        h.update(b'None')
+        return
+    a = np.ascontiguousarray(a)
+    h.update(str((a.dtype.str, a.shape)).encode())
+    h.update(a.tobytes())
+
+
+def get_key(img, method, winspec, mask, params):
+    """Return cache key for texture calculation."""
+    h = hashlib.sha1()
+    update_hash(h, img)
+    masks = mask if isinstance(mask, (list, tuple)) else [mask]
+    for m in masks:
+        update_hash(h, m)
+    if dwi.util.iterable(winspec) and not dwi.util.isstring(winspec):
+        winspec = [int(x) for x in winspec]
+    elif str(winspec).isdigit():
+        winspec = int(winspec)
+    items = sorted((k, v) for k, v in params.items() if
+                   k.startswith('texture.') and k not in IGNORED_PARAMS)
+    h.update(repr((method, winspec, items)).encode())
+    return h.hexdigest()
+
+
+_caches = {}
+
+
+def get_cache(directory, max_size):
+    """Return the cache object of a directory, shared within the process."""
+    if directory not in _caches:
+        _caches[directory] = TextureCache(directory, max_size)
+    cache = _caches[directory]
+    cache.max_size = max_size
+    return cache
@@ -53,19 +53,23 @@ def zernike_map(img, winsize, mask=None, output=None):
 
 
 def haar(img):
-    """Haar wavelet transform."""
+    """Haar wavelet transform.
+
+    Odd borders are padded by replicating the edge. Returns the coefficient
+    bands (approximation first) upsampled back to the padded image shape,
+    stacked into a single array.
+    """
     # Cannot have nans here, they might have global influence.
     img = np.asarray_chkfinite(img)
     assert img.ndim == 2
-    # assert img.shape[0] % 2 == img.shape[1] % 2 == 0
-    # Prune possible odd borders.
-    newshape = [x - x % 2 for x in img.shape]
-    img = img[:newshape[0], :newshape[1]]
+    pad = [(0, x % 2) for x in img.shape]
+    img = np.pad(img, pad, mode='edge')
     a = mahotas.haar(img)
     h, w = [x//2 for x in a.shape]
-    coeffs = [a[:h, :w], a[:h, w:],
-              a[h:, :w], a[h:, w:]]
-    coeffs = [ndimage.interpolation.zoom(l, 2.) for l in coeffs]
+    coeffs = np.array([a[:h, :w], a[:h, w:],
+                       a[h:, :w], a[h:, w:]])
+    # Zooming the stack in one go equals zooming each band separately.
+    coeffs = ndimage.interpolation.zoom(coeffs, (1, 2, 2))
     return coeffs
 
 
@@ -89,73 +93,258 @@ def haar_features(win):
     return d
 
 
-def haar_map(img, winsize, mask=None, output=None):
-    """Haar texture feature map."""
+def haar_maps(img, winsizes, mask=None):
+    """Haar texture feature maps for a sequence of window sizes.
+
+    The window features of haar_features() are calculated for all levels and
+    detail bands at once by box filtering the stacked coefficients, which are
+    calculated only once. NaN voxels are left out of the windows.
+    """
     nlevels = dwi.rcParams['texture.haar.levels']
-    # Cannot have nans here, they might have global influence.
-    nans = np.isnan(img)
-    if np.count_nonzero(nans):
-        img[nans] = 0  # XXX: Replace with minimum value instead?
+    img = np.asarray(img)
+    valid = ~np.isnan(img)
+    # Cannot have nans here, they might have global influence. Use a copy.
+    img = np.where(valid, img, 0)
     levels = haar_levels(img, nlevels, drop_approx=True)
+    crop = (slice(None),) + tuple(slice(0, x) for x in img.shape)
+    coeffs = np.concatenate(levels)[crop]
+    coeffs[:, ~valid] = 0
+    featnames = list(haar_features(coeffs[0]).keys())
     names = []
-    for i, coeffs in enumerate(levels):
-        for j, coeff in enumerate(coeffs):
-            for pos, win in dwi.util.sliding_window(coeff, winsize, mask):
-                feats = haar_features(win)
-                if output is None:
-                    dtype = dwi.rcParams['texture.dtype']
-                    output = np.zeros((len(levels), len(coeffs), len(feats),) +
-                                      coeff.shape, dtype=dtype)
-                for k, v in enumerate(feats.values()):
-                    output[(i, j, k,) + pos] = v
+    for i in range(nlevels):
+        for j in range(len(levels[i])):
             s = 'haar({level},{coeff},{feat})'
             names += [s.format(level=i+1, coeff=j+1, feat=k) for k in
-                      feats.keys()]
-    output.shape = (-1,) + levels[0][0].shape
-    return output, names
+                      featnames]
+
+    dtype = dwi.rcParams['texture.dtype']
+    output = np.zeros((len(winsizes), len(names)) + img.shape, dtype=dtype)
+    for i, winsize in enumerate(winsizes):
+        winshape = (winsize, winsize)
+        counts = dwi.util.window_sums(valid, winshape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aav = dwi.util.window_sums(np.abs(coeffs), (1,) + winshape)
+            aav /= counts
+            mean = dwi.util.window_sums(coeffs, (1,) + winshape) / counts
+            var = dwi.util.window_sums(coeffs**2, (1,) + winshape) / counts
+        var -= mean**2
+        std = np.sqrt(var.clip(min=0))
+        feats = np.stack([aav, std], axis=1)  # Shape (bands, feats, ...).
+        origins = dwi.util.window_origins(img.shape, winshape)
+        output[(i, slice(None)) + origins] = feats.reshape(
+            (-1,) + feats.shape[2:])
+    if mask is not None:
+        output[:, :, ~mask] = 0
+    return output, [names] * len(winsizes)
+
+
+def haar_map(img, winsize, mask=None, output=None):
+    """Haar texture feature map."""
+    outputs, outnames = haar_maps(img, [winsize], mask=mask)
+    if output is None:
+        output = outputs[0]
+    else:
+        output[...] = outputs[0]
+    return output, outnames[0]
+
+
+# Haralick
+
+
+# Feature labels, in the order of mahotas.features.texture.haralick_labels.
+HARALICK_LABELS = [
+    'Angular Second Moment',
+    'Contrast',
+    'Correlation',
+    'Sum of Squares: Variance',
+    'Inverse Difference Moment',
+    'Sum Average',
+    'Sum Variance',
+    'Sum Entropy',
+    'Entropy',
+    'Difference Variance',
+    'Difference Entropy',
+    'Information Measure of Correlation 1',
+    'Information Measure of Correlation 2',
+    'Maximal Correlation Coefficient',
+    ]
 
+# Pixel pair offsets of the four directions, at distance 1, like in mahotas.
+HARALICK_OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1))
 
-# Haralick (never used this because of those weird eigenvalue errors)
+
+def entropy(p, axis):
+    """Entropy in bits, with zero probabilities contributing nothing."""
+    return -np.sum(p * np.log2(np.where(p == 0, 1, p)), axis=axis)
+
+
+def cooccurrence(wins, levels, ignore_zeros=False):
+    """Symmetric grey-level co-occurrence counts of a stack of windows.
+
+    Returns an array of shape (windows, directions, levels, levels), counted by
+    a single bincount per direction over the pair codes of all windows.
+    """
+    n = len(wins)
+    base = np.arange(n, dtype=np.int64)[:, np.newaxis] * levels**2
+    cmats = []
+    for offset in HARALICK_OFFSETS:
+        first, second = dwi.util.pair_slices(wins.shape[1:], offset)
+        a = wins[(slice(None),) + first].reshape(n, -1).astype(np.int64)
+        b = wins[(slice(None),) + second].reshape(n, -1).astype(np.int64)
+        codes = np.concatenate([base + a * levels + b,
+                                base + b * levels + a], axis=1)
+        c = np.bincount(codes.ravel(), minlength=n * levels**2)
+        cmats.append(c.reshape(n, levels, levels))
+    cmats = np.stack(cmats, axis=1)
+    if ignore_zeros:
+        cmats[..., 0, :] = 0
+        cmats[..., :, 0] = 0
+    return cmats
+
+
+def max_correlation(p, px):
+    """Maximal correlation coefficient of a stack of normalized GLCMs.
+
+    Like in mahotas, this is the square root of the second largest eigenvalue
+    of the correlation matrix between the GLCM rows, over the grey levels that
+    occur. Instead of selecting the levels per matrix, the rest are masked out
+    to zero rows and columns, which only adds zero eigenvalues, so that all
+    matrices are decomposed in one batch. Rows without variance are taken as
+    uncorrelated instead of NaN, and the eigenvalues of the symmetric positive
+    semidefinite matrices are clipped at zero against rounding error.
+    """
+    valid = px > 0
+    nvalid = np.count_nonzero(valid, axis=-1)
+    if p.shape[-1] < 3:
+        return np.zeros(nvalid.shape)
+    w = valid.astype(np.float64)
+    mean = np.sum(p * w[..., np.newaxis, :], axis=-1) / np.maximum(nvalid, 1)[
+        ..., np.newaxis]
+    x = (p - mean[..., np.newaxis]) * w[..., np.newaxis, :] * w[..., :,
+                                                                np.newaxis]
+    cov = np.matmul(x, np.swapaxes(x, -1, -2))
+    var = np.diagonal(cov, axis1=-2, axis2=-1)
+    scale = np.where(var > 0, 1 / np.sqrt(np.where(var > 0, var, 1)), 0)
+    corr = cov * scale[..., np.newaxis] * scale[..., np.newaxis, :]
+    diag = np.arange(corr.shape[-1])
+    corr[..., diag, diag] = w
+    eigenvalues = np.linalg.eigvalsh(corr)
+    second = np.maximum(eigenvalues[..., -2], 0)
+    return np.where(nvalid > 2, np.sqrt(second), 0)
+
+
+def haralick_features(cmats, maxlevels):
+    """Haralick texture features of a stack of co-occurrence matrices.
+
+    The features are calculated as in mahotas for each matrix of shape (...,
+    levels, levels). Parameter maxlevels gives the number of grey levels of
+    each matrix as mahotas sees it (image maximum plus one), because the
+    difference variance depends on it. Returns an array of shape (..., 14).
+    Matrices without any counts give NaN.
+    """
+    shape, levels = cmats.shape[:-2], cmats.shape[-1]
+    # Flatten the stack, so that the dot products are matrix products.
+    cmats = cmats.reshape((-1, levels, levels))
+    maxlevels = np.broadcast_to(maxlevels, shape).ravel()
+    k = np.arange(levels, dtype=np.float64)
+    i, j = np.indices((levels, levels))
+    total = np.sum(cmats, axis=(-2, -1), dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = cmats / total[..., np.newaxis, np.newaxis]
+    pflat = p.reshape((len(p), -1))
+    px = np.sum(p, axis=-2)
+    py = np.sum(p, axis=-1)
+    ux = np.dot(px, k)
+    uy = np.dot(py, k)
+    vx = np.dot(px, k**2) - ux**2
+    vy = np.dot(py, k**2) - uy**2
+    sx = np.sqrt(np.maximum(vx, 0))
+    sy = np.sqrt(np.maximum(vy, 0))
+    # Sums over anti-diagonals (i + j) and diagonals (|i - j|).
+    plus = np.zeros((levels**2, 2 * levels))
+    plus[np.arange(levels**2), (i + j).ravel()] = 1
+    minus = np.zeros((levels**2, levels))
+    minus[np.arange(levels**2), np.abs(i - j).ravel()] = 1
+    px_plus_y = np.dot(pflat, plus)
+    px_minus_y = np.dot(pflat, minus)
+    tk = np.arange(2 * levels, dtype=np.float64)
+
+    f = np.empty((len(p), 14), dtype=np.float64)
+    f[..., 0] = np.sum(pflat**2, axis=-1)
+    f[..., 1] = np.dot(px_minus_y, k**2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (np.dot(pflat, (i * j).ravel()) - ux * uy) / (sx * sy)
+    f[..., 2] = np.where((sx == 0) | (sy == 0), 1, corr)
+    f[..., 3] = vx
+    f[..., 4] = np.dot(pflat, 1 / (1 + (i - j).ravel()**2))
+    f[..., 5] = np.dot(px_plus_y, tk)
+    f[..., 6] = np.dot(px_plus_y, tk**2) - f[..., 5]**2
+    f[..., 7] = entropy(px_plus_y, -1)
+    f[..., 8] = entropy(pflat, -1)
+    f[..., 9] = (np.sum(px_minus_y**2, axis=-1) / maxlevels -
+                 (np.sum(px_minus_y, axis=-1) / maxlevels)**2)
+    f[..., 10] = entropy(px_minus_y, -1)
+    hx = entropy(px, -1)
+    hy = entropy(py, -1)
+    cross = px[..., :, np.newaxis] * py[..., np.newaxis, :]
+    cross = cross.reshape(pflat.shape)
+    hxy1 = -np.sum(pflat * np.log2(np.where(cross == 0, 1, cross)), axis=-1)
+    hxy2 = entropy(cross, -1)
+    hmax = np.maximum(hx, hy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        f[..., 11] = np.where(hmax == 0, f[..., 8] - hxy1,
+                              (f[..., 8] - hxy1) / hmax)
+    f[..., 12] = np.sqrt(np.maximum(0, 1 - np.exp(-2 * (hxy2 - f[..., 8]))))
+    f[..., 13] = max_correlation(p, px)
+    f[total == 0] = np.nan
+    return f.reshape(shape + (14,))
+
+
+def haralick_windows(wins, levels, ignore_zeros=False):
+    """Haralick features of a stack of windows, averaged over directions."""
+    cmats = cooccurrence(wins, levels, ignore_zeros=ignore_zeros)
+    maxlevels = wins.reshape(len(wins), -1).max(axis=1) + 1
+    feats = haralick_features(cmats, maxlevels[:, np.newaxis])
+    return np.mean(feats, axis=1)
 
 
 def haralick(img, ignore_zeros=False):
     """Haralick texture features.
 
-    14 features provided by mahotas. Averaged over 4 directions for orientation
-    invariance.
-
-    Note: This implementation has some issues, it fails with some input raising
-    an exception about eigenvectors not converging.
+    14 features, computed like in mahotas, but vectorized. Averaged over 4
+    directions for orientation invariance.
     """
     assert img.ndim == 2, img.shape
     assert img.dtype == np.uint8, img.dtype
-    a = mahotas.features.texture.haralick(img, ignore_zeros,
-                                          compute_14th_feature=True)
-    a = np.mean(a, axis=0)
-    return a, mahotas.features.texture.haralick_labels
+    a = haralick_windows(img[np.newaxis], int(img.max()) + 1,
+                         ignore_zeros=ignore_zeros)[0]
+    return a, HARALICK_LABELS
 
 
 def haralick_map(img, winsize, mask=None, output=None, ignore_zeros=False):
-    """Haralick texture feature map."""
-    for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
-        feats, names = haralick(win, ignore_zeros=ignore_zeros)
-        if output is None:
-            dtype = dwi.rcParams['texture.dtype']
-            output = np.zeros((len(names),) + img.shape, dtype=dtype)
-        for i, v in enumerate(feats):
-            output[(i,) + pos] = v
+    """Haralick texture feature map. Calculated in blocks of windows."""
+    assert img.dtype == np.uint8, img.dtype
+    levels = int(img.max()) + 1
+    if output is None:
+        dtype = dwi.rcParams['texture.dtype']
+        output = np.zeros((len(HARALICK_LABELS),) + img.shape, dtype=dtype)
+    # Small blocks, as each window has a stack of levels by levels matrices.
+    for pos, wins in dwi.util.window_blocks(img, winsize, mask=mask,
+                                            blocksize=256):
+        feats = haralick_windows(wins, levels, ignore_zeros=ignore_zeros)
+        output[(slice(None),) + tuple(pos.T)] = feats.T
     names = ['haralick({i}-{n})'.format(i=i+1, n=abbrev(n))
-             for i, n in enumerate(names)]
+             for i, n in enumerate(HARALICK_LABELS)]
     return output, names
 
 
 def haralick_mbb(img, mask):
     """Haralick features for selected area inside minimum bounding box."""
     positions = dwi.util.bounding_box(mask)
-    slices = [slice(*t) for t in positions]
-    img = img[slices]
+    slices = tuple(slice(*t) for t in positions)
+    img = img[slices].copy()  # Do not modify the shared image.
     mask = mask[slices]
-    img[-mask] = 0
+    img[~mask] = 0
     feats, names = haralick(img, ignore_zeros=True)
     names = ['haralick({i}-{n})'.format(i=i+1, n=abbrev(n))
              for i, n in enumerate(names)]
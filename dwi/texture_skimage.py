@@ -73,7 +73,7 @@ def glcm_mbb(img, mask):
     """Single GLCM features for selected area inside minimum bounding box."""
     positions = dwi.util.bounding_box(mask)
     slices = [slice(*t) for t in positions]
-    img = img[slices]
+    img = img[slices].copy()  # Do not modify the shared image.
     mask = mask[slices]
     img[-mask] = 0
     feats = glcm_props(img, ignore_zeros=True)
@@ -85,25 +85,39 @@ def glcm_mbb(img, mask):
 # Local Binary Pattern (LBP) features
 
 
-def lbp_freq_map(img, winsize, mask=None):
-    """Local Binary Pattern (LBP) frequency histogram map."""
+def lbp_freq_maps(img, winsizes, mask=None):
+    """Local Binary Pattern (LBP) frequency histogram maps for a sequence of
+    window sizes. The patterns are calculated once for each distinct radius.
+    """
     neighbours = dwi.rcParams['texture.lbp.neighbours']
-    radius = winsize // 2
     n = neighbours + 2
-    freqs = skimage.feature.local_binary_pattern(img, neighbours, radius,
-                                                 method='uniform')
-    assert freqs.max() == n - 1, freqs.max()
-    output = np.zeros((n,) + img.shape, dtype=np.float32)
-    # for i, a in enumerate(output):
-    #     a[:, :] = (freqs == i)
-    for origin, win in dwi.util.sliding_window(freqs, winsize, mask=mask):
-        for i in range(n):
-            output[i][origin] = np.count_nonzero(win == i) / win.size
-    assert len(output) == n, output.shape
-    names = ['lbp({r},{i})'.format(r=radius, i=i) for i in range(n)]
-    # if mask is not None:
-    #     output[:, -mask] = 0
-    return output, names
+    patterns = {}
+    outputs = []
+    outnames = []
+    for winsize in winsizes:
+        radius = winsize // 2
+        if radius not in patterns:
+            patterns[radius] = skimage.feature.local_binary_pattern(
+                img, neighbours, radius, method='uniform')
+        freqs = patterns[radius]
+        assert freqs.max() == n - 1, freqs.max()
+        output = np.zeros((n,) + img.shape, dtype=np.float32)
+        for pos, wins in dwi.util.window_blocks(freqs, winsize, mask=mask):
+            wins = wins.reshape(len(wins), -1)
+            pos = tuple(pos.T)
+            for i in range(n):
+                output[(i,) + pos] = np.mean(wins == i, axis=-1)
+        assert len(output) == n, output.shape
+        outputs.append(output)
+        outnames.append(['lbp({r},{i})'.format(r=radius, i=i)
+                         for i in range(n)])
+    return np.array(outputs), outnames
+
+
+def lbp_freq_map(img, winsize, mask=None):
+    """Local Binary Pattern (LBP) frequency histogram map."""
+    outputs, outnames = lbp_freq_maps(img, [winsize], mask=mask)
+    return outputs[0], outnames[0]
 
 
 # Gabor features
@@ -112,9 +126,10 @@ def lbp_freq_map(img, winsize, mask=None):
 GABOR_FEAT_NAMES = ('mean', 'var', 'absmean', 'mag')
 
 
-def gabor_feats(real, imag):
-    return (np.mean(real), np.var(real), np.mean(np.abs(real)),
-            np.mean(np.sqrt(real**2+imag**2)))
+def gabor_feats(real, imag, axis=None):
+    return (np.mean(real, axis=axis), np.var(real, axis=axis),
+            np.mean(np.abs(real), axis=axis),
+            np.mean(np.sqrt(real**2+imag**2), axis=axis))
 
 
 def gabor(img):
@@ -151,12 +166,13 @@ def gabor_featmap(real, imag, winsize, mask):
     image.
     """
     assert real.shape == imag.shape, (real.shape, imag.shape)
-    rit = iter(dwi.util.sliding_window(real, winsize, mask=mask))
-    iit = iter(dwi.util.sliding_window(imag, winsize, mask=mask))
+    rit = dwi.util.window_blocks(real, winsize, mask=mask)
+    iit = dwi.util.window_blocks(imag, winsize, mask=mask)
     shape = (len(GABOR_FEAT_NAMES),) + real.shape
     output = np.full(shape, np.nan, dtype=np.float32)
-    for ((y, x), rwin), (_, iwin) in zip(rit, iit):
-        output[:, y, x] = gabor_feats(rwin, iwin)
+    for (pos, rwins), (_, iwins) in zip(rit, iit):
+        output[(slice(None),) + tuple(pos.T)] = gabor_feats(rwins, iwins,
+                                                            axis=(1, 2))
     return output
 
 
@@ -184,14 +200,16 @@ def get_sigma_y(frequency, bandwidth=None):
             (np.sqrt(2) * np.pi * frequency * np.tan(bandwidth / 2)))
 
 
-def gabor_map(img, winsize, mask=None, output=None):
-    """Gabor texture feature map. This is the (more) correct way."""
+def gabor_maps(img, winsizes, mask=None):
+    """Gabor texture feature maps for a sequence of window sizes. The filter
+    responses are calculated only once.
+    """
     img = np.asarray(img, dtype=np.float32)
     sigmas = dwi.rcParams['texture.gabor.sigmas']
     freqs = dwi.rcParams['texture.gabor.freqs']
     thetas = get_angles(dwi.rcParams['texture.gabor.orientations'])
     featnames = GABOR_FEAT_NAMES
-    tmaps = []
+    tmaps = [[] for _ in winsizes]
     outnames = []
     reals = np.empty((len(thetas),) + img.shape, dtype=np.float32)
     imags = np.empty_like(reals)
@@ -214,13 +232,19 @@ def gabor_map(img, winsize, mask=None, output=None):
         # Sum orientations for invariance.
         real = np.sum(reals, axis=0)
         imag = np.sum(imags, axis=0)
-        featmaps = gabor_featmap(real, imag, winsize, mask)
-        for featmap, name in zip(featmaps, featnames):
-            tmaps.append(featmap)
+        for i, winsize in enumerate(winsizes):
+            tmaps[i].extend(gabor_featmap(real, imag, winsize, mask))
+        for name in featnames:
             s = 'gabor{}'.format((sigma, freq, name)).translate(None, " '")
             outnames.append(s)
     output = np.array(tmaps)
-    return output, outnames
+    return output, [outnames] * len(winsizes)
+
+
+def gabor_map(img, winsize, mask=None, output=None):
+    """Gabor texture feature map. This is the (more) correct way."""
+    outputs, outnames = gabor_maps(img, [winsize], mask=mask)
+    return outputs[0], outnames[0]
 
 
 # Histogram of Oriented Gradients (HOG)
@@ -242,17 +266,96 @@ def hog(img):
     return np.mean(feats)
 
 
+def hog_gradients(img):
+    """Gradient magnitude and unsigned orientation in degrees [0, 180) like in
+    skimage.feature.hog(), for the whole image.
+    """
+    img = np.asarray(img, dtype=np.float64)
+    g_row = np.zeros_like(img)
+    g_col = np.zeros_like(img)
+    g_row[1:-1, :] = img[2:, :] - img[:-2, :]
+    g_col[:, 1:-1] = img[:, 2:] - img[:, :-2]
+    magnitude = np.hypot(g_col, g_row)
+    orientation = np.rad2deg(np.arctan2(g_row, g_col)) % 180
+    return g_row, g_col, magnitude, orientation
+
+
+def hog_histograms(gradients, winsize, orientations):
+    """Orientation histograms of all windows from an integral histogram.
+
+    The result has shape (orientations, height-winsize+1, width-winsize+1),
+    indexed by window corner. Each window is handled as an image of its own,
+    like hog() does: the gradient is zero along its border, which leaves the
+    outermost rows and columns with pure vertical or horizontal differences.
+    """
+    g_row, g_col, magnitude, orientation = gradients
+    shape = tuple(x-winsize+1 for x in magnitude.shape)
+    hists = np.zeros((orientations,) + shape)
+    if winsize < 3:
+        return hists  # No room for any gradient.
+    w = winsize
+    # Bin i contains orientations within [edges[i], edges[i+1]).
+    edges = 180 / orientations * np.arange(orientations + 1)
+    bins = np.searchsorted(edges, orientation, side='right') - 1
+    inner = (slice(1, None), slice(1, None))
+    for i in range(orientations):
+        weights = np.where(bins == i, magnitude, 0)
+        hists[i] = dwi.util.window_sums(weights[inner], (w-2, w-2))[
+            :shape[0], :shape[1]]
+    # Top and bottom rows have orientation 0, sides have 90.
+    rows = dwi.util.window_sums(np.abs(g_col)[:, 1:], (1, w-2))
+    cols = dwi.util.window_sums(np.abs(g_row)[1:, :], (w-2, 1))
+    hists[0] += rows[:shape[0], :shape[1]] + rows[w-1:, :shape[1]]
+    i = np.searchsorted(edges, 90, side='right') - 1
+    hists[i] += cols[:shape[0], :shape[1]] + cols[:shape[0], w-1:]
+    hists /= w * w
+    return hists
+
+
+def hog_normalize(hists, eps=1e-5):
+    """Normalize histograms along the first axis with L2-Hys, the default block
+    normalization of skimage.feature.hog().
+    """
+    hists = hists / np.sqrt(np.sum(hists**2, axis=0) + eps**2)
+    hists = np.minimum(hists, 0.2)
+    hists /= np.sqrt(np.sum(hists**2, axis=0) + eps**2)
+    return hists
+
+
+def hog_maps(img, winsizes, mask=None):
+    """Histogram of oriented gradients (HOG) texture feature maps for a
+    sequence of window sizes.
+
+    The gradients are calculated once for the image, and the window
+    histograms are looked up from an integral histogram, giving the same
+    features as hog() does for each window. Parameter
+    'texture.hog.orientations' can also be a sequence, giving one feature for
+    each number of orientations.
+    """
+    orientations = dwi.rcParams['texture.hog.orientations']
+    if dwi.util.iterable(orientations):
+        names = ['hog({})'.format(x) for x in orientations]
+    else:
+        orientations = [orientations]
+        names = ['hog']
+    gradients = hog_gradients(img)
+    dtype = dwi.rcParams['texture.dtype']
+    output = np.zeros((len(winsizes), len(orientations)) + img.shape,
+                      dtype=dtype)
+    for i, winsize in enumerate(winsizes):
+        origins = dwi.util.window_origins(img.shape, winsize)
+        for j, n in enumerate(orientations):
+            hists = hog_histograms(gradients, winsize, n)
+            output[(i, j) + origins] = np.mean(hog_normalize(hists), axis=0)
+    if mask is not None:
+        output[:, :, ~mask] = 0
+    return output, [names] * len(winsizes)
+
+
 def hog_map(img, winsize, mask=None, output=None):
     """Histogram of oriented gradients (HOG) texture feature map."""
-    for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
-        feats = [hog(win)]
-        if output is None:
-            dtype = dwi.rcParams['texture.dtype']
-            output = np.zeros((len(feats),) + img.shape, dtype=dtype)
-        for i, v in enumerate(feats):
-            output[(i,) + pos] = v
-    names = ['hog']
-    return output, names
+    outputs, outnames = hog_maps(img, [winsize], mask=mask)
+    return outputs[0], outnames[0]
 
 
 # Hu moments.
@@ -311,3 +414,11 @@ def sobel_map(img, winsize=None, mask=None):
     output = np.array([sobel(img), sobel(img, mask=mask)])
     names = ['sobel', 'sobel_mask']
     return output, names
+
+
+def sobel_maps(img, winsizes, mask=None):
+    """Sobel edge descriptor maps, calculated once and repeated for each window
+    size.
+    """
+    output, names = sobel_map(img, mask=mask)
+    return np.array([output] * len(winsizes)), [names] * len(winsizes)
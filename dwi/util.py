@@ -150,7 +150,7 @@ def sliding_window(a, winshape, mask=None):
 
     Yields window origin (center) and view to window. Window won't overlap
     image border. If a mask array is provided, windows are skipped unless
-    origin is selected in mask.
+    origin is selected in mask. See window_blocks() for a batched version.
     """
     a = np.asanyarray(a)
     winshape = normalize_sequence(winshape, a.ndim)
@@ -165,6 +165,94 @@ def sliding_window(a, winshape, mask=None):
             yield origin, window
 
 
+def window_view(a, winshape):
+    """Return a read-only strided view of all full sliding windows, without
+    copying. The view has shape a.shape - winshape + 1 + winshape, indexed by
+    window corner followed by position inside window.
+    """
+    a = np.asanyarray(a)
+    winshape = normalize_sequence(winshape, a.ndim)
+    if not all(0 < w <= i for w, i in zip(winshape, a.shape)):
+        raise Exception('Invalid window shape: {}'.format(winshape))
+    shape = tuple(i-w+1 for i, w in zip(a.shape, winshape)) + tuple(winshape)
+    view = np.lib.stride_tricks.as_strided(a, shape=shape,
+                                           strides=a.strides * 2)
+    view.flags.writeable = False
+    return view
+
+
+def window_blocks(a, winshape, mask=None, blocksize=4096):
+    """Batched sliding window iterator with arbitrary window shape.
+
+    Like sliding_window(), but yields windows in blocks of at most blocksize,
+    as (origins, windows), where origins is an integer array of shape [n,
+    ndim], and windows is an array of shape [n] + winshape (not squeezed). The
+    windows are taken from window_view(), only the block at hand is copied.
+    Window origins (centers) follow the convention of sliding_window(); if a
+    mask array is provided, windows are skipped unless origin is selected in
+    mask.
+    """
+    a = np.asanyarray(a)
+    view = window_view(a, winshape)
+    corners, winshape = view.shape[:a.ndim], view.shape[a.ndim:]
+    if mask is None:
+        indices = np.arange(np.prod(corners, dtype=np.intp))
+    else:
+        mask = np.asanyarray(mask)[window_origins(a.shape, winshape)]
+        indices = np.flatnonzero(mask)
+    halves = np.array(winshape) // 2
+    for i in range(0, len(indices), blocksize):
+        corner = np.unravel_index(indices[i:i+blocksize], corners)
+        origins = np.transpose(corner) + halves
+        yield origins, view[corner]
+
+
+def window_sums(a, winshape, dtype=np.float64):
+    """Sum of each full sliding window, calculated as a separable box filter on
+    cumulative sums (summed-area table).
+
+    Result has one item per window, indexed by window corner; thus its shape is
+    a.shape - winshape + 1. Use window_origins() to place it by window origin
+    like sliding_window() does.
+    """
+    a = np.asanyarray(a)
+    winshape = normalize_sequence(winshape, a.ndim)
+    if not all(0 < w <= i for w, i in zip(winshape, a.shape)):
+        raise Exception('Invalid window shape: {}'.format(winshape))
+    for axis, w in enumerate(winshape):
+        if w == 1:
+            continue
+        shape = list(a.shape)
+        shape[axis] = 1
+        c = np.concatenate([np.zeros(shape, dtype=dtype),
+                            np.cumsum(a, axis=axis, dtype=dtype)], axis=axis)
+        head = [slice(None)] * a.ndim
+        tail = [slice(None)] * a.ndim
+        head[axis] = slice(None, -w)
+        tail[axis] = slice(w, None)
+        a = c[tuple(tail)] - c[tuple(head)]
+    return a.astype(dtype, copy=False)
+
+
+def window_origins(shape, winshape):
+    """Return slices that select window origins of full sliding windows in an
+    array of given shape. See window_sums().
+    """
+    winshape = normalize_sequence(winshape, len(shape))
+    return tuple(slice(w//2, w//2 + i-w+1) for i, w in zip(shape, winshape))
+
+
+def pair_slices(shape, offset):
+    """Return slices that select the first and second voxels of the voxel
+    pairs at given offset.
+    """
+    first = tuple(slice(max(0, -o), n - max(0, o)) for n, o in
+                  zip(shape, offset))
+    second = tuple(slice(max(0, o), n - max(0, -o)) for n, o in
+                   zip(shape, offset))
+    return first, second
+
+
 def bounding_box(array, pad=0):
     """Return the minimum bounding box with optional padding.
 
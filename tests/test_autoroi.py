@@ -0,0 +1,152 @@
+"""Tests for dwi.autoroi."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+
+import dwi.autoroi
+import dwi.mask
+
+
+# Reference implementations scoring and adding one ROI at a time.
+
+
+def get_roi_scores(img, d, params):
+    """Return array of all scores for each possible ROI of given dimension."""
+    shape = [img.shape[i]-d[i]+1 for i in range(3)] + [len(params)]
+    scores = np.empty(shape)
+    for z, y, x, i in np.ndindex(scores.shape):
+        roi = img[z:z+d[0], y:y+d[1], x:x+d[2], i]
+        scores[z, y, x, i] = dwi.autoroi.get_score_param(roi, params[i])
+    return scores
+
+
+def get_scoremap(img, d, params, n_rois):
+    """Return array like original image, with scores of n_rois best ROI's."""
+    scores = get_roi_scores(img, d, params)
+    for i in range(len(params)):
+        dwi.autoroi.scale_scores(scores[..., i])
+    scores = np.sum(scores, axis=-1)  # Sum scores parameter-wise.
+    indices = scores.ravel().argsort()  # Sort ROI's by score.
+    indices = indices[-n_rois:]  # Select best ones.
+    indices = [np.unravel_index(i, scores.shape) for i in indices]
+    scoremap = np.zeros(img.shape[0:3] + (1,))
+    for z, y, x in indices:
+        scoremap[z:z+d[0], y:y+d[1], x:x+d[2], 0] += scores[z, y, x]
+    return scoremap
+
+
+def locate_roi(scoremap, roidim, prostate_mask=None):
+    """Find optimal ROI in score map."""
+    scoremap_params = ['score']
+    if prostate_mask:
+        scoremap = dwi.autoroi.add_mask(scoremap, prostate_mask)
+        scoremap_params += ['prostate_mask_strict']
+    roimap = get_scoremap(scoremap, roidim, scoremap_params, 1)
+    return [axis[0] for axis in roimap[..., 0].nonzero()]
+
+def find_roi(img, roidim, params, prostate_mask=None, depthmin=2, depthmax=3,
+             sidemin=10, sidemax=10, n_rois=500):
+    """Find ROI from the sum of the score maps of each dimension."""
+    dims = [(j, i, i) for i in range(sidemin, sidemax+1)
+            for j in range(depthmin, depthmax+1)]
+    if prostate_mask:
+        img = dwi.autoroi.add_mask(img, prostate_mask)
+        params = params + ['prostate_mask']
+    scoremap = sum(get_scoremap(img, d, params, n_rois) for d in dims)
+    return scoremap[..., 0], locate_roi(scoremap, roidim, prostate_mask)
+
+
+def get_image(shape=(5, 16, 16), seed=0):
+    """Random ADC and K like image, and a prostate mask."""
+    rng = np.random.RandomState(seed)
+    img = np.stack([rng.uniform(0.0005, 0.002, size=shape),
+                    rng.uniform(500, 1500, size=shape)], axis=-1)
+    mask = np.zeros(shape, dtype=bool)
+    mask[1:-1, 2:-2, 3:-3] = True
+    return img, ['ADCm', 'K'], dwi.mask.Mask3D(mask)
+
+
+class TestScoremap(unittest.TestCase):
+    def test_get_scoremap(self):
+        for seed in range(4):
+            img, params, mask = get_image(seed=seed)
+            img = dwi.autoroi.add_mask(img, mask)
+            params = params + ['prostate_mask']
+            for d, n_rois in [((2, 3, 3), 20), ((3, 5, 5), 100)]:
+                np.testing.assert_allclose(
+                    dwi.autoroi.get_scoremap(img, d, params, n_rois),
+                    get_scoremap(img, d, params, n_rois), rtol=1e-9)
+
+    def test_locate_roi(self):
+        rng = np.random.RandomState(0)
+        for seed in range(6):
+            _, _, mask = get_image(seed=seed)
+            scoremap = rng.rand(*mask.shape() + (1,))
+            for prostate_mask in (None, mask):
+                d = dwi.autoroi.locate_roi(scoremap, (2, 5, 5),
+                                           prostate_mask=prostate_mask)
+                self.assertEqual(d['roi_corner'],
+                                 locate_roi(scoremap, (2, 5, 5),
+                                            prostate_mask=prostate_mask))
+
+
+class TestScores(unittest.TestCase):
+    def test_get_roi_scores(self):
+        params = ['ADCm', 'K', 'score', 'prostate_mask',
+                  'prostate_mask_strict', 'foo']
+        for seed in range(3):
+            img, _, mask = get_image(seed=seed)
+            img = np.concatenate([img, img[..., :1] * 1000, mask.array[...,
+                                  np.newaxis], mask.array[..., np.newaxis],
+                                  img[..., :1]], axis=-1)
+            # Boxes of zero ADC score zero.
+            img[1:4, 2:8, 2:8, 0] = 0
+            for d in [(1, 1, 1), (2, 3, 3), (3, 5, 4), (5, 16, 16)]:
+                np.testing.assert_allclose(
+                    dwi.autoroi.get_roi_scores(img, d, params),
+                    get_roi_scores(img, d, params), rtol=1e-9)
+
+
+class TestFindROI(unittest.TestCase):
+    combinations = [(1, 2, 3, 4, 10), (2, 3, 3, 3, 30), (1, 3, 4, 5, 30),
+                    (2, 2, 3, 5, 10)]
+
+    def test_find_roi(self):
+        for seed in range(3):
+            img, params, mask = get_image(seed=seed)
+            for prostate_mask in (None, mask):
+                for c in self.combinations:
+                    d = dwi.autoroi.find_roi(img, (2, 3, 3), params,
+                                             prostate_mask, *c)
+                    scoremap, corner = find_roi(img, (2, 3, 3), params,
+                                                prostate_mask, *c)
+                    np.testing.assert_allclose(d['scoremap'], scoremap,
+                                               rtol=1e-9)
+                    self.assertEqual(d['roi_corner'], corner)
+                    self.assertEqual(d['roi_coords'],
+                                     [(x, x+n) for x, n in zip(corner,
+                                                               (2, 3, 3))])
+
+    def test_find_roi_sweep(self):
+        for seed in range(3):
+            img, params, mask = get_image(seed=seed)
+            for prostate_mask in (None, mask):
+                results = list(dwi.autoroi.find_roi_sweep(
+                    img, (2, 3, 3), params, self.combinations,
+                    prostate_mask=prostate_mask))
+                self.assertEqual(sorted(c for c, _ in results),
+                                 sorted(self.combinations))
+                self.assertEqual([c[4] for c, _ in results],
+                                 sorted(c[4] for c in self.combinations))
+                for c, d in results:
+                    expected = dwi.autoroi.find_roi(img, (2, 3, 3), params,
+                                                    prostate_mask, *c)
+                    np.testing.assert_allclose(d['scoremap'],
+                                               expected['scoremap'])
+                    self.assertEqual(d['roi_corner'], expected['roi_corner'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Tests for tools/get_texture.py."""
+
+from __future__ import absolute_import, division, print_function
+import os.path
+import runpy
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import dwi.conf
+import dwi.doit
+import dwi.files
+
+TOOL = os.path.join(os.path.dirname(__file__), '..', 'tools',
+                    'get_texture.py')
+
+
+def run_tool(*args):
+    """Run the tool in this process."""
+    argv = sys.argv
+    sys.argv = [TOOL] + [str(x) for x in args]
+    try:
+        with dwi.conf.rc_context({}):
+            runpy.run_path(TOOL, run_name='__main__')
+    finally:
+        sys.argv = argv
+
+
+class TestFused(unittest.TestCase):
+    """Methods merged in one pass equal the per-method files."""
+    mode = 'DWI-Mono-ADCm'
+    masktype = 'lesion'
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        img = rng.uniform(0, 0.004, size=(3, 32, 32, 1))
+        self.inpath = os.path.join(self.tempdir, 'img.h5')
+        dwi.files.write_pmap(self.inpath, img, dict(parameters=['ADCm']))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_texture(self, methods, winsizes, name):
+        outpath = os.path.join(self.tempdir, name + '.h5')
+        run_tool('--mode', self.mode, '--input', self.inpath,
+                 '--method', *(list(methods) + ['--winspec'] + list(winsizes) +
+                               ['--voxel', 'mean', '--output', outpath]))
+        tmap, attrs = dwi.files.read_pmap(outpath)
+        return tmap.ravel(), list(attrs['parameters'])
+
+    def test_default_methods(self):
+        # Like dodo.py get_task_texture_fused(): the union of window sizes is
+        # given to all methods.
+        methods, winsizes = [], []
+        for method, winsize in dwi.doit.texture_methods_winsizes(
+                self.mode, self.masktype):
+            if method not in methods:
+                methods.append(method)
+            if winsize not in winsizes + ['all', 'mbb']:
+                winsizes.append(winsize)
+        fused, names = self.get_texture(methods, winsizes, 'fused')
+        values, allnames = [], []
+        for method in methods:
+            w = dwi.doit.texture_winsizes(self.masktype, self.mode, method)
+            v, n = self.get_texture([method], w, method)
+            values.append(v)
+            allnames += n
+        self.assertEqual(names, allnames)
+        np.testing.assert_allclose(fused, np.concatenate(values))
+
+
+if __name__ == '__main__':
+    unittest.main()
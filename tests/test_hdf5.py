@@ -0,0 +1,30 @@
+"""Tests for dwi.hdf5."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+
+import dwi.hdf5
+
+
+class TestSliceChunks(unittest.TestCase):
+    def test_slice_chunks(self):
+        nbytes = dwi.hdf5.CHUNK_BYTES
+        # Whole planes with as many parameters as fit.
+        shape = (20, 64, 64, 100)
+        chunks = dwi.hdf5.slice_chunks(shape, np.float32)
+        self.assertEqual(chunks[:3], (1, 64, 64))
+        self.assertLessEqual(np.prod(chunks) * 4, nbytes)
+        self.assertGreater((chunks[3] + 1) * 64 * 64 * 4, nbytes)
+        self.assertEqual(dwi.hdf5.slice_chunks((20, 64, 64, 3),
+                                               np.float32),
+                         (1, 64, 64, 3))
+        # Rows of a single parameter for a plane that does not fit.
+        shape = (2, 1024, 1024, 5)
+        chunks = dwi.hdf5.slice_chunks(shape, np.float64)
+        self.assertEqual(chunks, (1, nbytes // (1024 * 8), 1024, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
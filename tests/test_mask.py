@@ -0,0 +1,93 @@
+"""Tests for dwi.mask."""
+
+from __future__ import absolute_import, division, print_function
+from collections import defaultdict
+import unittest
+
+import numpy as np
+
+import dwi.mask
+import dwi.util
+
+
+def max_mask(mask, winsize):
+    """Reference maximum count mask by a sliding window."""
+    d = defaultdict(list)
+    for pos, win in dwi.util.sliding_window(mask, winsize, mask=mask):
+        d[np.count_nonzero(win)].append(pos)
+    r = np.zeros_like(mask)
+    for pos in d[max(d)] if d else []:
+        r[pos] = True
+    return r
+
+
+def portion_mask(mask, winsize, portion=1, resort_to_max=True):
+    """Reference portion mask by a sliding window."""
+    r = np.zeros_like(mask)
+    for pos, win in dwi.util.sliding_window(mask, winsize, mask=mask):
+        if np.count_nonzero(win) / win.size >= portion:
+            r[pos] = True
+    if resort_to_max and np.count_nonzero(r) == 0:
+        r = max_mask(mask, winsize)
+    return r
+
+
+def border(mask):
+    """Reference border by a sliding window."""
+    out = np.zeros_like(mask, dtype=bool)
+    winshape = [max(x//70, 3) for x in mask.shape]
+    for i, win in dwi.util.sliding_window(mask, winshape):
+        selected = np.count_nonzero(win) / win.size
+        if 0.3 < selected < 0.7:
+            out[i] = True
+    return out
+
+
+def get_masks(shape=(4, 20, 24), seed=0):
+    """Random masks of varying density, and a blob."""
+    rng = np.random.RandomState(seed)
+    masks = [rng.rand(*shape) < p for p in (0.2, 0.5, 0.9)]
+    blob = np.zeros(shape, dtype=bool)
+    blob[1:3, 4:15, 6:20] = True
+    masks += [blob, np.zeros(shape, dtype=bool)]
+    return masks
+
+
+class TestWindowMasks(unittest.TestCase):
+    """Box-filter count masks equal the sliding window loops."""
+
+    def test_window_counts(self):
+        for mask in get_masks():
+            for winshape in [(1, 3, 3), (3, 5, 2), (4, 20, 24)]:
+                counts = dwi.mask.window_counts(mask, winshape)
+                expected = np.full(mask.shape, -1)
+                for pos, win in dwi.util.sliding_window(mask, winshape):
+                    expected[pos] = np.count_nonzero(win)
+                np.testing.assert_array_equal(counts, expected)
+
+    def test_max_mask(self):
+        for mask in get_masks():
+            for winshape in [(1, 3, 3), (1, 5, 5), (3, 3, 3)]:
+                np.testing.assert_array_equal(
+                    dwi.mask.max_mask(mask, winshape),
+                    max_mask(mask, winshape))
+
+    def test_portion_mask(self):
+        for mask in get_masks():
+            for winshape in [(1, 3, 3), (1, 5, 5), (3, 3, 3)]:
+                for portion in (0, 0.5, 0.75, 1):
+                    for resort_to_max in (False, True):
+                        np.testing.assert_array_equal(
+                            dwi.mask.portion_mask(mask, winshape, portion,
+                                                  resort_to_max),
+                            portion_mask(mask, winshape, portion,
+                                         resort_to_max))
+
+    def test_border(self):
+        for mask in get_masks() + get_masks(shape=(3, 220, 150)):
+            np.testing.assert_array_equal(dwi.mask.border(mask),
+                                          border(mask))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests for dwi.sparse."""
+
+from __future__ import absolute_import, division, print_function
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import dwi.conf
+import dwi.hdf5
+import dwi.sparse
+import dwi.texture
+
+
+def get_map(shape=(3, 8, 9, 4), seed=0):
+    """Random dense map with NaN background, and its voxel mask."""
+    rng = np.random.RandomState(seed)
+    mask = rng.rand(*shape[:-1]) < 0.3
+    a = np.full(shape, np.nan)
+    a[mask] = rng.rand(np.count_nonzero(mask), shape[-1])
+    return a, mask
+
+
+class TestSparseMap(unittest.TestCase):
+    def test_dense(self):
+        a, mask = get_map()
+        pmap = dwi.sparse.from_dense(a, mask)
+        self.assertEqual(pmap.shape, a.shape)
+        self.assertEqual(len(pmap.coords), np.count_nonzero(mask))
+        np.testing.assert_array_equal(pmap.todense(), a)
+        np.testing.assert_array_equal(np.asarray(pmap), a)
+        np.testing.assert_array_equal(pmap.pick([3, 1]).todense(),
+                                      a[..., [3, 1]])
+
+    def test_rows(self):
+        # Voxels sharing value rows, like 'mbb' textures.
+        a, mask = get_map()
+        values = np.arange(12).reshape(3, 4)
+        coords = np.argwhere(mask)
+        pmap = dwi.sparse.SparseMap(a.shape, coords, values,
+                                    rows=coords[:, 0])
+        expected = np.full(a.shape, np.nan)
+        expected[mask] = values[np.nonzero(mask)[0]]
+        np.testing.assert_array_equal(pmap.todense(), expected)
+
+    def test_concatenate(self):
+        rng = np.random.RandomState(0)
+        a, b, c = rng.rand(3, 3, 8, 9, 4)
+        _, mask = get_map(seed=0)
+        _, other = get_map(seed=1)
+        maps = [dwi.sparse.from_dense(x, mask) for x in (a, b)]
+        expected = np.concatenate([a, b], axis=-1)
+        expected[~mask] = np.nan
+        np.testing.assert_array_equal(
+            dwi.sparse.concatenate(maps).todense(), expected)
+        # Voxels missing from a map are NaN.
+        maps.append(dwi.sparse.from_dense(c, other))
+        expected = np.concatenate([a, b, c], axis=-1)
+        expected[~mask, :8] = np.nan
+        expected[~other, 8:] = np.nan
+        pmap = dwi.sparse.concatenate(maps)
+        np.testing.assert_array_equal(np.argwhere(mask | other), pmap.coords)
+        np.testing.assert_array_equal(pmap.todense(), expected)
+
+    def test_hdf5(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            a, mask = get_map()
+            path = os.path.join(tempdir, 'sparse.h5')
+            coords = np.argwhere(mask)
+            for rows in (None, coords[:, 0]):
+                values = a[mask] if rows is None else a[0, 0, :3]
+                pmap = dwi.sparse.SparseMap(a.shape, coords, values,
+                                            rows=rows)
+                dwi.hdf5.write_hdf5(path, pmap, dict(parameters=list('abcd')))
+                p, attrs = dwi.hdf5.read_hdf5(path)
+                self.assertIsInstance(p, dwi.sparse.SparseMap)
+                self.assertEqual(list(attrs['parameters']), list('abcd'))
+                np.testing.assert_array_equal(p.todense(), pmap.todense())
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestSparseTexture(unittest.TestCase):
+    """Sparse texture maps equal dense ones at the selected voxels."""
+
+    def test_get_texture(self):
+        rng = np.random.RandomState(0)
+        img = rng.rand(3, 16, 16)
+        mask = np.zeros(img.shape, dtype=bool)
+        mask[1, 4:-4, 3:-5] = True
+        mask[2, 6:-6, 5:-5] = True
+        for method, winspec in [('stats', [3, 5]), ('stats_mbb', 'mbb'),
+                                ('stats_all', 'all'), ('stats', '3x3x3')]:
+            dense, names = dwi.texture.get_texture(img, method, winspec,
+                                                   mask)
+            with dwi.conf.rc_context({'texture.sparse': True}):
+                tmap, n = dwi.texture.get_texture(img, method, winspec, mask)
+            self.assertIsInstance(tmap, dwi.sparse.SparseMap)
+            self.assertEqual(n, names)
+            np.testing.assert_array_equal(np.argwhere(mask), tmap.coords)
+            np.testing.assert_array_equal(tmap.voxel_values(), dense[mask])
+
+
+if __name__ == '__main__':
+    unittest.main()
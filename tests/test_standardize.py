@@ -0,0 +1,100 @@
+"""Tests for dwi.standardize."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+
+import dwi.standardize
+
+
+def transform(img, p, scores, scale, mapped_scores):
+    """Reference transform, mapping one voxel at a time."""
+    p1, p2 = p
+    s1, s2 = scale
+    scores = [p1] + list(scores) + [p2]
+    mapped_scores = [s1] + list(mapped_scores) + [s2]
+    r = np.zeros_like(img, dtype=np.int16)
+    # As float, so that small integer types do not wrap around, and clipped
+    # before conversion, so that far outliers do not overflow.
+    for pos, v in np.ndenumerate(img.astype(np.float64)):
+        # Select slot where to map.
+        slot = sum(v > s for s in scores)
+        slot = np.clip(slot, 1, len(scores)-1)
+        v = dwi.standardize.map_onto_scale(
+            scores[slot-1], scores[slot], mapped_scores[slot-1],
+            mapped_scores[slot], v)
+        r[pos] = np.clip(v, s1-1, s2+1)
+    return r
+
+
+class TestTransform(unittest.TestCase):
+    scale = (1, 4095)
+    mapped_scores = (400, 800, 1200, 1200, 2000)
+
+    def check(self, img, p, scores):
+        a = dwi.standardize.transform(img, p, scores, self.scale,
+                                      self.mapped_scores)
+        b = transform(img, p, scores, self.scale, self.mapped_scores)
+        self.assertEqual(a.dtype, np.int16)
+        np.testing.assert_array_equal(a, b)
+
+    def test_integer(self):
+        rng = np.random.RandomState(0)
+        img = rng.gamma(2, 300, size=(3, 20, 30, 1))
+        # Tied landmarks, and values beyond the percentile scores.
+        p, scores = (50, 1500), (200, 400, 700, 700, 1000)
+        for dtype in (np.uint8, np.int16, np.uint16, np.int32):
+            a = np.clip(img, 0, np.iinfo(dtype).max).astype(dtype)
+            self.check(a, p, scores)
+        self.check(np.array([-32768, -1, 0, 32767], dtype=np.int16), p,
+                   scores)
+
+    def test_float(self):
+        rng = np.random.RandomState(0)
+        img = rng.gamma(2, 300, size=(3, 20, 30, 1))
+        p, scores = (50.5, 1500.25), (200.1, 400, 700.7, 700.7, 1000)
+        self.check(img, p, scores)
+        self.check(img.astype(np.float32), p, scores)
+        # Values exactly at landmarks.
+        self.check(np.array([50.5, 200.1, 700.7, 1500.25]), p, scores)
+
+
+class TestLandmarkScoresStream(unittest.TestCase):
+    pc = (0., 99.8)
+    landmarks = tuple(range(10, 100, 10))
+
+    def check(self, img, bins=2**16):
+        for thresholding in ('none', 'mean', 'median'):
+            a = dwi.standardize.landmark_scores(img, self.pc, self.landmarks,
+                                                thresholding)
+            b = dwi.standardize.landmark_scores_stream(img, self.pc,
+                                                       self.landmarks,
+                                                       thresholding,
+                                                       bins=bins)
+            np.testing.assert_allclose(a[0], b[0])
+            np.testing.assert_allclose(a[1], b[1])
+
+    def test_integer(self):
+        rng = np.random.RandomState(0)
+        img = rng.gamma(2, 300, size=(6, 50, 40, 1)).astype(np.int16)
+        self.check(img)
+
+    def test_float(self):
+        rng = np.random.RandomState(0)
+        img = rng.gamma(2, 300, size=(6, 50, 40, 1))
+        img[0, 0, 0, 0] = np.nan
+        self.check(img)
+        self.check(img, bins=16)
+
+    def test_float_outlier(self):
+        rng = np.random.RandomState(0)
+        img = rng.gamma(2, 300, size=(6, 50, 40, 1)).astype(np.float32)
+        img[1, 10, 3, 0] = 1e9
+        self.check(img)
+        img[1, 10, 3, 0] = -1e9
+        self.check(img)
+
+
+if __name__ == '__main__':
+    unittest.main()
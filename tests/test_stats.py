@@ -0,0 +1,229 @@
+"""Tests for dwi.stats."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+import scipy.stats
+import sklearn.metrics
+
+import dwi.stats
+
+
+def get_samples(n=40, seed=0, ties=False):
+    """Random binary labels, and values that tend to be greater for the
+    positives.
+    """
+    rng = np.random.RandomState(seed)
+    y = rng.rand(n) < 0.4
+    y[:2] = True, False
+    x = rng.randn(n) + y
+    if ties:
+        x = np.round(x)
+    return y.astype(int), x
+
+
+def delong_cov(labels, values):
+    """Reference DeLong AUCs and covariance from all pairs of positive and
+    negative samples, in O(n^2).
+    """
+    positive = labels == labels.max()
+    x = values[:, positive]
+    y = values[:, ~positive]
+    psi = ((x[:, :, np.newaxis] > y[:, np.newaxis, :]) +
+           0.5 * (x[:, :, np.newaxis] == y[:, np.newaxis, :]))
+    aucs = np.mean(psi, axis=(1, 2))
+    v10 = np.mean(psi, axis=2)  # Positive sample components.
+    v01 = np.mean(psi, axis=1)  # Negative sample components.
+    cov = (np.atleast_2d(np.cov(v10)) / x.shape[1] +
+           np.atleast_2d(np.cov(v01)) / y.shape[1])
+    return aucs, cov
+
+def icc(baselines):
+    """Reference ICC(3,1) of a single (k, n) array."""
+    data = np.array(baselines)
+    k, n = data.shape  # Number of raters, targets.
+    mpt = np.mean(data, axis=0)  # Mean per target.
+    mpr = np.mean(data, axis=1)  # Mean per rater.
+    tm = np.mean(data)  # Total mean.
+    wss = sum(sum((data-mpt)**2))  # Within-target sum of squares.
+    rss = sum((mpr-tm)**2) * n  # Between-rater sum of squares.
+    bss = sum((mpt-tm)**2) * k  # Between-target sum of squares.
+    bms = bss / (n-1)  # Between-target mean of squares.
+    ess = wss - rss  # Residual sum of squares.
+    ems = ess / ((k-1) * (n-1))  # Residual mean of squares.
+    return (bms - ems) / (bms + (k-1)*ems)
+
+
+class TestMannWhitney(unittest.TestCase):
+    def test_mann_whitney_aucs(self):
+        for seed, ties in [(0, False), (1, True), (2, True)]:
+            y, x = get_samples(seed=seed, ties=ties)
+            indices = dwi.stats.bootstrap_indices_stratified(y, 50,
+                                                             random_state=0)
+            aucs = dwi.stats.mann_whitney_aucs(y, x, indices)
+            expected = [sklearn.metrics.roc_auc_score(y[i], x[i]) for i in
+                        indices]
+            np.testing.assert_allclose(aucs, expected)
+            # A single resample may be given as a vector.
+            np.testing.assert_allclose(
+                dwi.stats.mann_whitney_aucs(y, x, np.arange(len(y))),
+                [sklearn.metrics.roc_auc_score(y, x)])
+
+    def test_bootstrap_aucs(self):
+        y, x = get_samples(ties=True)
+        aucs = dwi.stats.bootstrap_aucs(y, x, 100, random_state=5)
+        indices = dwi.stats.bootstrap_indices_stratified(y, 100,
+                                                         random_state=5)
+        for i, auc in zip(indices, aucs):
+            # Resamples are stratified.
+            self.assertEqual(np.count_nonzero(y[i]), np.count_nonzero(y))
+            _, _, expected = dwi.stats.calculate_roc_auc(y[i], x[i],
+                                                         scale=False)
+            self.assertAlmostEqual(auc, expected)
+
+
+class TestDeLong(unittest.TestCase):
+    def test_midranks(self):
+        rng = np.random.RandomState(0)
+        a = np.round(rng.randn(3, 4, 30))
+        expected = np.apply_along_axis(scipy.stats.rankdata, -1, a)
+        np.testing.assert_allclose(dwi.stats.midranks(a), expected)
+
+    def test_delong_cov(self):
+        for seed, ties in [(0, False), (1, True)]:
+            y, x = get_samples(seed=seed, ties=ties)
+            rng = np.random.RandomState(seed)
+            values = np.array([x, x + rng.randn(len(x)), -x, np.round(x * 3)])
+            aucs, cov = dwi.stats.delong_cov(y, values)
+            expected_aucs, expected_cov = delong_cov(y, values)
+            np.testing.assert_allclose(aucs, expected_aucs)
+            np.testing.assert_allclose(cov, expected_cov, atol=1e-15)
+            np.testing.assert_allclose(
+                aucs, [sklearn.metrics.roc_auc_score(y, v) for v in values])
+            # A single classifier.
+            auc, var = dwi.stats.delong_cov(y, x)
+            np.testing.assert_allclose(var, expected_cov[:1, :1])
+
+    def test_compare_aucs_delong(self):
+        y, x = get_samples()
+        rng = np.random.RandomState(0)
+        values = np.array([x, x + rng.randn(len(x)), x + rng.randn(len(x))])
+        aucs, cov = dwi.stats.delong_cov(y, values)
+        D, z, p = dwi.stats.compare_aucs_delong(aucs, cov)
+        for i, j in [(0, 1), (0, 2), (2, 1)]:
+            d = aucs[i] - aucs[j]
+            sd = np.sqrt(cov[i, i] + cov[j, j] - 2 * cov[i, j])
+            self.assertAlmostEqual(D[i, j], d)
+            self.assertAlmostEqual(z[i, j], d / sd)
+            self.assertAlmostEqual(p[i, j], 1 - scipy.stats.norm.cdf(
+                abs(d / sd)))
+            self.assertAlmostEqual(z[j, i], -z[i, j])
+
+    def test_roc_auc(self):
+        y, x = get_samples()
+        for values in (x, -x):
+            d = dwi.stats.roc_auc(y, values, autoflip=True, delong=True)
+            _, cov = delong_cov(y, np.atleast_2d(x))
+            self.assertAlmostEqual(d['auc'],
+                                   sklearn.metrics.roc_auc_score(y, x))
+            self.assertAlmostEqual(d['var'], cov[0, 0])
+            self.assertEqual(d['flipped'], values is not x)
+            self.assertTrue(0 <= d['ci1'] < d['auc'] < d['ci2'] <= 1)
+
+
+class TestICC(unittest.TestCase):
+    def get_baselines(self, shape=(5, 2, 30), seed=0):
+        """Repeated measurements of targets, for a stack of parameters."""
+        rng = np.random.RandomState(seed)
+        targets = rng.randn(shape[0], 1, shape[2])
+        return targets + 0.5 * rng.randn(*shape)
+
+    def test_icc(self):
+        for k in (2, 3):
+            data = self.get_baselines(shape=(5, k, 30))
+            np.testing.assert_allclose(dwi.stats.icc(data),
+                                       [icc(x) for x in data])
+            self.assertAlmostEqual(dwi.stats.icc(data[0]), icc(data[0]))
+
+    def test_bootstrap_icc(self):
+        data = self.get_baselines()
+        n = data.shape[-1]
+        indices = np.random.RandomState(3).randint(0, n, (100, n))
+        values = [[icc(x[:, i]) for i in indices] for x in data]
+        expected = (np.mean(values, axis=-1),) + dwi.stats.conf_int(values)
+        for blocksize in (1, 30, 256):
+            result = dwi.stats.bootstrap_icc(data, nboot=100, random_state=3,
+                                             blocksize=blocksize)
+            np.testing.assert_allclose(result, expected)
+        # The same resamples are used for each parameter.
+        for x, mean, ci1, ci2 in zip(data, *result):
+            np.testing.assert_allclose(
+                dwi.stats.bootstrap_icc(x, nboot=100, random_state=3),
+                (mean, ci1, ci2))
+
+    def test_repeatability_coeff(self):
+        data = np.abs(self.get_baselines()) + 1
+        a1, a2 = data[:, 0].T, data[:, 1].T  # Shaped (samples, params).
+        d = dwi.stats.repeatability_coeff(a1, a2)
+        for i in range(a1.shape[1]):
+            e = dwi.stats.repeatability_coeff(a1[:, i], a2[:, i])
+            for key, value in e.items():
+                self.assertAlmostEqual(d[key][i], value)
+        a = np.concatenate([a1, a2])
+        np.testing.assert_allclose(d['avg'], np.mean(a, axis=0))
+        msd = np.sqrt(np.sum((a1 - a2)**2, axis=0) / (len(a1) - 1))
+        np.testing.assert_allclose(d['cor'], 1.96 * msd)
+        np.testing.assert_allclose(d['wcv'], msd / np.sqrt(2) / d['avg'])
+
+
+class TestCompareAUCs(unittest.TestCase):
+    def test_compare_aucs_matrix(self):
+        y, x = get_samples()
+        rng = np.random.RandomState(0)
+        aucs = np.array([dwi.stats.bootstrap_aucs(y, v, 200, random_state=1)
+                         for v in (x, x + rng.randn(len(x)),
+                                   x + 2 * rng.randn(len(x)), x)])
+        D, z, p = dwi.stats.compare_aucs_matrix(aucs)
+        for i in range(len(aucs)):
+            for j in range(len(aucs)):
+                if i == j or set([i, j]) == set([0, 3]):
+                    # Equal arrays have no deviation.
+                    self.assertEqual(D[i, j], 0)
+                    continue
+                expected = dwi.stats.compare_aucs(aucs[i], aucs[j])
+                np.testing.assert_allclose((D[i, j], z[i, j], p[i, j]),
+                                           expected, rtol=1e-9, atol=1e-12)
+
+
+class TestCorrelations(unittest.TestCase):
+    def test_correlations(self):
+        rng = np.random.RandomState(0)
+        n = 30
+        y = np.round(rng.randn(n) * 2)
+        x = np.stack([y + rng.randn(n), np.round(-y + rng.randn(n)),
+                      rng.randn(n), np.full(n, 2.0), y], axis=1)
+        x[3, 2] = np.nan
+        for method, f in [('spearman', scipy.stats.spearmanr),
+                          ('pearson', scipy.stats.pearsonr)]:
+            d = dwi.stats.correlations(x, y, method=method)
+            for i in range(x.shape[1]):
+                if i in (2, 3):
+                    # Non-finite or equal values.
+                    self.assertTrue(np.isnan(d['r'][i]))
+                    continue
+                r, p = f(x[:, i], y)
+                self.assertAlmostEqual(d['r'][i], r)
+                np.testing.assert_allclose(d['p'][i], p, rtol=1e-6,
+                                           atol=1e-300)
+                delta = 1.96 / np.sqrt(n - 3)
+                self.assertAlmostEqual(d['lower'][i],
+                                       np.tanh(np.arctanh(r) - delta))
+                self.assertAlmostEqual(d['upper'][i],
+                                       np.tanh(np.arctanh(r) + delta))
+        with self.assertRaises(ValueError):
+            dwi.stats.correlations(x, y, method='kendall')
+
+
+if __name__ == '__main__':
+    unittest.main()
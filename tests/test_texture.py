@@ -0,0 +1,223 @@
+"""Tests for dwi.texture."""
+
+from __future__ import absolute_import, division, print_function
+from itertools import product
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import dwi.conf
+import dwi.texture
+import dwi.util
+
+
+def get_image(shape=(3, 24, 24), levels=32, seed=0):
+    """Random quantized image and a mask selecting a square in the middle
+    slice.
+    """
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, levels, size=shape).astype(np.uint8)
+    mask = np.zeros(shape, dtype=bool)
+    mask[shape[0] // 2, 6:-6, 6:-6] = True
+    return img, mask
+
+
+class TestWindowSizes(unittest.TestCase):
+    """Several window sizes in one pass equal separate runs."""
+
+    def check(self, img, method, winsizes, mask, **params):
+        with dwi.conf.rc_context(params):
+            tmap, names = dwi.texture.get_texture(img, method, winsizes, mask)
+            tmaps, allnames = [], []
+            for winsize in winsizes:
+                t, n = dwi.texture.get_texture(img, method, winsize, mask)
+                tmaps.append(t)
+                allnames += n
+        self.assertEqual(names, allnames)
+        np.testing.assert_allclose(tmap, np.concatenate(tmaps, axis=-1))
+
+    def test_glcm(self):
+        # GLCM leaves out distances that do not fit in the window, so the
+        # number of features depends on window size.
+        img, mask = get_image()
+        for avg in (False, True):
+            self.check(img, 'glcm', [3, 5], mask, **{'texture.avg': avg})
+
+    def test_multi_methods(self):
+        img, mask = get_image()
+        img = img.astype(np.float64)
+        for method in ('hog', 'haar', 'sobel'):
+            self.check(img, method, [5, 7], mask, **{'texture.avg': False})
+
+
+class TestParallel(unittest.TestCase):
+    """Maps calculated by a pool of processes equal serial ones."""
+
+    def check(self, img, method, winsizes, mask, **params):
+        with dwi.conf.rc_context(params):
+            expected, names = dwi.texture.get_texture(img, method, winsizes,
+                                                      mask)
+            with dwi.conf.rc_context({'texture.jobs': 2}):
+                tmap, n = dwi.texture.get_texture(img, method, winsizes,
+                                                  mask)
+        self.assertEqual(n, names)
+        np.testing.assert_allclose(np.asarray(tmap), expected)
+
+    def test_methods(self):
+        img, mask = get_image(shape=(3, 32, 32))
+        mask[0, 8:-8, 8:-8] = True
+        for avg in (False, True):
+            # Local methods are split into row tiles, others by slice.
+            self.check(img, 'glcm', [3, 5], mask, **{'texture.avg': avg})
+            self.check(img.astype(np.float64), 'stats', [5], mask,
+                       **{'texture.avg': avg})
+            self.check(img.astype(np.float64), 'lbp', [3, 5], mask,
+                       **{'texture.avg': avg})
+
+    def test_map_tasks(self):
+        # Tiles cover the selected rows of each slice once.
+        img, mask = get_image(shape=(3, 32, 32))
+        mask[0, 4:9, 4:9] = True
+        masks = [mask, np.roll(mask, 3, axis=1)]
+        tasks = dwi.texture.get_map_tasks(img, 'glcm', [3, 7], masks, 4)
+        covered = np.zeros(mask.shape[:2], dtype=int)
+        for task in tasks:
+            i, start, stop = task['position']
+            self.assertEqual(stop - start, task['rows'][1] - task['rows'][0])
+            self.assertGreaterEqual(len(task['img']), 7)
+            covered[i, start:stop] += 1
+        selected = np.any(dwi.util.unify_masks(masks), axis=-1)
+        self.assertTrue(np.all(covered[selected] == 1))
+        self.assertEqual(dwi.texture.get_map_tasks(
+            img, 'glcm', [3], [np.zeros_like(mask)], 4), [])
+
+
+class TestOnDisk(unittest.TestCase):
+    """Maps written on disk by 'texture.path' equal maps in memory."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_texture_path(self):
+        img, mask = get_image(shape=(4, 24, 24))
+        mask[2, 8:-8, 8:-8] = True
+        expected, names = dwi.texture.get_texture(img, 'glcm', [3, 5], mask)
+        for jobs, compression in product((1, 2), ('gzip', 'lzf', 'none')):
+            path = os.path.join(self.tempdir, '{}{}.h5'.format(jobs,
+                                                               compression))
+            params = {'texture.path': path, 'texture.jobs': jobs,
+                      'texture.compression': compression}
+            with dwi.conf.rc_context(params):
+                tmap, n = dwi.texture.get_texture(img, 'glcm', [3, 5], mask)
+            self.assertEqual(n, names)
+            self.assertEqual(tmap.file.filename, path)
+            # Slices never written read as NaN.
+            np.testing.assert_array_equal(tmap[...], expected)
+            self.assertTrue(np.all(np.isnan(tmap[0])))
+
+
+class TestMean(unittest.TestCase):
+    """Averaged maps equal the mean of the full map over each window size
+    mask.
+    """
+
+    def test_mean(self):
+        img, mask = get_image(shape=(3, 24, 24))
+        mask[0, 5:-7, 8:-8] = True
+        masks = [mask, np.roll(mask, 2, axis=2)]
+        for method in ('glcm', 'lbp'):
+            tmap, names = dwi.texture.get_texture(img, method, [3, 5], masks)
+            for jobs in (1, 2):
+                params = {'texture.avg': True, 'texture.jobs': jobs}
+                with dwi.conf.rc_context(params):
+                    avg, n = dwi.texture.get_texture(img, method, [3, 5],
+                                                     masks)
+                self.assertEqual(n, names)
+                self.assertEqual(avg.shape, (1, 1, 1, len(names)))
+                for i, name in enumerate(names):
+                    m = masks[name.startswith('5-')]
+                    np.testing.assert_allclose(
+                        avg[..., i], np.mean(tmap[m, i], dtype=np.float64),
+                        rtol=1e-6)
+
+
+class TestStats(unittest.TestCase):
+    def test_stats_map(self):
+        # Blocks of windows equal features of each window.
+        rng = np.random.RandomState(0)
+        img = rng.rand(20, 24)
+        mask = rng.rand(20, 24) < 0.5
+        for winsize in (3, 4, 7):
+            output, names = dwi.texture.stats_map(img, winsize, mask=mask)
+            expected = np.zeros_like(output)
+            for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
+                d = dwi.texture.stats(win)
+                expected[(slice(None),) + pos] = list(d.values())
+            self.assertEqual(names, ['stats({})'.format(x) for x in d])
+            np.testing.assert_allclose(output, expected, rtol=1e-5,
+                                       atol=1e-6)
+
+
+class TestSelected(unittest.TestCase):
+    """Selected features equal the same columns of the full map."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check(self, img, method, winsizes, mask, **params):
+        with dwi.conf.rc_context(params):
+            full, allnames = dwi.texture.get_texture(img, method, winsizes,
+                                                     mask)
+            # Every other feature, in reverse order.
+            names = allnames[::-2]
+            tmap, n = dwi.texture.get_texture(img, method, winsizes, mask,
+                                              names=names)
+        self.assertEqual(n, names)
+        indices = [allnames.index(x) for x in names]
+        np.testing.assert_allclose(tmap, full[..., indices])
+
+    def test_methods(self):
+        img, mask = get_image()
+        self.check(img, 'glcm', [3, 5], mask)
+        self.check(img, 'glcm', [3, 5], mask, **{'texture.avg': True})
+        self.check(img, 'stats', [3, 5], mask)
+        img = img.astype(np.float64)
+        self.check(img, 'gabor', [3, 5], mask)
+        self.check(img, 'haar', [5, 7], mask)
+        self.check(img, 'hog', [5, 7], mask,
+                   **{'texture.hog.orientations': (1, 4)})
+
+    def test_texture_path(self):
+        # The subset is returned in memory, nothing is written on disk.
+        img, mask = get_image()
+        full, allnames = dwi.texture.get_texture(img, 'glcm', [3, 5], mask)
+        names = allnames[:3]
+        path = os.path.join(self.tempdir, 'tmap.h5')
+        with dwi.conf.rc_context({'texture.path': path}):
+            tmap, n = dwi.texture.get_texture(img, 'glcm', [3, 5], mask,
+                                              names=names)
+        self.assertIsInstance(tmap, np.ndarray)
+        np.testing.assert_array_equal(tmap, full[..., :3])
+        self.assertFalse(os.path.exists(path))
+
+    def test_missing(self):
+        img, mask = get_image()
+        with self.assertRaises(ValueError):
+            dwi.texture.get_texture(img, 'glcm', [3, 5], mask,
+                                    names=['7-glcm(contrast,1,mean)'])
+        with self.assertRaises(ValueError):
+            dwi.texture.get_texture(img, 'glcm', [3, 5], mask,
+                                    names=['3-glcm(foo,1,mean)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
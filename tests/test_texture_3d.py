@@ -0,0 +1,187 @@
+"""Tests for dwi.texture_3d."""
+
+from __future__ import absolute_import, division, print_function
+from itertools import product
+import unittest
+
+import numpy as np
+from scipy import ndimage
+import skimage.feature
+
+import dwi.conf
+import dwi.texture  # Imported before its method modules, see there.
+import dwi.texture_3d
+import dwi.texture_skimage
+import dwi.util
+
+
+def glcm_props(win, offset, levels):
+    """Reference GLCM properties of a window for one offset, from the
+    symmetric, normalized co-occurrence matrix.
+    """
+    first, second = dwi.util.pair_slices(win.shape, offset)
+    a, b = win[first].ravel(), win[second].ravel()
+    m = np.zeros((levels, levels))
+    np.add.at(m, (a, b), 1)
+    np.add.at(m, (b, a), 1)
+    p = m / m.sum()
+    i, j = np.indices(p.shape)
+    d = {}
+    d['contrast'] = np.sum(p * (i - j)**2)
+    d['dissimilarity'] = np.sum(p * np.abs(i - j))
+    d['homogeneity'] = np.sum(p / (1 + (i - j)**2))
+    d['ASM'] = np.sum(p**2)
+    d['energy'] = np.sqrt(d['ASM'])
+    mean = np.sum(p * i)
+    var = np.sum(p * (i - mean)**2)
+    cov = np.sum(p * (i - mean) * (j - mean))
+    d['correlation'] = 1 if var == 0 else cov / var
+    return d
+
+
+class TestGLCM(unittest.TestCase):
+    names = ('contrast', 'dissimilarity', 'homogeneity', 'energy',
+             'correlation', 'ASM')
+    distances = (1, 2)
+
+    def check(self, img, winshape, mask):
+        params = {'texture.glcm.names': self.names,
+                  'texture.glcm.distances': self.distances}
+        with dwi.conf.rc_context(params):
+            output, names = dwi.texture_3d.glcm_map(img, winshape, mask=mask)
+        levels = int(img.max()) + 1
+        origins = dwi.util.window_origins(img.shape, winshape)
+        selected = np.zeros(img.shape, dtype=bool)
+        selected[origins] = mask[origins]
+        self.assertTrue(np.count_nonzero(selected))
+        for origin in np.argwhere(selected):
+            corner = origin - np.array(winshape) // 2
+            win = img[tuple(slice(c, c + w) for c, w in zip(corner,
+                                                              winshape))]
+            props = []
+            for dist in self.distances:
+                offsets = [tuple(dist * x for x in d) for d in
+                           dwi.texture_3d.DIRECTIONS]
+                offsets = [x for x in offsets if
+                           all(abs(o) < w for o, w in zip(x, winshape))]
+                if offsets:
+                    props.append([glcm_props(win, x, levels) for x in
+                                  offsets])
+            expected = []
+            for name, p in product(self.names, props):
+                a = [x[name] for x in p]
+                expected += [np.mean(a), np.ptp(a)]
+            np.testing.assert_allclose(output[(slice(None),) +
+                                              tuple(origin)],
+                                       expected, atol=1e-12)
+        self.assertEqual(len(names), len(output))
+        self.assertFalse(np.any(output[:, ~selected]))
+
+    def test_glcm(self):
+        rng = np.random.RandomState(0)
+        img = rng.randint(0, 8, size=(5, 9, 9)).astype(np.uint8)
+        mask = rng.rand(*img.shape) < 0.3
+        self.check(img, (3, 3, 3), mask)
+        self.check(img, (3, 5, 5), mask)
+
+    def test_glcm_full_range(self):
+        # Pair codes need more than 8 bits with 256 grey levels.
+        rng = np.random.RandomState(0)
+        img = rng.randint(0, 256, size=(4, 7, 7)).astype(np.uint8)
+        img[0, 0, 0] = 255
+        mask = np.ones(img.shape, dtype=bool)
+        self.check(img, (3, 3, 3), mask)
+
+
+def window_map(img, winshape, mask, call):
+    """Reference feature map calculated one window at a time."""
+    output = None
+    for pos, win in dwi.util.sliding_window(img, winshape, mask=mask):
+        feats = call(win)
+        if output is None:
+            output = np.zeros((len(feats),) + img.shape)
+        output[(slice(None),) + pos] = feats
+    return output
+
+
+class TestStats(unittest.TestCase):
+    def test_stats_map(self):
+        rng = np.random.RandomState(0)
+        img = rng.rand(5, 9, 10)
+        mask = rng.rand(*img.shape) < 0.3
+        for winshape in [(3, 3, 3), (1, 5, 3)]:
+            output, names = dwi.texture_3d.stats_map(img, winshape,
+                                                     mask=mask)
+            expected = window_map(
+                img, winshape, mask,
+                lambda x: list(dwi.texture.stats(x).values()))
+            np.testing.assert_allclose(output, expected, atol=1e-12)
+            self.assertEqual(len(names), len(output))
+
+    def test_stats_map_empty(self):
+        img = np.random.RandomState(0).rand(5, 9, 10)
+        mask = np.zeros(img.shape, dtype=bool)
+        output, names = dwi.texture_3d.stats_map(img, (3, 3, 3), mask=mask)
+        self.assertEqual(len(names), len(output))
+        self.assertFalse(np.any(output))
+
+
+class TestLBP(unittest.TestCase):
+    def test_lbp_freq_map(self):
+        rng = np.random.RandomState(0)
+        img = rng.rand(5, 9, 10)
+        winshape = (3, 5, 5)
+        output, names = dwi.texture_3d.lbp_freq_map(img, winshape)
+        neighbours = dwi.rcParams['texture.lbp.neighbours']
+        lbp = lambda x, r: skimage.feature.local_binary_pattern(
+            x, neighbours, r, method='uniform')
+        patterns = np.zeros((3,) + img.shape)
+        for i in range(img.shape[0]):
+            patterns[0, i, :, :] = lbp(img[i, :, :], 2)
+        for i in range(img.shape[1]):
+            patterns[1, :, i, :] = lbp(img[:, i, :], 1)
+        for i in range(img.shape[2]):
+            patterns[2, :, :, i] = lbp(img[:, :, i], 1)
+        n = neighbours + 2
+        expected = np.concatenate([
+            window_map(p, winshape, None,
+                       lambda x: [np.mean(x == i) for i in range(n)])
+            for p in patterns])
+        self.assertEqual(names[0], 'lbp(xy,2,0)')
+        self.assertEqual(names[-1], 'lbp(yz,1,{})'.format(n - 1))
+        np.testing.assert_allclose(output, expected, atol=1e-12)
+
+    def test_lbp_freq_map_thin(self):
+        # Planes without thickness are left out.
+        img = np.random.RandomState(0).rand(5, 9, 10)
+        output, names = dwi.texture_3d.lbp_freq_map(img, (1, 3, 3))
+        n = dwi.rcParams['texture.lbp.neighbours'] + 2
+        self.assertEqual(len(names), n)
+        self.assertTrue(all(x.startswith('lbp(xy,') for x in names))
+
+
+class TestGabor(unittest.TestCase):
+    def test_gabor_map(self):
+        rng = np.random.RandomState(0)
+        img = rng.rand(7, 9, 10)
+        winshape = (3, 3, 5)
+        params = {'texture.gabor.sigmas': (1,),
+                  'texture.gabor.freqs': (0.25,)}
+        with dwi.conf.rc_context(params):
+            output, names = dwi.texture_3d.gabor_map(img, winshape)
+        kernel = sum(dwi.texture_3d.gabor_kernel(0.25, x, 1, 1) for x in
+                     dwi.texture_3d.DIRECTIONS)
+        real = ndimage.convolve(img, kernel.real, mode='mirror')
+        imag = ndimage.convolve(img, kernel.imag, mode='mirror')
+        expected = np.zeros_like(output)
+        for (pos, rwin), (_, iwin) in zip(
+                dwi.util.sliding_window(real, winshape),
+                dwi.util.sliding_window(imag, winshape)):
+            expected[(slice(None),) + pos] = (
+                dwi.texture_skimage.gabor_feats(rwin, iwin))
+        self.assertEqual(len(names), len(output))
+        np.testing.assert_allclose(output, expected, rtol=1e-9, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests for dwi.texture_cache."""
+
+from __future__ import absolute_import, division, print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import dwi.conf
+import dwi.sparse
+import dwi.texture
+import dwi.texture_cache
+
+
+def get_image(shape=(3, 16, 16), seed=0):
+    """Random image and a mask selecting a square in the middle slice."""
+    rng = np.random.RandomState(seed)
+    img = rng.rand(*shape)
+    mask = np.zeros(shape, dtype=bool)
+    mask[shape[0] // 2, 4:-4, 4:-4] = True
+    return img, mask
+
+
+class TestTextureCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_texture(self, img, method, winspec, mask, **params):
+        params['texture.cache.dir'] = self.directory
+        with dwi.conf.rc_context(params):
+            return dwi.texture.get_texture(img, method, winspec, mask)
+
+    def test_get_texture(self):
+        img, mask = get_image()
+        cache = dwi.texture_cache.get_cache(
+            self.directory, dwi.rcParams['texture.cache.size'])
+        for sparse in (False, True):
+            params = {'texture.sparse': sparse}
+            with dwi.conf.rc_context(params):
+                expected, names = dwi.texture.get_texture(img, 'stats', 5,
+                                                          mask)
+            hits, misses = cache.hits, cache.misses
+            for _ in range(2):
+                tmap, n = self.get_texture(img, 'stats', 5, mask, **params)
+                self.assertEqual(n, names)
+                self.assertEqual(isinstance(tmap, dwi.sparse.SparseMap),
+                                 sparse)
+                if sparse:
+                    tmap = tmap.todense()
+                np.testing.assert_array_equal(tmap, expected.todense() if
+                                              sparse else expected)
+            self.assertEqual((cache.hits, cache.misses),
+                             (hits + 1, misses + 1))
+
+    def test_get_key(self):
+        img, mask = get_image()
+        params = dict(dwi.rcParams)
+        key = dwi.texture_cache.get_key(img, 'stats', 5, mask, params)
+        self.assertEqual(key, dwi.texture_cache.get_key(
+            img.copy(), 'stats', '5', mask.copy(), params))
+        self.assertEqual(key, dwi.texture_cache.get_key(
+            img, 'stats', 5, mask, dict(params, **{'texture.jobs': 4})))
+        other = [
+            (img + 1, 'stats', 5, mask, params),
+            (img, 'glcm', 5, mask, params),
+            (img, 'stats', 7, mask, params),
+            (img, 'stats', 5, ~mask, params),
+            (img, 'stats', 5, mask, dict(params, **{'texture.avg': True})),
+            ]
+        for args in other:
+            self.assertNotEqual(key, dwi.texture_cache.get_key(*args))
+
+    def test_evict(self):
+        # The least recently used entries are evicted first.
+        cache = dwi.texture_cache.TextureCache(self.directory, 10**9)
+        a = np.zeros((10, 10))
+        for i, key in enumerate(('a', 'b', 'c')):
+            cache.put(key, a, ['x'])
+            os.utime(cache.path(key), (i, i))
+        size = cache.size() // 3
+        self.assertIsNotNone(cache.get('a'))
+        cache.max_size = 2 * size
+        cache.evict()
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""Tests for dwi.texture_mahotas."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import mahotas.features.texture
+import numpy as np
+
+import dwi.conf
+import dwi.texture  # Imported before its method modules, see there.
+import dwi.texture_mahotas
+import dwi.util
+
+
+def window_map(img, winsize, mask, call):
+    """Reference feature map calculated one window at a time."""
+    output = None
+    for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
+        feats = call(win)
+        if output is None:
+            output = np.zeros((len(feats),) + img.shape)
+        output[(slice(None),) + pos] = feats
+    return output
+
+
+def get_image(shape=(20, 24), seed=0):
+    """Random image and mask."""
+    rng = np.random.RandomState(seed)
+    img = rng.rand(*shape)
+    mask = rng.rand(*shape) < 0.5
+    return img, mask
+
+
+class TestHaar(unittest.TestCase):
+    def haar_map(self, img, winsize, mask):
+        """Reference Haar map: features of each window of each band."""
+        nlevels = dwi.rcParams['texture.haar.levels']
+        levels = dwi.texture_mahotas.haar_levels(img, nlevels,
+                                                 drop_approx=True)
+        outputs = []
+        for coeffs in levels:
+            for coeff in coeffs:
+                outputs.append(window_map(
+                    coeff, winsize, mask, lambda x: list(
+                        dwi.texture_mahotas.haar_features(x).values())))
+        return np.concatenate(outputs)
+
+    def test_haar_map(self):
+        img, mask = get_image()
+        for winsize in (3, 5, 8):
+            output, names = dwi.texture_mahotas.haar_map(img, winsize,
+                                                         mask=mask)
+            self.assertEqual(len(names), len(output))
+            # The map is float32.
+            np.testing.assert_allclose(output,
+                                       self.haar_map(img, winsize, mask),
+                                       rtol=1e-5, atol=1e-6)
+
+
+def mahotas_haralick(img, ignore_zeros=False):
+    """Reference Haralick features by mahotas, averaged over directions.
+
+    The 14th feature is NaN where mahotas fails at it: rows of the GLCM
+    without variance give NaN correlations, on which the eigenvalues may not
+    converge.
+    """
+    texture = mahotas.features.texture
+    a = texture.haralick(img, ignore_zeros, compute_14th_feature=False)
+    a = np.mean(a, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        try:
+            b = texture.haralick(img, ignore_zeros,
+                                 compute_14th_feature=True)
+            last = np.mean(b[:, 13])
+        except np.linalg.LinAlgError:
+            last = np.nan
+    return np.append(a, last)
+
+
+class TestHaralick(unittest.TestCase):
+    def get_image(self, shape=(16, 18), levels=8, seed=0):
+        rng = np.random.RandomState(seed)
+        img = rng.randint(0, levels, size=shape).astype(np.uint8)
+        mask = rng.rand(*shape) < 0.5
+        return img, mask
+
+    def test_haralick_map(self):
+        img, mask = self.get_image()
+        for winsize in (3, 5, 8):
+            output, names = dwi.texture_mahotas.haralick_map(img, winsize,
+                                                             mask=mask)
+            expected = window_map(img, winsize, mask, mahotas_haralick)
+            self.assertEqual(len(names), 14)
+            # The map is float32.
+            np.testing.assert_allclose(output[:13], expected[:13], rtol=1e-4,
+                                       atol=1e-5)
+            valid = np.isfinite(expected[13])
+            self.assertTrue(np.count_nonzero(valid))
+            np.testing.assert_allclose(output[13][valid],
+                                       expected[13][valid], rtol=1e-4,
+                                       atol=1e-5)
+            self.assertTrue(np.all(np.isfinite(output[13])))
+
+    def test_haralick_mbb(self):
+        img, mask = self.get_image(shape=(20, 24), levels=32)
+        img += 1  # Zero is background.
+        mask[:] = False
+        mask[4:15, 6:20] = True
+        mask[4:8, 6:10] = False
+        feats, names = dwi.texture_mahotas.haralick_mbb(img, mask)
+        expected = img[4:15, 6:20].copy()
+        expected[~mask[4:15, 6:20]] = 0
+        expected = mahotas_haralick(expected, ignore_zeros=True)
+        np.testing.assert_allclose(feats, expected, rtol=1e-9, atol=1e-12)
+        self.assertEqual(names[0], 'haralick(1-ASM)')
+
+
+if __name__ == '__main__':
+    unittest.main()
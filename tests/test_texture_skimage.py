@@ -0,0 +1,101 @@
+"""Tests for dwi.texture_skimage."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+import skimage.feature
+
+import dwi.conf
+import dwi.texture  # Imported before its method modules, see there.
+import dwi.texture_skimage
+import dwi.util
+
+
+def window_map(img, winsize, mask, call):
+    """Reference feature map calculated one window at a time."""
+    output = None
+    for pos, win in dwi.util.sliding_window(img, winsize, mask=mask):
+        feats = call(win)
+        if output is None:
+            output = np.zeros((len(feats),) + img.shape)
+        output[(slice(None),) + pos] = feats
+    return output
+
+
+def get_image(shape=(20, 24), seed=0):
+    """Random image and mask."""
+    rng = np.random.RandomState(seed)
+    img = rng.rand(*shape)
+    mask = rng.rand(*shape) < 0.5
+    return img, mask
+
+
+class TestHOG(unittest.TestCase):
+    def test_hog_map(self):
+        img, mask = get_image()
+        for orientations in (1, 4, 9):
+            with dwi.conf.rc_context({'texture.hog.orientations':
+                                      orientations}):
+                for winsize in (3, 5, 8):
+                    output, names = dwi.texture_skimage.hog_map(img, winsize,
+                                                                mask=mask)
+                    expected = window_map(
+                        img, winsize, mask,
+                        lambda x: [dwi.texture_skimage.hog(x)])
+                    # The map is float32.
+                    np.testing.assert_allclose(output, expected, rtol=1e-5,
+                                               atol=1e-6)
+
+    def test_hog_maps_orientations(self):
+        # A sequence of orientations gives a feature for each.
+        img, mask = get_image()
+        with dwi.conf.rc_context({'texture.hog.orientations': (1, 4)}):
+            outputs, names = dwi.texture_skimage.hog_maps(img, [5, 7],
+                                                          mask=mask)
+        self.assertEqual(names, [['hog(1)', 'hog(4)']] * 2)
+        for output, winsize in zip(outputs, [5, 7]):
+            for feat, orientations in zip(output, (1, 4)):
+                with dwi.conf.rc_context({'texture.hog.orientations':
+                                          orientations}):
+                    expected, _ = dwi.texture_skimage.hog_map(img, winsize,
+                                                              mask=mask)
+                np.testing.assert_allclose(feat, expected[0])
+
+
+class TestLBP(unittest.TestCase):
+    def test_lbp_freq_map(self):
+        img, mask = get_image()
+        n = dwi.rcParams['texture.lbp.neighbours'] + 2
+        for winsize in (3, 5, 8):
+            output, names = dwi.texture_skimage.lbp_freq_map(img, winsize,
+                                                             mask=mask)
+            freqs = skimage.feature.local_binary_pattern(
+                img, n - 2, winsize // 2, method='uniform')
+            expected = window_map(
+                freqs, winsize, mask,
+                lambda x: [np.count_nonzero(x == i) / x.size for i in
+                           range(n)])
+            self.assertEqual(len(names), n)
+            np.testing.assert_allclose(output, expected, rtol=1e-6)
+
+
+class TestGabor(unittest.TestCase):
+    def test_gabor_featmap(self):
+        img, mask = get_image()
+        imag = np.random.RandomState(1).rand(*img.shape)
+        for winsize in (3, 5, 8):
+            output = dwi.texture_skimage.gabor_featmap(img, imag, winsize,
+                                                       mask)
+            expected = np.full_like(output, np.nan)
+            for (pos, rwin), (_, iwin) in zip(
+                    dwi.util.sliding_window(img, winsize, mask=mask),
+                    dwi.util.sliding_window(imag, winsize, mask=mask)):
+                expected[(slice(None),) + pos] = (
+                    dwi.texture_skimage.gabor_feats(rwin, iwin))
+            np.testing.assert_allclose(output, expected, rtol=1e-5,
+                                       atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests for dwi.util."""
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+import numpy as np
+
+import dwi.util
+
+
+class TestWindows(unittest.TestCase):
+    """Batched and strided windows equal sliding_window()."""
+
+    def test_window_blocks(self):
+        rng = np.random.RandomState(0)
+        for shape, winshape in [((9, 11), 3), ((9, 11), (4, 1)),
+                                ((5, 6, 7), (3, 2, 5)), ((4, 5), (4, 5))]:
+            a = rng.rand(*shape)
+            for mask in (None, rng.rand(*shape) < 0.5,
+                         np.zeros(shape, dtype=bool)):
+                expected = list(dwi.util.sliding_window(a, winshape,
+                                                        mask=mask))
+                for blocksize in (1, 7, 4096):
+                    blocks = list(dwi.util.window_blocks(
+                        a, winshape, mask=mask, blocksize=blocksize))
+                    self.assertTrue(all(len(w) <= blocksize for _, w in
+                                        blocks))
+                    origins = [tuple(o) for p, _ in blocks for o in p]
+                    windows = [w for _, b in blocks for w in b]
+                    self.assertEqual(origins, [o for o, _ in expected])
+                    for win, (_, exp) in zip(windows, expected):
+                        np.testing.assert_equal(np.squeeze(win), exp)
+
+    def test_window_view(self):
+        a = np.arange(5 * 6).reshape(5, 6)
+        view = dwi.util.window_view(a, (2, 3))
+        self.assertEqual(view.shape, (4, 4, 2, 3))
+        self.assertFalse(view.flags.writeable)
+        for i, j in np.ndindex(4, 4):
+            np.testing.assert_equal(view[i, j], a[i:i+2, j:j+3])
+
+    def test_window_sums(self):
+        rng = np.random.RandomState(0)
+        for shape, winshape in [((9, 11), 3), ((9, 11), (4, 1)),
+                                ((5, 6, 7), (3, 2, 5)), ((4, 5), (4, 5))]:
+            a = rng.rand(*shape)
+            sums = dwi.util.window_sums(a, winshape)
+            origins = dwi.util.window_origins(shape, winshape)
+            expected = np.zeros(shape)
+            for pos, win in dwi.util.sliding_window(a, winshape):
+                expected[pos] = np.sum(win)
+            np.testing.assert_allclose(sums, expected[origins])
+            mask = np.zeros(shape, dtype=bool)
+            mask[origins] = True
+            self.assertEqual(np.count_nonzero(mask), len(
+                list(dwi.util.sliding_window(a, winshape))))
+            self.assertTrue(np.all(expected[~mask] == 0))
+        with self.assertRaises(Exception):
+            dwi.util.window_sums(a, (5, 6))
+
+    def test_pair_slices(self):
+        rng = np.random.RandomState(0)
+        a = rng.rand(4, 5, 6)
+        for offset in [(0, 0, 1), (0, 2, -1), (-1, 1, 3), (3, -4, 0)]:
+            first, second = dwi.util.pair_slices(a.shape, offset)
+            pairs = [(a[i], a[tuple(np.add(i, offset))]) for i in
+                     np.ndindex(a.shape) if all(0 <= x + o < n for x, o, n in
+                                                zip(i, offset, a.shape))]
+            np.testing.assert_equal(a[first].ravel(), [x for x, _ in pairs])
+            np.testing.assert_equal(a[second].ravel(), [y for _, y in pairs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+"""Benchmark texture method throughput on synthetic images.
+
+Each method of dwi.texture.METHODS is timed on synthetic DWI and T2w sized
+slices with a range of mask fractions. Map methods are timed at each window
+size of 'texture.winsizes.small' (DWI) and 'texture.winsizes.large' (T2w),
+methods over minimum bounding box or all voxels once. The results are written
+one JSON object per line, to be compared between versions.
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import logging
+import platform
+import sys
+import timeit
+
+import numpy as np
+from scipy import ndimage
+
+import dwi.texture
+import dwi.util
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2: no peak memory.
+
+# Slice shapes of synthetic images, and their window size parameters.
+SHAPES = dict(DWI=(100, 100), T2w=(320, 320))
+WINSIZES = dict(DWI='texture.winsizes.small', T2w='texture.winsizes.large')
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('--verbose', '-v', action='count',
+                   help='increase verbosity')
+    p.add_argument('--methods', nargs='+',
+                   default=list(dwi.texture.METHODS.keys()),
+                   help='texture methods to benchmark')
+    p.add_argument('--modes', nargs='+', choices=sorted(SHAPES),
+                   default=sorted(SHAPES),
+                   help='synthetic image types')
+    p.add_argument('--winsizes', type=int, nargs='+',
+                   help='window sizes, instead of the configured ones')
+    p.add_argument('--fractions', type=float, nargs='+', default=[0.1, 0.5],
+                   help='portions of slice area selected by mask')
+    p.add_argument('--scale', type=float, default=1,
+                   help='scale of image side lengths')
+    p.add_argument('--repeat', type=int, default=1,
+                   help='number of repetitions, best time is reported')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='number of parallel processes for texture maps')
+    p.add_argument('--seed', type=int, default=0,
+                   help='random seed for synthetic images')
+    p.add_argument('--label',
+                   help='label to tell versions apart in results')
+    p.add_argument('--output', metavar='FILENAME',
+                   help='output file for results (default stdout)')
+    return p.parse_args()
+
+
+def synthetic_image(shape, seed):
+    """Return a synthetic float slice in [0, 1] with some spatial correlation,
+    and its quantized version, both shaped (1, height, width).
+    """
+    rng = np.random.RandomState(seed)
+    img = ndimage.gaussian_filter(rng.standard_normal(shape), 1.5)
+    img = dwi.util.scale(img).astype(np.float32)
+    img.shape = (1,) + img.shape
+    return img, dwi.util.quantize(img)
+
+
+def synthetic_mask(shape, fraction):
+    """Return a centered rectangular mask covering a portion of slice area."""
+    mask = np.zeros(shape, dtype=np.bool)
+    side = np.sqrt(fraction)
+    slices = [slice(int(round(n * (1 - side) / 2)),
+                    int(round(n * (1 + side) / 2))) for n in shape[1:]]
+    mask[tuple([slice(None)] + slices)] = True
+    return mask
+
+
+def get_winspecs(method, mode, winsizes=None):
+    """Return the window specifications to time a method at."""
+    if method.endswith('_mbb'):
+        return ['mbb']
+    if method.endswith('_all'):
+        return ['all']
+    if winsizes is None:
+        winsizes = range(*dwi.rcParams[WINSIZES[mode]])
+    return list(winsizes)
+
+
+def measure(img, method, winspec, mask, repeat):
+    """Time texture calculation. Return best time in seconds, peak memory
+    allocated in bytes (None if not available), and number of features.
+    """
+    times = []
+    peak = None
+    for _ in range(repeat):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = timeit.default_timer()
+        tmap, names = dwi.texture.get_texture(img, method, winspec, mask)
+        times.append(timeit.default_timer() - start)
+        if tracemalloc is not None:
+            peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        del tmap
+    return min(times), peak, len(names)
+
+
+def benchmark(args, mode, method, winspec, fraction):
+    """Benchmark a method with a window specification on a synthetic image.
+    Return the result as a dictionary.
+    """
+    shape = tuple(int(round(x * args.scale)) for x in SHAPES[mode])
+    img, qimg = synthetic_image(shape, args.seed)
+    mask = synthetic_mask(img.shape, fraction)
+    if method in dwi.texture.QUANTIZED_METHODS:
+        img = qimg
+    if winspec == 'mbb':
+        windows = len(mask)  # One for each slice.
+    elif winspec == 'all':
+        windows = 1
+    else:
+        windows = np.count_nonzero(mask)
+    d = dict(label=args.label, method=method, mode=mode, shape=img.shape,
+             dtype=str(img.dtype), winspec=winspec, fraction=fraction,
+             voxels=int(np.count_nonzero(mask)), windows=int(windows),
+             jobs=args.jobs, repeat=args.repeat)
+    try:
+        seconds, peak, nfeats = measure(img, method, winspec, mask,
+                                        args.repeat)
+    except Exception as e:
+        logging.warning('Failed: %s %s %s: %s', method, mode, winspec, e)
+        d['error'] = '{}: {}'.format(type(e).__name__, e)
+        return d
+    d.update(seconds=seconds, windows_per_sec=windows / seconds,
+             peak_bytes=peak, features=nfeats)
+    return d
+
+
+def main():
+    args = parse_args()
+    loglevel = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=loglevel, stream=logging.sys.stderr)
+
+    dwi.rcParams['texture.avg'] = False
+    dwi.rcParams['texture.path'] = None
+    dwi.rcParams['texture.cache.dir'] = None
+    dwi.rcParams['texture.jobs'] = args.jobs
+    versions = dict(python=platform.python_version(), numpy=np.__version__)
+    f = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        for mode in args.modes:
+            for method in args.methods:
+                for winspec in get_winspecs(method, mode, args.winsizes):
+                    for fraction in args.fractions:
+                        d = benchmark(args, mode, method, winspec, fraction)
+                        d.update(versions)
+                        logging.info('%s %s %s %s: %s s', mode, method,
+                                     winspec, fraction, d.get('seconds'))
+                        print(json.dumps(d, sort_keys=True), file=f)
+                        f.flush()
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
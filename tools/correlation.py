@@ -10,6 +10,7 @@ from scipy import stats
 
 import dwi.dataset
 import dwi.patient
+import dwi.stats
 import dwi.util
 
 
@@ -30,6 +31,9 @@ def parse_args():
                    help='use all lesions, not just first for each')
     p.add_argument('--dropok', action='store_true',
                    help='allow dropping of files not found')
+    p.add_argument('--method', choices=('spearman', 'pearson', 'kendall'),
+                   default='spearman',
+                   help='correlation method')
     return p.parse_args()
 
 
@@ -58,9 +62,10 @@ def main():
     args = parse_args()
     thresholds = args.thresholds
 
-    # Collect all parameters.
-    X, Y = [], []
-    Params = []
+    # Collect all parameters, and correlate those of each pmap directory at
+    # once, as a matrix of shape (samples, parameters). Kendall's tau is
+    # calculated one parameter at a time.
+    Params, Results = [], []
     scores = None
     for i, pmapdir in enumerate(args.pmapdir):
         data = dwi.dataset.read_pmaps(args.patients, pmapdir, thresholds,
@@ -69,19 +74,21 @@ def main():
                                       dropok=args.dropok)
         if scores is None:
             scores, groups, group_sizes = dwi.patient.grouping(data)
-        for j, param in enumerate(data[0]['params']):
-            x, y = [], []
-            for d in data:
-                for v in d['pmap']:
-                    x.append(v[j])
-                    y.append(d['label'])
-            X.append(np.asarray(x))
-            Y.append(np.asarray(y))
-            Params.append('%i:%s' % (i, param))
+            n_samples = sum(len(d['pmap']) for d in data)
+        x = np.array([v for d in data for v in d['pmap']])
+        y = np.array([d['label'] for d in data for _ in d['pmap']])
+        if args.method == 'kendall':
+            Results += [correlation(x[:, j], y, method=args.method) for j in
+                        range(x.shape[1])]
+        else:
+            r = dwi.stats.correlations(x, y, method=args.method)
+            Results += [{k: v[j] for k, v in r.items()} for j in
+                        range(x.shape[1])]
+        Params += ['%i:%s' % (i, param) for param in data[0]['params']]
 
     # Print info.
     if args.verbose > 1:
-        d = dict(n=len(X[0]),
+        d = dict(n=n_samples,
                  ns=len(scores), s=scores,
                  ng=len(groups), g=' '.join(str(x) for x in groups),
                  gs=', '.join(str(x) for x in group_sizes))
@@ -94,9 +101,9 @@ def main():
     if args.verbose > 1:
         print('# param  r  p  lower  upper')
     params_maxlen = max(len(p) for p in Params)
-    for x, y, param in zip(X, Y, Params):
+    for param, result in zip(Params, Results):
         d = dict(param=param, l=params_maxlen, f='.3f')
-        d.update(correlation(x, y))
+        d.update(result)
         if args.verbose:
             s = '{param:{l}}  {r:+{f}}  {p:{f}}  {lower:+{f}}  {upper:+{f}}'
         else:
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+"""Find automatic ROIs by score maps of a parametric image. The search is run
+with several search parameter combinations at once, sharing the ROI scores of
+each box size, and the ROI of each combination is written as a mask.
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import logging
+
+import numpy as np
+
+import dwi.autoroi
+import dwi.files
+import dwi.mask
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('--verbose', '-v', action='count',
+                   help='increase verbosity')
+    p.add_argument('--input', '-i', required=True,
+                   help='input parametric map file')
+    p.add_argument('--prostate', '-p',
+                   help='prostate mask file')
+    p.add_argument('--roidim', metavar='I', nargs=3, type=int,
+                   default=[1, 5, 5],
+                   help='dimensions of wanted ROI (depth must be 1)')
+    p.add_argument('--algparams', metavar='D_D_S_S_N', nargs='+',
+                   required=True,
+                   help='search parameter combinations: depthmin, depthmax, '
+                   'sidemin, sidemax, n_rois, separated by underscore')
+    p.add_argument('--output', '-o', nargs='+', required=True,
+                   help='output mask file for each combination')
+    return p.parse_args()
+
+
+def write_roi_mask(path, shape, coords):
+    """Write a single-slice ROI as an ASCII mask."""
+    (z0, z1), (y0, y1), (x0, x1) = coords
+    if z1 - z0 != 1:
+        raise ValueError('Only single-slice ROIs can be written')
+    a = np.zeros(shape[1:3], dtype=np.bool)
+    a[y0:y1, x0:x1] = True
+    dwi.mask.Mask(z0 + 1, a).write(path)
+
+
+def main():
+    args = parse_args()
+    loglevel = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=loglevel, stream=logging.sys.stderr)
+    if len(args.algparams) != len(args.output):
+        raise ValueError('Number of outputs does not match combinations')
+
+    img, attrs = dwi.files.read_pmap(args.input)
+    prostate = None
+    if args.prostate:
+        prostate = dwi.mask.read_mask(args.prostate)
+    combinations = [tuple(int(x) for x in s.split('_')) for s in
+                    args.algparams]
+    outputs = dict(zip(combinations, args.output))
+    for c, d in dwi.autoroi.find_roi_sweep(img, args.roidim,
+                                           attrs['parameters'], combinations,
+                                           prostate_mask=prostate):
+        logging.info('%s: %s', c, d['roi_coords'])
+        write_roi_mask(outputs[c], img.shape, d['roi_coords'])
+
+
+if __name__ == '__main__':
+    main()
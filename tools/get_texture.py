@@ -4,7 +4,6 @@
 
 from __future__ import absolute_import, division, print_function
 import argparse
-from collections import defaultdict
 import logging
 
 import numpy as np
@@ -13,6 +12,7 @@ import dwi.files
 import dwi.mask
 import dwi.standardize
 import dwi.texture
+import dwi.texture_cache
 import dwi.util
 
 
@@ -27,49 +27,54 @@ def parse_args():
                    help='mask file to use')
     p.add_argument('--mode', metavar='MODE', required=True,
                    help='imaging mode specification')
-    p.add_argument('--method', metavar='METHOD', required=True,
-                   help='method')
+    p.add_argument('--method', metavar='METHOD', nargs='+', required=True,
+                   help='method; multiple methods are calculated in one pass '
+                   'and written into one merged file')
+    p.add_argument('--feature', metavar='NAME', nargs='+',
+                   help='calculate only features of these names, e.g. '
+                   '5-glcm(contrast,1,mean)')
     p.add_argument('--slices', default='maxfirst',
                    help='slice selection (maxfirst, max, all)')
-    p.add_argument('--winspec', default='5',
-                   help='window specification (side length, all, mbb)')
+    p.add_argument('--winspec', nargs='+', default=['5'],
+                   help='window specification (side length, all, mbb, or '
+                   'volumetric WxHxD); multiple side lengths are calculated '
+                   'in one pass')
     p.add_argument('--portion', type=float, default=0,
                    help='portion of selected voxels required for each window')
     p.add_argument('--voxel', choices=('all', 'mean'), default='all',
                    help='voxel to output (all, mean)')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='number of parallel processes for texture maps')
+    p.add_argument('--compression', choices=('gzip', 'lzf', 'none'),
+                   default=dwi.rcParams['texture.compression'],
+                   help='compression of texture maps written on disk')
+    p.add_argument('--sparse', action='store_true',
+                   help='write only selected voxels of texture maps')
+    p.add_argument('--cache', metavar='DIR',
+                   help='texture result cache directory')
     p.add_argument('--output', metavar='FILENAME', required=True,
                    help='output texture map file')
     return p.parse_args()
 
 
-def max_mask(mask, winsize):
-    """Return a mask that has the voxels selected that have the maximum number
-    of surrounding voxels selected in the original mask.
+def get_winspec(method, winsizes, pmasks, mask):
+    """Return window specification and mask for a method. Methods over the
+    minimum bounding box or all voxels have their own specification, others
+    use the window sizes, with the portion mask of each.
     """
-    d = defaultdict(list)
-    for pos, win in dwi.util.sliding_window(mask, winsize, mask=mask):
-        d[np.count_nonzero(win)].append(pos)
-    r = np.zeros_like(mask)
-    for pos in d[max(d)]:
-        r[pos] = True
-    return r
-
-
-def portion_mask(mask, winsize, portion=1, resort_to_max=True):
-    """Return a mask that selects (only) voxels that have the window at each
-    selected voxel origin up to a minimum portion in the original mask selected
-    (1 means the whole window must be selected, 0 gives the original mask).
-
-    If resort_to_max is true, the window with maximum number of selected voxels
-    is used in case the resulting mask would otherwise be empty.
-    """
-    r = np.zeros_like(mask)
-    for pos, win in dwi.util.sliding_window(mask, winsize, mask=mask):
-        if np.count_nonzero(win) / win.size >= portion:
-            r[pos] = True
-    if resort_to_max and np.count_nonzero(r) == 0:
-        r = max_mask(mask, winsize)
-    return r
+    if method.endswith('_mbb'):
+        return 'mbb', mask
+    if method.endswith('_all'):
+        return 'all', mask
+    if not winsizes:
+        raise ValueError('No window size for method: {}'.format(method))
+    if method == 'sobel':
+        # Sobel convolution kernel is always 3x3 voxels, window size is not
+        # used. Calculate it just once.
+        winsizes = winsizes[:1]
+    if len(winsizes) == 1:
+        return winsizes[0], pmasks[0]
+    return winsizes, pmasks
 
 
 def main():
@@ -116,21 +121,31 @@ def main():
         if i not in slice_indices:
             mask.array[i, :, :] = 0
 
-    # Use only selected slices to save memory.
-    if args.voxel == 'mean':
+    # Get window shapes for portion masks, shared by all methods.
+    winshape = None
+    if len(args.winspec) == 1:
+        winshape = dwi.texture.get_winshape(args.winspec[0])
+    if len(args.winspec) == 1 and args.winspec[0] in ('all', 'mbb'):
+        winsizes = []  # Some methods don't use window.
+        winshapes = []
+    elif all(x.isdigit() for x in args.winspec):
+        winsizes = sorted(int(x) for x in args.winspec)
+        assert all(x > 0 for x in winsizes)
+        winshapes = [(1, x, x) for x in winsizes]
+    elif winshape is not None:
+        winsizes = args.winspec  # Volumetric window.
+        winshapes = [winshape]
+    else:
+        raise ValueError('Invalid window spec: {}'.format(args.winspec))
+
+    # Use only selected slices to save memory. Volumetric windows need the
+    # surrounding slices.
+    if args.voxel == 'mean' and winshape is None:
         img = img[slice_indices].copy()
         mask.array = mask.array[slice_indices].copy()
 
-    # Get portion mask.
-    if args.winspec in ('all', 'mbb'):
-        pmask = mask.array  # Some methods don't use window.
-    elif args.winspec.isdigit():
-        winsize = int(args.winspec)
-        assert winsize > 0
-        winshape = (1, winsize, winsize)
-        pmask = portion_mask(mask.array, winshape, portion=args.portion)
-    else:
-        raise ValueError('Invalid window spec: {}'.format(args.winspec))
+    pmasks = [dwi.mask.portion_mask(mask.array, x, portion=args.portion)
+              for x in winshapes]
 
     logging.info('Image: %s, slice: %s, voxels: %s, window: %s', img.shape,
                  slice_indices, np.count_nonzero(mask.array), args.winspec)
@@ -138,22 +153,40 @@ def main():
     logging.info('Calculating %s texture features for %s...', args.method,
                  args.mode)
 
+    dwi.rcParams['texture.jobs'] = args.jobs
+    dwi.rcParams['texture.cache.dir'] = args.cache
+    dwi.rcParams['texture.compression'] = args.compression
+    dwi.rcParams['texture.sparse'] = args.sparse
     if args.voxel == 'mean':
         dwi.rcParams['texture.avg'] = True
     else:
         dwi.rcParams['texture.avg'] = False
-        if args.mode.startswith('T2w') and args.method.startswith('gabor'):
-            # These result arrays can get quite huge (if float64).
+        if (len(args.method) == 1 and args.mode.startswith('T2w') and
+                args.method[0].startswith('gabor') and not args.sparse and
+                not args.feature):
+            # These result arrays can get quite huge (if float64). Selected
+            # features are picked from the full map in memory, though.
             dwi.rcParams['texture.path'] = args.output
 
-    if args.method in ('glcm', 'glcm_mbb'):
-        img = dwi.util.quantize(dwi.util.normalize(img, args.mode))
-
-    tmap, names = dwi.texture.get_texture(img, args.method, args.winspec,
-                                          pmask)
+    # Normalize and quantize just once for all methods that need it.
+    qimg = None
+    if any(x in dwi.texture.QUANTIZED_METHODS for x in args.method):
+        qimg = dwi.util.quantize(dwi.util.normalize(img, args.mode))
+
+    winspecs, masks = zip(*[get_winspec(x, winsizes, pmasks, mask.array) for
+                            x in args.method])
+    tmap, names = dwi.texture.get_textures(img, args.method, winspecs, masks,
+                                           qimg=qimg, names=args.feature)
+    if args.cache:
+        cache = dwi.texture_cache.get_cache(
+            args.cache, dwi.rcParams['texture.cache.size'])
+        logging.info('Cache hits: %i, misses: %i', cache.hits, cache.misses)
     attrs['parameters'] = names
     # Number of windows, or resulting texture map volume in general.
-    attrs['tmap_voxels'] = np.count_nonzero(pmask)
+    if len(pmasks) > 1:
+        attrs['tmap_voxels'] = [np.count_nonzero(x) for x in pmasks]
+    else:
+        attrs['tmap_voxels'] = np.count_nonzero(masks[0])
 
     logging.info('Writing shape %s, type %s to %s', tmap.shape, tmap.dtype,
                  args.output)
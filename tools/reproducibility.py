@@ -27,6 +27,8 @@ def parse_args():
                    help='patients file')
     p.add_argument('-b', '--nboot', type=int, default=2000,
                    help='number of bootstraps')
+    p.add_argument('--seed', type=int,
+                   help='random seed for bootstrapping')
     p.add_argument('--voxel', default='0',
                    help='index of voxel to use, or mean or median')
     p.add_argument('-m', '--pmaps', nargs='+', required=True,
@@ -190,22 +192,26 @@ def main():
     #     '{param}'
     #     )
     skipped_params = 'SI0N C RMSE'.split()
-    for values, param in zip(X.T, params):
-        if param in skipped_params:
-            continue
-        if dwi.util.all_equal(values):
-            continue
-        if args.figdir:
-            plot(values, param, args.figdir)
-        baselines = dwi.util.pairs(values)
-        d = dict(param=param)
-        d.update(dwi.stats.repeatability_coeff(*baselines, avgfun=np.median))
-        d['msdr'] = d['msd']/d['avg']
-        d['cir'] = d['ci']/d['avg']
-        d['corr'] = d['cor']/d['avg']
-        d['icc'] = dwi.stats.icc(baselines)
-        (d['icc_bs'], d['icc_ci1'],
-         d['icc_ci2']) = dwi.stats.bootstrap_icc(baselines, nboot=args.nboot)
+    indices = [i for i, (values, param) in enumerate(zip(X.T, params)) if
+               param not in skipped_params and not dwi.util.all_equal(values)]
+    if args.figdir:
+        for i in indices:
+            plot(X[:, i], params[i], args.figdir)
+
+    # Calculate all parameters at once, with parameters on the last axis.
+    baselines = dwi.util.pairs(X[:, indices])
+    rc = dwi.stats.repeatability_coeff(*baselines, avgfun=np.median)
+    rc['msdr'] = rc['msd']/rc['avg']
+    rc['cir'] = rc['ci']/rc['avg']
+    rc['corr'] = rc['cor']/rc['avg']
+    baselines = np.moveaxis(np.array(baselines), -1, 0)  # Shape (p, k, n).
+    rc['icc'] = dwi.stats.icc(baselines)
+    (rc['icc_bs'], rc['icc_ci1'],
+     rc['icc_ci2']) = dwi.stats.bootstrap_icc(baselines, nboot=args.nboot,
+                                              random_state=args.seed)
+    for j, i in enumerate(indices):
+        d = {k: v[j] for k, v in rc.items()}
+        d['param'] = params[i]
         print(output.format(**d))
 
 
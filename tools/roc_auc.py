@@ -5,6 +5,10 @@ AUCs and draw the ROC curves into a file."""
 
 from __future__ import absolute_import, division, print_function
 import argparse
+from functools import partial
+from itertools import combinations
+import multiprocessing
+
 import numpy as np
 
 import dwi.dataset
@@ -27,6 +31,13 @@ def parse_args():
                    help='classification threshold (maximum negative)')
     p.add_argument('--nboot', type=int,
                    help='number of bootstraps (try 2000)')
+    p.add_argument('--seed', type=int,
+                   help='random seed for bootstrapping')
+    p.add_argument('--jobs', '-j', type=int, default=1,
+                   help='number of parallel processes')
+    p.add_argument('--delong', action='store_true',
+                   help='use DeLong method instead of bootstrapping for '
+                   'confidence intervals and comparison')
     p.add_argument('--voxel', default='all',
                    help='index of voxel to use, or all, sole, mean, median')
     p.add_argument('--normalvoxel', type=int,
@@ -45,6 +56,15 @@ def parse_args():
     return p.parse_args()
 
 
+def get_auc(task, autoflip=False, nboot=None, delong=False):
+    """Calculate ROC AUC of a parameter, with its own random seed."""
+    y, x, seed = task
+    # Scaling may be required for correct results.
+    x = dwi.stats.scale_standard(x)
+    return dwi.stats.roc_auc(y, x, autoflip=autoflip, nboot=nboot,
+                             random_state=seed, delong=delong)
+
+
 def main():
     args = parse_args()
     if args.normalvoxel is not None and args.voxel != 'all':
@@ -86,42 +106,57 @@ def main():
         print('Groups: {ng}: {g}'.format(**d))
         print('Group sizes: {gs}'.format(**d))
 
+    # Calculate AUCs and bootstrapped AUCs, in parallel if requested. Each
+    # parameter gets its own random seed drawn from the main seed, so the
+    # results do not depend on the number of processes.
+    random_state = np.random.RandomState(args.seed)
+    seeds = random_state.randint(0, 2**31-1, len(Params))
+    valid = [i for i, x in enumerate(X) if not np.any(np.isnan(x))]
+    f = partial(get_auc, autoflip=args.autoflip, nboot=args.nboot,
+                delong=args.delong)
+    tasks = [(Y[i], X[i], seeds[i]) for i in valid]
+    if args.jobs == 1:
+        results = [f(x) for x in tasks]
+    else:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            results = pool.map(f, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    results = dict(zip(valid, results))
+
     # Print AUCs and bootstrapped AUCs.
     if args.verbose > 1:
         print('# param  AUC  AUC_BS_mean  lower  upper')
-    Auc_bs = []
     params_maxlen = max(len(p) for p in Params)
-    d = dict(l=params_maxlen)
-    for x, y, param in zip(X, Y, Params):
-        d['param'] = param
+    for i, param in enumerate(Params):
+        d = dict(results.get(i, dict(auc=np.nan)), param=param,
+                 l=params_maxlen)
         s = '{param:{l}}  {auc:.3f}'
-        if np.any(np.isnan(x)):
-            d['auc'] = np.nan
-            print(s.format(**d))
-            continue
-        # Scaling may be required for correct results.
-        x = dwi.stats.scale_standard(x)
-        d.update(dwi.stats.roc_auc(y, x, autoflip=args.autoflip,
-                                   nboot=args.nboot))
-        if args.nboot:
-            Auc_bs.append(d.pop('aucs'))
+        if i in results and (args.delong or args.nboot):
             s += '  {ci1:.3f}  {ci2:.3f}'
         print(s.format(**d))
 
-    # Print bootstrapped AUC comparisons.
-    if args.nboot and args.compare:
+    # Print AUC comparisons, all pairs at once.
+    if args.compare and (args.delong or args.nboot):
+        if args.delong:
+            if not all(np.array_equal(Y[0], y) for y in Y):
+                raise ValueError('DeLong comparison needs the same samples')
+            X_valid = [-X[i] if results[i]['flipped'] else X[i] for i in
+                       valid]
+            X_valid = [dwi.stats.scale_standard(x) for x in X_valid]
+            aucs, cov = dwi.stats.delong_cov(Y[0], np.array(X_valid))
+            D, Z, P = dwi.stats.compare_aucs_delong(aucs, cov)
+        else:
+            aucs = np.array([results[i]['aucs'] for i in valid])
+            D, Z, P = dwi.stats.compare_aucs_matrix(aucs)
         if args.verbose > 1:
             print('# param1  param2  diff  Z  p')
-        done = []
-        for i, param_i in enumerate(Params):
-            for j, param_j in enumerate(Params):
-                if i == j or (i, j) in done or (j, i) in done:
-                    continue
-                done.append((i, j))
-                d, z, p = dwi.stats.compare_aucs(Auc_bs[i], Auc_bs[j])
-                s = '{pi:{l}}  {pj:{l}}  {d:+.4f}  {z:+.4f}  {p:.4f}'
-                print(s.format(pi=param_i, pj=param_j, d=d, z=z, p=p,
-                               l=params_maxlen))
+        s = '{pi:{l}}  {pj:{l}}  {d:+.4f}  {z:+.4f}  {p:.4f}'
+        for a, b in combinations(range(len(valid)), 2):
+            print(s.format(pi=Params[valid[a]], pj=Params[valid[b]],
+                           d=D[a, b], z=Z[a, b], p=P[a, b], l=params_maxlen))
 
     # Plot the ROCs.
     if args.figure:
@@ -7,6 +7,8 @@ See Nyul et al. 2000: New variants of a method of MRI scale standardization.
 
 from __future__ import absolute_import, division, print_function
 import argparse
+from functools import partial
+import multiprocessing
 
 import numpy as np
 
@@ -40,41 +42,69 @@ def parse_args():
                    help='thresholding strategy (none, mean, median)')
     p.add_argument('--mask',
                    help='mask file for selecting foreground during transform')
+    p.add_argument('--update', action='store_true',
+                   help='train: add inputs to existing configuration')
+    p.add_argument('--bins', type=int, default=2**16,
+                   help='train: histogram bins for non-integer images')
+    p.add_argument('--jobs', '-j', type=int, default=1,
+                   help='train: number of parallel processes')
     return p.parse_args()
 
 
-def get_stats(pc, scale, landmarks, img, thresholding):
-    """Gather info from single image."""
-    p, scores = dwi.standardize.landmark_scores(img, pc, landmarks,
-                                                thresholding)
+def get_stats(pc, scale, landmarks, thresholding, bins, inpath):
+    """Gather info from single image, streaming it from disk."""
+    img, _ = dwi.files.read_pmap(inpath, ondisk=True)
+    if img.shape[-1] != 1:
+        raise Exception('Incorrect shape: {}'.format(inpath))
+    p, scores = dwi.standardize.landmark_scores_stream(img, pc, landmarks,
+                                                       thresholding,
+                                                       bins=bins)
     p1, p2 = p
     s1, s2 = scale
     mapped_scores = [dwi.standardize.map_onto_scale(p1, p2, s1, s2, x) for x in
                      scores]
     mapped_scores = [int(x) for x in mapped_scores]
-    return dict(p=p, scores=scores, mapped_scores=mapped_scores)
-
-
-def train(pc, scale, landmarks, inpaths, cfgpath, thresholding, verbose):
-    """Training phase."""
-    data = []
-    for inpath in inpaths:
-        img, _ = dwi.files.read_pmap(inpath)
-        if img.shape[-1] != 1:
-            raise Exception('Incorrect shape: {}'.format(inpath))
-        d = get_stats(pc, scale, landmarks, img, thresholding)
-        if verbose:
-            # print(img.shape, dwi.util.fivenum(img), inpath)
-            # print(d['p'], d['scores'], inpath)
-            print(img.shape, d['mapped_scores'], inpath)
-        data.append(d)
-    mapped_scores = np.array([x['mapped_scores'] for x in data], dtype=np.int)
-    mapped_scores = np.mean(mapped_scores, axis=0, dtype=mapped_scores.dtype)
-    mapped_scores = list(mapped_scores)
+    return dict(p=p, scores=scores, mapped_scores=mapped_scores,
+                shape=img.shape)
+
+
+def train(pc, scale, landmarks, inpaths, cfgpath, thresholding, verbose,
+          update=False, bins=2**16, jobs=1):
+    """Training phase. With update, the inputs are added to an existing
+    configuration, which knows the sums of its mapped scores.
+    """
+    if update:
+        cfg = dwi.standardize.read_std_cfg(cfgpath)
+        if 'n' not in cfg:
+            raise Exception('Configuration cannot be updated: {}'.format(
+                cfgpath))
+        pc, landmarks, scale = cfg['pc'], cfg['landmarks'], cfg['scale']
+        thresholding = cfg['thresholding']
+        n, sums = cfg['n'], np.array(cfg['sums'], dtype=np.int64)
+    else:
+        n, sums = 0, np.zeros(len(landmarks), dtype=np.int64)
+    f = partial(get_stats, pc, scale, landmarks, thresholding, bins)
+    if jobs == 1:
+        data = [f(x) for x in inpaths]
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            data = pool.map(f, inpaths, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if verbose:
+        for d, inpath in zip(data, inpaths):
+            print(d['shape'], d['mapped_scores'], inpath)
+    mapped_scores = np.array([x['mapped_scores'] for x in data],
+                             dtype=np.int64)
+    n += len(mapped_scores)
+    sums += np.sum(mapped_scores, axis=0)
+    mapped_scores = list((sums / n).astype(np.int64))
     if verbose:
         print(mapped_scores)
     dwi.standardize.write_std_cfg(cfgpath, pc, landmarks, scale, mapped_scores,
-                                  thresholding)
+                                  thresholding, n=n, sums=list(sums))
 
 
 def transform(cfgpath, inpath, outpath, maskpath, verbose):
@@ -106,7 +136,8 @@ def main():
     if args.train:
         cfgpath, inpaths = args.train[0], args.train[1:]
         train(args.pc, args.scale, DEF_CFG['landmarks'], inpaths, cfgpath,
-              args.thresholding, args.verbose)
+              args.thresholding, args.verbose, update=args.update,
+              bins=args.bins, jobs=args.jobs)
 
     if args.transform:
         cfgpath, inpath, outpath = args.transform